@@ -3,7 +3,11 @@ from flask_login import LoginManager
 from scheduler import init_scheduler, validate_interval_string
 from functools import wraps
 from file_watcher import Watcher
+from download_server import DownloadServer
 import threading
+import subprocess
+import signal
+import atexit
 import logging
 import sys
 import copy
@@ -18,47 +22,183 @@ from auth import *
 import titles as titles_lib
 from utils import *
 from library import *
+from downloads import send_library_file, send_decompressed_file, download_activity
+from mover import file_mover
+from compressor import Compressor
+from verifier import Verifier
+from tasks import register_task_handler, set_local_tasks, submit_task, process_pending_tasks
+from leader import LeaderElector
+from shared_cache import shop_cache, update_shop_cache
 import titledb
 import os
 from clients import CyberFoilClient, TinfoilClient, SphairaClient
 
 def init():
+    global leader_elector
+    # Load initial configuration
+    logger.info('Loading initial configuration...')
+    reload_conf()
+
+    # Background tasks submitted by requests, run by the leader process
+    register_task_handler('library_change', post_full_library_change)
+    register_task_handler('sync_libraries', sync_libraries)
+    register_task_handler('update_titledb', update_titledb)
+    register_task_handler('reschedule_update_and_scan', reschedule_update_and_scan_job)
+    register_task_handler('scan_library', run_library_scan)
+    register_task_handler('library_files_moved', on_library_files_moved)
+
+    # Initialize and schedule jobs
+    logger.info('Initializing Scheduler...')
+    init_scheduler(app)
+    app.scheduler.add_job(
+        job_id='flush_download_counts',
+        func=flush_download_counts,
+        interval=timedelta(seconds=DOWNLOAD_COUNT_FLUSH_INTERVAL),
+        quiet=True
+    )
+    app.scheduler.add_job(
+        job_id='download_activity_heartbeat',
+        func=download_activity.heartbeat,
+        interval=timedelta(seconds=DOWNLOAD_ACTIVITY_HEARTBEAT_INTERVAL),
+        quiet=True
+    )
+
+    # Only one of the Ownfoil processes sharing the database runs the background services
+    leader_elector = LeaderElector(app, start_background_services, stop_background_services)
+    leader_elector.start()
+
+def start_background_services():
     global watcher
     global watcher_thread
+    global download_server
+    global download_server_thread
+    global compressor
+    global verifier
     # Create and start the file watcher
     logger.info('Initializing File Watcher...')
-    watcher = Watcher(on_library_change)
+    watcher = Watcher(on_library_change, app_settings['library']['watcher'], known_files=get_known_library_files)
     watcher_thread = threading.Thread(target=watcher.run)
     watcher_thread.daemon = True
     watcher_thread.start()
 
-    # Load initial configuration
-    logger.info('Loading initial configuration...')
     reload_conf()
+    set_local_tasks(True)
 
     # init libraries
     library_paths = app_settings['library']['paths']
     init_libraries(app, watcher, library_paths)
 
-    # Initialize and schedule jobs
-    logger.info('Initializing Scheduler...')
-    init_scheduler(app)
     scan_interval_str = app_settings.get('scheduler', {}).get('scan_interval', '12h')
     schedule_update_and_scan_job(app, scan_interval_str, run_first=True, run_once=True)
+    app.scheduler.add_job(
+        job_id='process_background_tasks',
+        func=process_pending_tasks,
+        interval=timedelta(seconds=BACKGROUND_TASKS_INTERVAL),
+        quiet=True
+    )
+    app.scheduler.add_job(
+        job_id='resume_libraries',
+        func=resume_libraries_job,
+        interval=timedelta(seconds=LIBRARY_RESUME_CHECK_INTERVAL),
+        quiet=True
+    )
+
+    # Compress the library files in the background, if enabled
+    compressor = Compressor(app, watcher, on_library_files_compressed)
+    compressor.start()
+
+    # Verify the integrity of the library files in the background, if enabled
+    verifier = Verifier(app)
+    verifier.start()
+
+    # Start the download server
+    server_settings = app_settings['downloads']['server']
+    if server_settings['enabled']:
+        logger.info('Initializing Download Server...')
+        download_server = DownloadServer(app, server_settings['host'], server_settings['port'])
+        download_server_thread = threading.Thread(target=download_server.run)
+        download_server_thread.daemon = True
+        download_server_thread.start()
+
+    # Share the current library and shop indexes with all processes
+    try:
+        with app.app_context():
+            update_shop_cache(generate_library())
+    except Exception as e:
+        # i.e. TitleDB not downloaded yet, the cache is written after the first library scan
+        logger.warning(f'Shop cache not updated at startup: {e}')
+
+def stop_background_services():
+    global watcher
+    global download_server
+    global compressor
+    global verifier
+    set_local_tasks(False)
+    # A pending library pipeline run would use the stopped services
+    post_library_change.cancel()
+    app.scheduler.remove_job('update_db_and_scan')
+    app.scheduler.remove_job('process_background_tasks')
+    app.scheduler.remove_job('resume_libraries')
+    if compressor:
+        compressor.stop()
+        compressor = None
+        logger.debug('Compressor terminated.')
+    if verifier:
+        verifier.stop()
+        verifier = None
+        logger.debug('Verifier terminated.')
+    # Moves to other filesystems in progress complete with the watcher still ignoring their events
+    file_mover.drain()
+    logger.debug('File mover drained.')
+    if watcher:
+        watcher.stop()
+        watcher_thread.join()
+        watcher = None
+        logger.debug('Watcher thread terminated.')
+    if download_server:
+        download_server.stop()
+        download_server_thread.join()
+        download_server = None
+        logger.debug('Download server terminated.')
+
+def init_worker():
+    """Initialize a request-serving worker process, background services run in the main process."""
+    init_db_engine(app)
+    reload_conf()
+    # Download counts recorded by this worker are written periodically and on exit
+    init_scheduler(app)
+    app.scheduler.add_job(
+        job_id='flush_download_counts',
+        func=flush_download_counts,
+        interval=timedelta(seconds=DOWNLOAD_COUNT_FLUSH_INTERVAL),
+        quiet=True
+    )
+    app.scheduler.add_job(
+        job_id='download_activity_heartbeat',
+        func=download_activity.heartbeat,
+        interval=timedelta(seconds=DOWNLOAD_ACTIVITY_HEARTBEAT_INTERVAL),
+        quiet=True
+    )
+    atexit.register(flush_download_counts_on_exit)
+
+def flush_download_counts_on_exit():
+    with app.app_context():
+        flush_download_counts()
 
 os.makedirs(CONFIG_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
 ## Global variables
 app_settings = {}
+leader_elector = None
 watcher = None
 watcher_thread = None
-# Create a global variable and lock for scan_in_progress
-scan_in_progress = False
+download_server = None
+download_server_thread = None
+compressor = None
+verifier = None
+# Held while a library scan is in progress, shared by the scan API and the scheduled job
 scan_lock = threading.Lock()
-# Global flag for titledb update status
-is_titledb_update_running = False
-titledb_update_lock = threading.Lock()
 
 # Configure logging
 formatter = ColoredFormatter(
@@ -85,37 +225,53 @@ logging.getLogger('alembic.runtime.migration').setLevel(logging.WARNING)
 
 @login_manager.user_loader
 def load_user(user_id):
-    # since the user_id is just the primary key of our user table, use it in the query for the user
-    return User.query.filter_by(id=user_id).first()
+    # since the user_id is just the primary key of our user table, use it to get the cached user
+    return get_user(user_id)
 
 def reload_conf():
     global app_settings
     global watcher
     app_settings = load_settings()
 
+def get_known_library_files(directory, recursive=False):
+    # Previous state of the directories polled by the watcher
+    with app.app_context():
+        return get_file_sizes_in_directory(directory, recursive)
+
 def on_library_change(events):
     # TODO refactor: group modified and created together
     with app.app_context():
         created_events = [e for e in events if e.type == 'created']
         modified_events = [e for e in events if e.type != 'created']
+        deleted_filepaths = {}  # library path -> deleted file paths
 
         for event in modified_events:
             if event.type == 'moved':
                 if file_exists_in_db(event.src_path):
                     # update the path
                     update_file_path(event.directory, event.src_path, event.dest_path)
+                    library_changes.add_files([event.dest_path])
                 else:
                     # add to the database
                     event.src_path = event.dest_path
                     created_events.append(event)
 
             elif event.type == 'deleted':
-                # delete the file from library if it exists
-                delete_file_by_filepath(event.src_path)
+                deleted_filepaths.setdefault(event.directory, []).append(event.src_path)
 
             elif event.type == 'modified':
                 # can happen if file copy has started before the app was running
                 add_files_to_library(event.directory, [event.src_path])
+                library_changes.add_files([event.src_path])
+
+        for library_path, filepaths in deleted_filepaths.items():
+            # A vanished library root reports the deletion of all its files
+            if not check_library_available(library_path):
+                continue
+            try:
+                library_changes.add_titles(delete_files_by_filepaths(filepaths))
+            except Exception as e:
+                logger.error(f'Error removing deleted files of {library_path}: {e}')
 
         if created_events:
             directories = list(set(e.directory for e in created_events))
@@ -123,7 +279,7 @@ def on_library_change(events):
                 new_files = [e.src_path for e in created_events if e.directory == library_path]
                 add_files_to_library(library_path, new_files)
 
-    post_library_change()
+    post_library_change('library files changed')
 
 def create_app():
     app = Flask(__name__)
@@ -304,8 +460,7 @@ def set_titles_settings_api():
     if region != app_settings['titles']['region'] or language != app_settings['titles']['language']:
         set_titles_settings(region, language)
         reload_conf()
-        titledb.update_titledb(app_settings)
-        post_library_change()
+        submit_task('update_titledb')
 
     resp = {
         'success': True,
@@ -328,13 +483,13 @@ def set_shop_settings_api():
 @app.route('/api/settings/library/paths', methods=['GET', 'POST', 'DELETE'])
 @access_required('admin')
 def library_paths_api():
-    global watcher
     if request.method == 'POST':
         data = request.json
-        success, errors = add_library_complete(app, watcher, data['path'])
+        success, errors = add_library_path_to_settings(data['path'])
         if success:
             reload_conf()
-            post_library_change()
+            submit_task('sync_libraries')
+            submit_task('library_change', reason='library paths changed')
         resp = {
             'success': success,
             'errors': errors
@@ -348,10 +503,11 @@ def library_paths_api():
         }
     elif request.method == 'DELETE':
         data = request.json
-        success, errors = remove_library_complete(app, watcher, data['path'])
+        success, errors = delete_library_path_from_settings(data['path'])
         if success:
             reload_conf()
-            post_library_change()
+            submit_task('sync_libraries')
+            submit_task('library_change', reason='library paths changed')
         resp = {
             'success': success,
             'errors': errors
@@ -364,7 +520,7 @@ def set_library_management_settings_api():
     data = request.json
     set_library_management_settings(data)
     reload_conf()
-    post_library_change()
+    submit_task('library_change', reason='library management settings changed')
     resp = {
         'success': True,
         'errors': []
@@ -389,18 +545,23 @@ def set_scheduler_settings_api():
     reload_conf()
 
     if scan_interval_str is not None:
-        try:
-            current_interval_str = app_settings.get('scheduler', {}).get('scan_interval', '12h')
-            schedule_update_and_scan_job(app, current_interval_str, run_first=False)
-        except Exception as e:
-            logger.error(f"Error updating scheduler: {e}")
-            return jsonify({
-                'success': False,
-                'errors': [{'path': 'scheduler', 'error': str(e)}]
-            })
+        submit_task('reschedule_update_and_scan')
 
     return jsonify({'success': True, 'errors': []})
 
+@app.get('/api/scheduler/jobs')
+@access_required('admin')
+def get_scheduler_jobs_api():
+    """Latest recorded job runs, and the scheduled jobs when this process runs the background services"""
+    job_id = request.args.get('job_id')
+    limit = request.args.get('limit', JOB_RUNS_HISTORY_SIZE, type=int)
+    runs_background_services = leader_elector is not None and leader_elector.is_leader
+    return jsonify({
+        'success': True,
+        'jobs': app.scheduler.get_jobs() if runs_background_services else None,
+        'runs': get_job_runs(job_id, limit)
+    })
+
 @app.post('/api/upload')
 @access_required('admin')
 def upload_file():
@@ -415,7 +576,7 @@ def upload_file():
             logger.info(f'Validating {file.filename}...')
             valid_keys, missing_keys, corrupt_keys = load_keys(KEYS_FILE)
             if valid_keys:
-                post_library_change()
+                submit_task('library_change', reason='keys uploaded')
             else:
                 logger.warning(f'Invalid keys from {file.filename}')
             success = True
@@ -444,8 +605,11 @@ def upload_file():
 @app.route('/api/titles', methods=['GET'])
 @access_required('shop')
 def get_all_titles_api():
-    titles_library = generate_library()
+    library_json = shop_cache.get('library')
+    if library_json is not None:
+        return Response(library_json, mimetype='application/json')
 
+    titles_library = generate_library()
     return jsonify({
         'total': len(titles_library),
         'games': titles_library
@@ -456,57 +620,141 @@ def get_all_titles_api():
 def serve_game(id):
     """Serve a game file to authenticated clients."""
     filepath = db.session.query(Files.filepath).filter_by(id=id).first()[0]
-    filedir, filename = os.path.split(filepath)
     increment_download_count_throttled(filepath, request.remote_addr)
-    return send_from_directory(filedir, filename)
+    return send_library_file(id, filepath, app_settings)
 
+@app.route('/api/get_game/<int:id>/nsp')
+@file_access
+def serve_decompressed_game(id):
+    """Serve a NSZ file decompressed to NSP, for clients that cannot install compressed files."""
+    file = db.session.query(Files.filepath, Files.extension).filter_by(id=id).first()
+    if not app_settings['downloads']['decompressed_nsp'] or file is None or file.extension != 'nsz':
+        return jsonify({'error': 'Not found.'}), 404
+    increment_download_count_throttled(file.filepath, request.remote_addr)
+    return send_decompressed_file(file.filepath)
+
+
+def merge_library_change_reasons(previous_call, call):
+    """Keep the reasons of all the library changes handled by a single run"""
+    (previous_reasons, _), (reasons, kwargs) = previous_call, call
+    return tuple(dict.fromkeys(previous_reasons + reasons)), kwargs
+
+@debounce(10, key='post_library_change', merge=merge_library_change_reasons)
+def post_library_change(*reasons):
+    """
+    Run the library pipeline, from identification to the shop cache update.
+    Only one run is in progress at a time and changes during a run are handled by a single following run.
+    """
+    if leader_elector is None or not leader_elector.is_leader:
+        # Demoted since the call, the changes are processed by the new leader
+        logger.debug('Library changes not processed, background services are not running in this process.')
+        return
+    logger.info(f"Processing library changes ({', '.join(reasons) or 'unknown reason'})...")
+    # Each stage only processes the changed files and titles, or the whole library on full runs
+    changes = library_changes.pop()
+    if not (changes.full or changes.check_existence or changes.filepaths or changes.title_ids):
+        logger.info('No library changes to process.')
+        return
+    filepaths = None if changes.full else changes.filepaths
+    title_ids = None if changes.full else set(changes.title_ids)
 
-@debounce(10, key='post_library_change')
-def post_library_change():
-    with app.app_context():
-        titles_lib.load_titledb()
-        process_library_identification(app)
-        add_missing_apps_to_db()
-        # remove missing files
-        remove_missing_files_from_db()
-        update_titles() # Ensure titles are updated after identification
-        process_library_organization(app, watcher) # Pass the watcher instance to skip organizer move/delete events
-        # The process_library_identification already handles updating titles and generating library
-        # So, we just need to ensure titles_library is updated from the generated library
-        generate_library()
-        titles_lib.identification_in_progress_count -= 1
-        titles_lib.unload_titledb()
+    try:
+        with app.app_context():
+            titles_lib.load_titledb()
+            identified_title_ids = process_library_identification(app, filepaths)
+            if changes.full:
+                update_decompressed_sizes()
+            if title_ids is not None:
+                title_ids |= identified_title_ids
+            add_missing_apps_to_db(title_ids)
+            # remove missing files, changes reported by the watcher are already applied
+            if changes.full or changes.check_existence:
+                missing_title_ids = remove_missing_files_from_db(get_available_library_ids())
+                if title_ids is not None:
+                    title_ids |= missing_title_ids
+            update_titles(title_ids) # Ensure titles are updated after identification
+            process_library_organization(app, watcher, filepaths, title_ids) # Pass the watcher instance to skip organizer move/delete events
+            if compressor and (changes.full or filepaths):
+                compressor.request_run()
+            if verifier and (changes.full or filepaths):
+                verifier.request_run()
+            # The process_library_identification already handles updating titles and generating library
+            # So, we just need to ensure titles_library is updated from the generated library
+            # and shared with all processes along with the shop indexes
+            update_shop_cache(generate_library())
+            titles_lib.identification_in_progress_count -= 1
+            titles_lib.unload_titledb()
+    except Exception:
+        # Processed again by the next run
+        library_changes.restore(changes)
+        raise
+
+def on_library_files_moved(filepaths):
+    """Files moved by the organizer in the background, i.e. to another filesystem"""
+    library_changes.add_files(filepaths)
+    post_library_change('organizer moves completed')
+
+def on_library_files_compressed(filepaths):
+    library_changes.add_files(filepaths)
+    post_library_change('library files compressed')
+
+def post_full_library_change(reason):
+    """Run the library pipeline over the whole library, i.e. after a settings, keys or TitleDB change"""
+    library_changes.request_full_run()
+    post_library_change(reason)
+
+@app.get('/api/library/organizer/plan')
+@access_required('admin')
+def get_library_organizer_plan_api():
+    """Moves the organizer would make with the current settings, and the last applied plan"""
+    # By default files unchanged since they were last organized are not evaluated, as in the library pipeline
+    all_files = request.args.get('all', 'false').lower() in ('1', 'true')
+    try:
+        moves = get_library_organization_plan(app, all_files)
+    except Exception as e:
+        logger.error(f'Error computing organization plan: {e}')
+        return jsonify({'success': False, 'errors': [str(e)]})
+    return jsonify({
+        'success': True,
+        'moves': moves,
+        'last_plan': load_organization_plan(),
+        'moves_in_progress': file_mover.get_progress()
+    })
 
-@app.post('/api/library/scan')
+@app.get('/api/library/watcher')
 @access_required('admin')
-def scan_library_api():
-    data = request.json
-    path = data['path']
-    success = True
-    errors = []
+def get_library_watcher_api():
+    """Watcher mode and polling cost of each library, when this process runs the background services"""
+    return jsonify({
+        'success': True,
+        'libraries': watcher.get_stats() if watcher else None
+    })
 
-    global scan_in_progress
-    with scan_lock:
-        if scan_in_progress:
-            logger.info('Skipping scan_library_api call: Scan already in progress')
-            return {'success': False, 'errors': []}
-    # Set the scan status to in progress
-    scan_in_progress = True
+@app.get('/api/library/compression')
+@access_required('admin')
+def get_library_compression_api():
+    """File being compressed and number of files that could not be compressed, when this process runs the background services"""
+    return jsonify({
+        'success': True,
+        'compression': compressor.get_status() if compressor else None
+    })
 
-    try:
-        if path is None:
-            scan_library()
-        else:
-            scan_library_path(path)
-    except Exception as e:
-        errors.append(e)
-        success = False
-        logger.error(f"Error during library scan: {e}")
-    finally:
-        with scan_lock:
-            scan_in_progress = False
+@app.get('/api/library/verification')
+@access_required('admin')
+def get_library_verification_api():
+    """Files whose integrity verification failed, and files being verified when this process runs the background services"""
+    return jsonify({
+        'success': True,
+        'failures': get_verification_failures(),
+        'verification': verifier.get_status() if verifier else None
+    })
 
-    post_library_change()
+@app.post('/api/library/scan')
+@access_required('admin')
+def scan_library_api():
+    data = request.json
+    # The scan result is only known when running in the background services process
+    success, errors = submit_task('scan_library', path=data['path']) or (True, [])
     resp = {
         'success': success,
         'errors': errors
@@ -521,21 +769,46 @@ def scan_library_api():
 #     for header, value in request.headers:
 #         logger.debug(f"Header: {header} = {value}")
 
+def run_library_scan(path=None):
+    """Scan the whole library or a single library path, returns (success, errors)"""
+    if not scan_lock.acquire(blocking=False):
+        logger.info('Skipping library scan: Scan already in progress')
+        return False, []
+
+    success = True
+    errors = []
+    library_changes.request_existence_check()
+    try:
+        if path is None:
+            scan_library()
+        else:
+            scan_library_path(path)
+    except Exception as e:
+        errors.append(str(e))
+        success = False
+        logger.error(f"Error during library scan: {e}")
+    finally:
+        scan_lock.release()
+
+    post_library_change('library scan')
+    return success, errors
+
 def scan_library():
+    """Scan all library paths, returns the number of new files"""
     logger.info(f'Scanning whole library ...')
     libraries = get_libraries()
+    new_files = 0
     for library in libraries:
-        scan_library_path(library.path) # Only scan, identification will be done globally
+        if library.path in suspended_libraries:
+            logger.info(f'Skipping scan of suspended library {library.path}.')
+            continue
+        new_files += scan_library_path(library.path) # Only scan, identification will be done globally
+    return new_files
 
 def update_and_scan_job():
-    """Combined job: updates TitleDB then scans library"""
+    """Combined job: updates TitleDB then scans library, returns the number of new files"""
     logger.info("Running update job (TitleDB update and library scan)...")
-    global scan_in_progress
-    
-    # Update TitleDB with locking
-    with titledb_update_lock:
-        is_titledb_update_running = True
-    
+
     logger.info("Starting TitleDB update...")
     try:
         settings = load_settings()
@@ -543,35 +816,39 @@ def update_and_scan_job():
         logger.info("TitleDB update completed.")
     except Exception as e:
         logger.error(f"Error during TitleDB update: {e}")
-    finally:
-        with titledb_update_lock:
-            is_titledb_update_running = False
-    
-    # Check if update is still running before scanning
-    with titledb_update_lock:
-        if is_titledb_update_running:
-            logger.info("Skipping library scan: TitleDB update still in progress.")
-            return
-    
-    # Scan library with locking
+
+    # The job itself never overlaps (see schedule_update_and_scan_job), but a scan may have been requested meanwhile
     logger.info("Starting library scan...")
-    with scan_lock:
-        if scan_in_progress:
-            logger.info('Skipping library scan: scan already in progress.')
-            return
-        scan_in_progress = True
-    
+    if not scan_lock.acquire(blocking=False):
+        logger.info('Skipping library scan: scan already in progress.')
+        return 0
+
+    new_files = 0
     try:
-        scan_library()
-        post_library_change()
+        new_files = scan_library()
+        # TitleDB may have been updated
+        post_full_library_change('scheduled library scan')
         logger.info("Library scan completed.")
     except Exception as e:
         logger.error(f"Error during library scan: {e}")
     finally:
-        with scan_lock:
-            scan_in_progress = False
-    
+        scan_lock.release()
+
     logger.info("Update job completed.")
+    return new_files
+
+def resume_libraries_job():
+    """Resume the suspended libraries available again and add the files changed meanwhile"""
+    if not suspended_libraries:
+        return 0
+    resumed = resume_libraries(app, watcher)
+    if resumed:
+        with app.app_context():
+            for library_path in resumed:
+                scan_library_path(library_path)
+        library_changes.request_existence_check()
+        post_library_change('library available again')
+    return len(resumed)
 
 def schedule_update_and_scan_job(app: Flask, interval_str: str, run_first: bool = True, run_once: bool = False):
     """Schedule or update the update_and_scan job"""
@@ -580,9 +857,58 @@ def schedule_update_and_scan_job(app: Flask, interval_str: str, run_first: bool
         interval_str=interval_str,
         func=update_and_scan_job,
         run_first=run_first,
-        run_once=run_once
+        run_once=run_once,
+        overlap='skip',
+        timeout=timedelta(seconds=UPDATE_AND_SCAN_JOB_TIMEOUT)
     )
 
+def reschedule_update_and_scan_job():
+    reload_conf()
+    scan_interval_str = app_settings.get('scheduler', {}).get('scan_interval', '12h')
+    schedule_update_and_scan_job(app, scan_interval_str, run_first=False)
+
+def sync_libraries():
+    """Apply the configured library paths to the database and the file watcher"""
+    reload_conf()
+    init_libraries(app, watcher, app_settings['library']['paths'])
+
+def update_titledb():
+    reload_conf()
+    titledb.update_titledb(app_settings)
+    post_full_library_change('TitleDB updated')
+
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+def run_production_server():
+    """
+    Serve requests with gunicorn worker processes (see wsgi.py), while this process
+    runs the watcher, scheduler and library pipeline when elected leader.
+    """
+    host = os.environ.get('OWNFOIL_HOST', '0.0.0.0')
+    port = os.environ.get('OWNFOIL_PORT', '8465')
+    workers = os.environ.get('OWNFOIL_WORKERS', str(DEFAULT_SERVER_WORKERS))
+    threads = os.environ.get('OWNFOIL_THREADS', str(DEFAULT_SERVER_THREADS))
+    logger.info(f'Starting gunicorn with {workers} workers and {threads} threads per worker on {host}:{port}...')
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn',
+        '--chdir', APP_DIR,
+        '--bind', f'{host}:{port}',
+        '--workers', workers,
+        '--threads', threads,
+        '--worker-class', 'gthread',
+        '--access-logfile', '-',
+        'wsgi:app'
+    ])
+
+    # Forward termination to gunicorn, then shut down the background services
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.terminate())
+    try:
+        server.wait()
+    except KeyboardInterrupt:
+        server.terminate()
+        server.wait()
+
 
 if __name__ == '__main__':
     logger.info('Starting initialization of Ownfoil...')
@@ -590,12 +916,19 @@ if __name__ == '__main__':
     init_users(app)
     init()
     logger.info('Initialization steps done, starting server...')
-    app.run(debug=False, use_reloader=False, host="0.0.0.0", port=8465)
+    if os.environ.get('OWNFOIL_SERVER', 'flask').lower() == 'gunicorn':
+        run_production_server()
+    else:
+        # Stop the development server on SIGTERM like on Ctrl+C, so the shutdown below runs
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        app.run(debug=False, use_reloader=False, host=os.environ.get('OWNFOIL_HOST', '0.0.0.0'), port=int(os.environ.get('OWNFOIL_PORT', 8465)))
     # Shutdown server
     logger.info('Shutting down server...')
-    watcher.stop()
-    watcher_thread.join()
-    logger.debug('Watcher thread terminated.')
+    # Stop background services and hand over the leadership
+    leader_elector.stop()
     # Shutdown scheduler
     app.scheduler.shutdown()
     logger.debug('Scheduler terminated.')
+    # Write pending download counts
+    with app.app_context():
+        flush_download_counts()
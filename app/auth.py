@@ -3,14 +3,81 @@ from flask_login import login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from db import *
+from utils import TTLCache
 from flask_login import LoginManager
 
+import hashlib
+import hmac
 import logging
 import re
+import os
+import secrets
 
 # Retrieve main logger
 logger = logging.getLogger('main')
 
+# Successfully verified Basic auth credentials, to avoid a scrypt check on every (range) request.
+# Entries are keyed by a keyed hash of the Authorization header, the key being random per process.
+_verified_credentials = TTLCache(VERIFIED_CREDENTIALS_TTL, maxsize=1000)
+_verified_credentials_key = secrets.token_bytes(32)
+
+# Identity map of users by id and number of admin accounts, used on every authenticated request.
+# Cached users are detached from the database session and must be considered read-only.
+# They are cleared in every process when the users change, see `check_users_cache`.
+_users_cache = TTLCache(USERS_CACHE_TTL, maxsize=1000)
+_admin_accounts_cache = TTLCache(USERS_CACHE_TTL, maxsize=1)
+
+# Signature of USERS_CHANGED_FILE when the caches were last cleared, replaced on each change of the users
+_users_changed_signature = None
+
+def _get_credentials_cache_key(authorization_header):
+    return hmac.new(_verified_credentials_key, authorization_header.encode('utf-8'), hashlib.sha256).digest()
+
+def _clear_users_cache():
+    _users_cache.clear()
+    _admin_accounts_cache.clear()
+    _verified_credentials.clear()
+
+def _get_users_changed_signature():
+    try:
+        stat = os.stat(USERS_CHANGED_FILE)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+def check_users_cache():
+    """Clear the caches when the users were changed by another process, see `invalidate_users_cache`"""
+    global _users_changed_signature
+    signature = _get_users_changed_signature()
+    if signature != _users_changed_signature:
+        _clear_users_cache()
+        _users_changed_signature = signature
+
+def invalidate_users_cache():
+    """Clear the caches of all processes, call after changing the users"""
+    _clear_users_cache()
+    try:
+        os.makedirs(os.path.dirname(USERS_CHANGED_FILE), exist_ok=True)
+        # Replaced rather than touched, its inode changes even within the mtime granularity
+        tmp_path = f'{USERS_CHANGED_FILE}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w'):
+            pass
+        os.replace(tmp_path, USERS_CHANGED_FILE)
+    except OSError as e:
+        logger.error(f'Error notifying the other processes of the users change: {e}')
+
+def get_user(user_id):
+    user_id = int(user_id)
+    check_users_cache()
+    user = _users_cache.get(user_id)
+    if user is None:
+        user = User.query.filter_by(id=user_id).first()
+        if user is None:
+            return None
+        db.session.expunge(user)
+        _users_cache.set(user_id, user)
+    return user
+
 def validate_password(password):
     """
     Validate password according to Basic Auth specifications and Tinfoil compatibility.
@@ -80,7 +147,12 @@ def validate_username(username):
     return True, "Username is valid"
 
 def admin_account_created():
-    return len(User.query.filter_by(admin_access=True).all())
+    check_users_cache()
+    admin_accounts = _admin_accounts_cache.get('count')
+    if admin_accounts is None:
+        admin_accounts = User.query.filter_by(admin_access=True).count()
+        _admin_accounts_cache.set('count', admin_accounts)
+    return admin_accounts
 
 def unauthorized_json():
     response = login_manager.unauthorized()
@@ -139,6 +211,14 @@ def basic_auth(request):
         error = 'No authentication provided.'
         return success, error, user
 
+    cache_key = _get_credentials_cache_key(request.headers.get('Authorization', ''))
+    check_users_cache()
+    user_id = _verified_credentials.get(cache_key)
+    if user_id is not None:
+        user = get_user(user_id)
+        if user is not None:
+            return success, error, user
+
     username = auth.username
     password = auth.password
     user = User.query.filter_by(user=username).first()
@@ -150,6 +230,9 @@ def basic_auth(request):
         success = False
         error = f'Incorrect password for user {username}.'
 
+    else:
+        _verified_credentials.set(cache_key, user.id)
+
     return success, error, user
 
 auth_blueprint = Blueprint('auth', __name__)
@@ -185,6 +268,7 @@ def create_or_update_user(username, password, admin_access=False, shop_access=Fa
         new_user = User(user=username, password=generate_password_hash(password, method='scrypt'), admin_access=admin_access, shop_access=shop_access, backup_access=backup_access)
         db.session.add(new_user)
     db.session.commit()
+    invalidate_users_cache()
 
 def init_user_from_environment(environment_name, admin=False):
     """
@@ -273,6 +357,7 @@ def delete_user():
     try:
         User.query.filter_by(id=user_id).delete()
         db.session.commit()
+        invalidate_users_cache()
         logger.info(f'Successfully deleted user with id {user_id}.')
     except Exception as e:
         logger.error(f'Could not delete user with id {user_id}: {e}')
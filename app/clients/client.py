@@ -6,8 +6,9 @@ from abc import ABC, abstractmethod
 from flask import Request, Response
 from typing import Tuple, Optional, Dict, Any
 from functools import wraps
-from db import get_filtered_files
+from db import get_filtered_files, get_shop_file_entries
 from auth import basic_auth
+from shared_cache import shop_cache, get_shop_files_key, encode_json
 import logging
 
 logger = logging.getLogger('main')
@@ -145,6 +146,18 @@ class BaseClient(ABC):
         """Get filtered files from the database based on content type."""
         return get_filtered_files(content_filter)
 
+    def get_shop_files_json(self, content_filter: Optional[str] = None) -> bytes:
+        """Get the JSON encoded shop files list, from the shared cache when available."""
+        files_json = shop_cache.get(get_shop_files_key(content_filter))
+        if files_json is None:
+            decompressed_nsp = self.app_settings['downloads']['decompressed_nsp']
+            files_json = encode_json(get_shop_file_entries(self.get_filtered_files(content_filter), decompressed_nsp))
+        return files_json
+
+    def encode_shop(self, shop: dict, files_json: bytes) -> bytes:
+        """Encode the shop response in JSON, inserting the already encoded files list."""
+        return encode_json(shop)[:-1] + b',"files":' + files_json + b'}'
+
     def log_info(self, message: str):
         """Log an info message with client context."""
         logger.info(f"({self.CLIENT_NAME}) {message}")
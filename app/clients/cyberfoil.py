@@ -55,7 +55,6 @@ class CyberFoilClient(BaseClient):
         content_filter = paths[0] if paths and paths[0] in APP_TYPE_FILTERS else None
         # Build shop content
         shop = {"success": self.app_settings['shop']['motd']}
-        shop["files"] = self._generate_shop_files(content_filter)
 
         # Get verified_host from auth_data
         verified_host = request.auth_data.get('verified_host')
@@ -64,7 +63,8 @@ class CyberFoilClient(BaseClient):
             shop["referrer"] = f"https://{verified_host}"
 
         # Serve the shop
-        return jsonify(shop)
+        shop_json = self.encode_shop(shop, self.get_shop_files_json(content_filter))
+        return Response(shop_json, mimetype='application/json')
 
     # ==================== Private/Helper Methods ====================
 
@@ -130,8 +130,3 @@ class CyberFoilClient(BaseClient):
             f"Connect to the shop from Cyberfoil with an admin account to set it."
         )
         return True, None, None
-
-    def _generate_shop_files(self, content_filter: Optional[str] = None) -> list:
-        """Generate the files list for the shop with optional content type filtering."""
-        files = self.get_filtered_files(content_filter)
-        return [{'url': f'/api/get_game/{f.id}#{f.filename}', 'size': f.size} for f in files]
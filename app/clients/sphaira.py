@@ -1,11 +1,14 @@
 """
 Sphaira client implementation.
 """
-from flask import Request, Response, request, send_from_directory
+from flask import Request, Response, request
 
 from .client import BaseClient
 from db import Files, Libraries, increment_download_count_throttled
 from constants import APP_TYPE_FILTERS, ALLOWED_EXTENSIONS
+from downloads import send_library_file
+from shared_cache import shop_cache, get_directory_listing_key
+import json
 
 SPHAIRA_DEFAULT_HEADERS = [
     'Host',
@@ -101,10 +104,20 @@ class SphairaClient(BaseClient):
         Serve a virtual directory listing by recreating folder structure.
         Strips library path from file paths and shows directories/files at current level.
         """
-        # Get all filtered files
-        all_files = self.get_filtered_files(content_filter)
         if content_filter:
             path = path[len(content_filter):].lstrip('/')
+
+        # Use the listing from the shared cache when available
+        if shop_cache.generation is not None:
+            listing = shop_cache.get(get_directory_listing_key(content_filter, path))
+            sorted_items = json.loads(listing) if listing is not None else []
+            if not sorted_items:
+                return self._serve_directory_listing(['No content available'])
+            return self._serve_directory_listing(sorted_items)
+
+        # Get all filtered files
+        all_files = self.get_filtered_files(content_filter)
+
         # Build virtual paths by stripping library paths
         virtual_items = set()
         
@@ -169,4 +182,4 @@ class SphairaClient(BaseClient):
         self.log_info(f"Serving file: {file.folder}/{filename}")
         increment_download_count_throttled(file.filepath, request.remote_addr)
 
-        return send_from_directory(file.folder, filename)
+        return send_library_file(file.id, file.filepath, self.app_settings)
@@ -3,7 +3,6 @@ Tinfoil client implementation.
 """
 from flask import Request, Response, jsonify
 from typing import Tuple, Optional, Dict, Any
-import json
 import random
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_OAEP, AES
@@ -72,7 +71,6 @@ class TinfoilClient(BaseClient):
         content_filter = paths[0] if paths and paths[0] in APP_TYPE_FILTERS else None
         # Build shop content
         shop = {"success": self.app_settings['shop']['motd']}
-        shop["files"] = self._generate_shop_files(content_filter)
 
         # Get verified_host from auth_data
         verified_host = request.auth_data.get('verified_host')
@@ -81,10 +79,11 @@ class TinfoilClient(BaseClient):
             shop["referrer"] = f"https://{verified_host}"
 
         # Serve the shop
+        shop_json = self.encode_shop(shop, self.get_shop_files_json(content_filter))
         if client_settings['encrypt']:
-            return Response(self._encrypt_shop(shop), mimetype='application/octet-stream')
+            return Response(self._encrypt_shop(shop_json), mimetype='application/octet-stream')
 
-        return jsonify(shop)
+        return Response(shop_json, mimetype='application/json')
 
     # ==================== Private/Helper Methods ====================
 
@@ -151,15 +150,8 @@ class TinfoilClient(BaseClient):
         )
         return True, None, None
 
-    def _generate_shop_files(self, content_filter: Optional[str] = None) -> list:
-        """Generate the files list for the shop with optional content type filtering."""
-        files = self.get_filtered_files(content_filter)
-        return [{'url': f'/api/get_game/{f.id}#{f.filename}', 'size': f.size} for f in files]
-
-    def _encrypt_shop(self, shop: dict) -> bytes:
-        """Encrypt shop data for Tinfoil using RSA + AES encryption."""
-        input_data = json.dumps(shop).encode('utf-8')
-
+    def _encrypt_shop(self, input_data: bytes) -> bytes:
+        """Encrypt JSON encoded shop data for Tinfoil using RSA + AES encryption."""
         # Random 128-bit AES key (16 bytes), used later for symmetric encryption (AES)
         aes_key = random.randint(0, 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF).to_bytes(0x10, 'big')
 
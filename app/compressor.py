@@ -0,0 +1,273 @@
+from constants import *
+from db import get_next_file_to_compress, get_file_from_db, set_file_compressed, get_total_download_count
+from settings import load_settings
+from downloads import download_activity
+from decompression import get_decompressed_size
+from pathlib import Path
+import subprocess
+import sys
+import threading
+import shutil
+import json
+import os
+import logging
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+def get_compressed_filepath(filepath):
+    extension = os.path.splitext(filepath)[1].lower()
+    return os.path.splitext(filepath)[0] + COMPRESSED_EXTENSIONS[extension]
+
+def get_compression_directory(filepath):
+    """Directory the compressed file is written to, next to the original so that it can be renamed in place"""
+    return os.path.join(os.path.dirname(filepath), TEMPORARY_DIRECTORY_NAME)
+
+def compress_file(src, output_dir, level, threads, verify, block=False, keys_file=KEYS_FILE):
+    """
+    Compress a file with nsz to `output_dir`, returns the compressed file path. Run in a dedicated process, see `Compressor`.
+    Block compression allows decompressing any part of the file, i.e. when serving it decompressed.
+    """
+    from nsz.nut import Keys
+    from nsz.SolidCompressor import solidCompress
+    from nsz.BlockCompressor import blockCompress
+    from nsz.Decompressor import verify as verify_compressed
+    Keys.load(keys_file)
+
+    status_report = [None]
+    if block:
+        compressed_path = blockCompress(Path(src), level, False, False, False, COMPRESSION_BLOCK_SIZE_EXPONENT, Path(output_dir), threads, status_report, 0)
+    else:
+        compressed_path = solidCompress(Path(src), level, False, False, False, Path(output_dir), threads, status_report, 0, None)
+    if compressed_path is None:
+        raise RuntimeError('nsz did not create the compressed file')
+    if verify:
+        # Decompress in memory and compare the NCA hashes with the original file
+        verify_compressed(compressed_path, False, True, False, src, [status_report, 0], None)
+    return str(compressed_path)
+
+class Compressor:
+    """
+    Background compression of the library files (NSP to NSZ, XCI to XCZ) when `compress_files` is enabled.
+    Files are compressed one at a time in a separate process, to a temporary directory next to them, verified,
+    then renamed in place of the original file whose database entry is updated, keeping its identification.
+    Each step is recorded in COMPRESSION_STATE_FILE so that an interrupted compression is resumed or cleaned up
+    at the next start. Compression pauses while files are being downloaded.
+    """
+    def __init__(self, app, watcher, on_compressed):
+        self.app = app
+        self.watcher = watcher
+        self.on_compressed = on_compressed  # called with the paths of the compressed files
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._process = None
+        self._lock = threading.Lock()
+        self.thread = None
+        self.state = self._load_state()
+
+    def start(self):
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name='compressor')
+        self.thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                # The temporary file is cleaned up at the next start
+                self._process.terminate()
+        if self.thread:
+            self.thread.join()
+
+    def request_run(self):
+        """Look for files to compress, i.e. after a library change"""
+        self._wake.set()
+
+    def get_status(self):
+        return {
+            'current': self.state.get('current'),
+            'failed': len(self.state.get('failed', {})),
+        }
+
+    def _load_state(self):
+        try:
+            with open(COMPRESSION_STATE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'current': None, 'failed': {}}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(COMPRESSION_STATE_FILE), exist_ok=True)
+        tmp_path = COMPRESSION_STATE_FILE + TEMPORARY_FILE_SUFFIX
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, COMPRESSION_STATE_FILE)
+
+    def _run(self):
+        try:
+            self._resume()
+        except Exception as e:
+            logger.error(f'Error resuming interrupted compression: {e}')
+
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                settings = load_settings()['library']['management']
+                if settings['compress_files']:
+                    self._compress_pending_files(settings['compression'])
+            except Exception as e:
+                logger.error(f'Error during library compression: {e}')
+            self._wake.wait(COMPRESSION_CHECK_INTERVAL)
+
+    def _resume(self):
+        current = self.state.get('current')
+        if not current:
+            return
+        if current['stage'] == 'compressing':
+            logger.info(f"Cleaning up interrupted compression of {current['src']}.")
+            self._remove_compression_output(current)
+            self.state['current'] = None
+            self._save_state()
+        elif current['stage'] == 'swapping':
+            logger.info(f"Completing interrupted compression of {current['src']}.")
+            self._swap(current)
+
+    def _wait_for_idle_downloads(self):
+        """
+        Wait until no download has been in progress or started for COMPRESSION_DOWNLOAD_BACKOFF seconds,
+        returns False if stopped meanwhile. Downloads offloaded to a reverse proxy are only noticed by their count.
+        """
+        with self.app.app_context():
+            download_count = get_total_download_count()
+        while not self._stopped.wait(COMPRESSION_DOWNLOAD_BACKOFF):
+            with self.app.app_context():
+                previous_count, download_count = download_count, get_total_download_count()
+            if download_count == previous_count and not download_activity.is_active():
+                return True
+            logger.debug('Files are being downloaded, compression paused.')
+        return False
+
+    def _compress_pending_files(self, compression_settings):
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                failed_ids = [int(file_id) for file_id in self.state.get('failed', {})]
+                file = get_next_file_to_compress(failed_ids)
+                if file is None:
+                    return
+                src = file.filepath
+                current = {
+                    'file_id': file.id,
+                    'src': src,
+                    'dest': get_compressed_filepath(src),
+                    'output_dir': get_compression_directory(src),
+                    'stage': 'compressing',
+                }
+            if not self._wait_for_idle_downloads():
+                return
+
+            if os.path.lexists(current['dest']):
+                self._fail(current, f"{current['dest']} already exists")
+                continue
+
+            self.state['current'] = current
+            self._save_state()
+            logger.info(f"Compressing {src} (level {compression_settings['level']})...")
+            compressed_path, error = self._run_compression(current, compression_settings)
+            if self._stopped.is_set():
+                return
+            if error:
+                self._remove_compression_output(current)
+                self._fail(current, error)
+                continue
+
+            current['tmp'] = compressed_path
+            current['stage'] = 'swapping'
+            self._save_state()
+            self._swap(current)
+
+    def _run_compression(self, current, compression_settings):
+        """Run `compress_file` in a child process, returns the compressed file path and an error"""
+        os.makedirs(current['output_dir'], exist_ok=True)
+        command = [
+            sys.executable, os.path.abspath(__file__), current['src'], current['output_dir'],
+            str(compression_settings['level']), str(compression_settings['threads']),
+            str(int(compression_settings['verify'])), str(int(compression_settings['block']))
+        ]
+        with self._lock:
+            if self._stopped.is_set():
+                return None, 'stopped'
+            self._process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if hasattr(os, 'setpriority'):
+                # Lower CPU (and on Linux I/O) priority, so that serving the shop and downloads comes first
+                try:
+                    os.setpriority(os.PRIO_PROCESS, self._process.pid, COMPRESSION_NICE)
+                except OSError as e:
+                    logger.warning(f'Error lowering the compression process priority: {e}')
+        try:
+            _, stderr = self._process.communicate()
+            returncode = self._process.returncode
+        finally:
+            with self._lock:
+                self._process = None
+
+        compressed_path = os.path.join(current['output_dir'], os.path.basename(current['dest']))
+        if returncode != 0 or not os.path.isfile(compressed_path):
+            error_lines = stderr.decode('utf-8', errors='replace').strip().splitlines()
+            return None, error_lines[-1] if error_lines else f'compression process exited with code {returncode}'
+        return compressed_path, None
+
+    def _swap(self, current):
+        """Replace the original file with its compressed version, each step can be done again after an interruption"""
+        src, dest, tmp = current['src'], current['dest'], current.get('tmp')
+        with self.app.app_context():
+            file = get_file_from_db(current['file_id'])
+            if file is None or file.filepath not in (src, dest):
+                # Moved or removed during the compression, compressed again later if still needed
+                logger.info(f'{src} changed during its compression, compressed file discarded.')
+                self._remove_compression_output(current)
+                self.state['current'] = None
+                self._save_state()
+                return
+
+            # Add the events to the ignored list before performing the operations, removed if they fail
+            if tmp and os.path.exists(tmp):
+                self.watcher.ignore_moves([(tmp, dest)])
+                try:
+                    os.rename(tmp, dest)
+                except OSError:
+                    self.watcher.unignore_moves([(tmp, dest)])
+                    raise
+            decompressed_size = get_decompressed_size(dest) if dest.lower().endswith('.nsz') else None
+            set_file_compressed(current['file_id'], dest, os.path.getsize(dest), decompressed_size)
+        if os.path.exists(src):
+            self.watcher.ignore_deletes([src])
+            try:
+                os.remove(src)
+            except OSError:
+                self.watcher.unignore_deletes([src])
+                raise
+        self._remove_compression_output(current)
+
+        self.state['current'] = None
+        self._save_state()
+        logger.info(f'Compressed {src} to {dest}.')
+        self.on_compressed([dest])
+
+    def _remove_compression_output(self, current):
+        shutil.rmtree(current['output_dir'], ignore_errors=True)
+
+    def _fail(self, current, error):
+        logger.error(f"Error compressing {current['src']}: {error}")
+        self.state.setdefault('failed', {})[str(current['file_id'])] = error
+        self.state['current'] = None
+        self._save_state()
+
+if __name__ == '__main__':
+    # Compression process started by Compressor._run_compression
+    src, output_dir, level, threads, verify, block = sys.argv[1:7]
+    try:
+        compress_file(src, output_dir, int(level), int(threads), verify == '1', block == '1')
+    except BaseException as e:
+        print(f'{type(e).__name__}: {e}', file=sys.stderr)
+        sys.exit(1)
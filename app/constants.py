@@ -8,6 +8,12 @@ CONFIG_FILE = os.path.join(CONFIG_DIR, 'settings.yaml')
 KEYS_FILE = os.path.join(CONFIG_DIR, 'keys.txt')
 CACHE_DIR = os.path.join(DATA_DIR, 'cache')
 LIBRARY_CACHE_FILE = os.path.join(CACHE_DIR, 'library.json')
+SHOP_CACHE_FILE = os.path.join(CACHE_DIR, 'shop.cache')
+ORGANIZER_LAST_PLAN_FILE = os.path.join(CACHE_DIR, 'organizer_plan.json')
+DECOMPRESSION_INDEX_DIR = os.path.join(CACHE_DIR, 'decompression')
+USERS_CHANGED_FILE = os.path.join(CACHE_DIR, 'users.changed')
+COMPRESSION_STATE_FILE = os.path.join(DATA_DIR, 'compression.json')
+DOWNLOAD_ACTIVITY_DIR = os.path.join(DATA_DIR, 'downloads')
 ALEMBIC_DIR = os.path.join(APP_DIR, 'migrations')
 ALEMBIC_CONF = os.path.join(ALEMBIC_DIR, 'alembic.ini')
 TITLEDB_DIR = os.path.join(DATA_DIR, 'titledb')
@@ -25,13 +31,29 @@ OWNFOIL_DB = 'sqlite:///' + DB_FILE
 DEFAULT_SETTINGS = {
     "library": {
         "paths": ["/games"],
+        "watcher": {
+            "mode": "auto", # auto, native or polling
+            "polling_interval": 10,
+            "modes": {}, # per library path, overrides mode
+        },
+        "verification": {
+            "enabled": False,
+            "rate_limit": 50, # MiB/s read per device, 0 for unlimited
+        },
         "management": {
             "compress_files": False,
+            "compression": {
+                "level": 18,
+                "threads": 2,
+                "verify": True,
+                "block": False,
+            },
             "delete_older_updates": False,
             "organizer": {
                 "enabled": False,
                 "remove_empty_folders": False,
                 "windows_compatible": False,
+                "verify_moves": False,
                 "templates": {
                     "base": "{titleName}/{titleName} [{appId}][v{appVersion}]",
                     "update": "{titleName}/{titleName} [{appId}][v{appVersion}]",
@@ -66,10 +88,107 @@ DEFAULT_SETTINGS = {
     },
     "scheduler": {
         "scan_interval": "12h",
+    },
+    "downloads": {
+        "offload": {
+            "mode": "",
+            "mappings": {},
+        },
+        "server": {
+            "enabled": False,
+            "host": "0.0.0.0",
+            "port": 8466,
+            "url": "",
+        },
+        "decompressed_nsp": False,
     }
 }
 
 
+# Reverse proxy headers used to offload file downloads
+DOWNLOAD_OFFLOAD_HEADERS = {
+    'x-accel-redirect': 'X-Accel-Redirect',
+    'x-sendfile': 'X-Sendfile',
+}
+
+# Time during which the file deletions reported by the watcher are grouped in a single batch, in seconds
+WATCHER_BATCH_WINDOW = 1
+# Seconds within which a directory change may not update its mtime, see CompactPollingEmitter
+WATCHER_MTIME_GRANULARITY = 2
+
+# Filesystems whose changes are not reported by native events (i.e. made by other machines or through a VM), watched by polling
+WATCHER_POLLING_FILESYSTEMS = {
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'afs', 'ceph', 'glusterfs', 'lustre', 'davfs',
+    'sshfs', 'rclone', 's3fs', 'grpcfuse', 'fakeowner', 'virtiofs', 'drvfs',
+}
+
+# Interval between two writes of the download counts to the database, in seconds
+DOWNLOAD_COUNT_FLUSH_INTERVAL = 30
+# Interval between two notices of the downloads in progress of a process, considered complete after the timeout, in seconds
+DOWNLOAD_ACTIVITY_HEARTBEAT_INTERVAL = 10
+DOWNLOAD_ACTIVITY_TIMEOUT = 3 * DOWNLOAD_ACTIVITY_HEARTBEAT_INTERVAL
+
+# Time during which successfully verified Basic auth credentials are trusted without checking the password hash, in seconds
+VERIFIED_CREDENTIALS_TTL = 60
+
+# Time during which users and admin account presence are cached, in seconds
+USERS_CACHE_TTL = 60
+
+# Size of the chunks of decompressed NSZ files sent to clients, in bytes
+DECOMPRESSED_CHUNK_SIZE = 1024 * 1024
+# Number of NSZ decompression indexes kept in memory
+DECOMPRESSION_INDEX_CACHE_SIZE = 256
+
+# Validity of the signed links to the download server, in seconds
+DOWNLOAD_TOKEN_MAX_AGE = 6 * 3600
+
+# Interval between two checks for background tasks submitted by request-serving processes, in seconds
+BACKGROUND_TASKS_INTERVAL = 2
+# Number of files moved in parallel by the organizer, within the same device
+ORGANIZER_WORKERS = 8
+# Number of files moved to another filesystem at the same time by the organizer
+CROSS_DEVICE_MOVE_WORKERS = 1
+# Size of the chunks copied when moving files to another filesystem, in bytes
+MOVE_CHUNK_SIZE = 64 * 1024 * 1024
+# Suffix of the files being written by Ownfoil, renamed once complete
+TEMPORARY_FILE_SUFFIX = '.ownfoil-tmp'
+# Directory of the files being written by Ownfoil next to their target, ignored by the watcher and scans
+TEMPORARY_DIRECTORY_NAME = '.ownfoil-tmp'
+# Extension of the compressed version of the files
+COMPRESSED_EXTENSIONS = {
+    '.nsp': '.nsz',
+    '.xci': '.xcz',
+}
+# Block size of block compressed files (2^20 = 1 MiB), see `compress_file`
+COMPRESSION_BLOCK_SIZE_EXPONENT = 20
+# Niceness of the compression processes, also lowering their I/O priority on Linux
+COMPRESSION_NICE = 10
+# Interval between two checks for files to compress, besides library changes, in seconds
+COMPRESSION_CHECK_INTERVAL = 3600
+# Compression only starts a file once no download has been in progress or started for this duration, in seconds
+COMPRESSION_DOWNLOAD_BACKOFF = 60
+# Interval between two checks for files to verify, besides library changes, in seconds
+VERIFICATION_CHECK_INTERVAL = 6 * 3600
+# Size of the chunks read when verifying files, in bytes
+VERIFICATION_CHUNK_SIZE = 4 * 1024 * 1024
+# Interval between two checks of the suspended libraries (unavailable library roots), in seconds
+LIBRARY_RESUME_CHECK_INTERVAL = 60
+
+# Lease of the process running the background services (watcher, scheduler and library pipeline), in seconds
+LEADER_LEASE_NAME = 'background_services'
+LEADER_LEASE_DURATION = 30
+LEADER_LEASE_RENEW_INTERVAL = 10
+
+# Default gunicorn worker processes and threads per worker, overridden by OWNFOIL_WORKERS and OWNFOIL_THREADS
+DEFAULT_SERVER_WORKERS = 2
+DEFAULT_SERVER_THREADS = 8
+
+# Number of recorded runs kept per scheduled job
+JOB_RUNS_HISTORY_SIZE = 50
+
+# Soft timeout of the TitleDB update and library scan job, in seconds
+UPDATE_AND_SCAN_JOB_TIMEOUT = 2 * 3600
+
 ALLOWED_EXTENSIONS = [
     'nsp',
     'nsz',
@@ -1,7 +1,7 @@
 from flask import send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import create_engine
-from sqlalchemy import event
+from sqlalchemy import event, update, bindparam, func, or_, cast, Integer
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.dialects.sqlite import insert  # Use postgresql if using PostgreSQL
@@ -12,11 +12,15 @@ from alembic.script import ScriptDirectory
 from flask_login import UserMixin
 from alembic import command
 import os, sys
+import json
 import shutil
 import logging
 import datetime
+import threading
+from collections import Counter
 from constants import *
 from utils import throttle
+from decompression import get_decompressed_filename
 
 # Retrieve main logger
 logger = logging.getLogger('main')
@@ -24,6 +28,10 @@ logger = logging.getLogger('main')
 db = SQLAlchemy()
 migrate = Migrate()
 
+# Download counts waiting to be written to the database
+_pending_download_counts = Counter()
+_pending_download_counts_lock = threading.Lock()
+
 # Alembic functions
 def get_alembic_cfg():
     cfg = Config(ALEMBIC_CONF)
@@ -74,6 +82,8 @@ class Files(db.Model):
     extension = db.Column(db.String)
     size = db.Column(db.Integer)
     compressed = db.Column(db.Boolean, default=False)
+    # Size of the NSP a NSZ file decompresses to, see `get_decompressed_size`
+    decompressed_size = db.Column(db.Integer)
     multicontent = db.Column(db.Boolean, default=False)
     nb_content = db.Column(db.Integer, default=0)
     download_count = db.Column(db.Integer, default=0)
@@ -82,6 +92,12 @@ class Files(db.Model):
     identification_error = db.Column(db.String)
     identification_attempts = db.Column(db.Integer, default=0)
     last_attempt = db.Column(db.DateTime, default=datetime.datetime.now())
+    # Hash of the organizer inputs the file was last organized with, see `get_organizer_inputs`
+    organizer_hash = db.Column(db.String)
+    # Integrity verification result, for the size and modification time in `verification_key`, see `Verifier`
+    verified = db.Column(db.Boolean)
+    verification_error = db.Column(db.String)
+    verification_key = db.Column(db.String)
 
     library = db.relationship('Libraries', backref=db.backref('files', lazy=True, cascade="all, delete-orphan"))
 
@@ -140,7 +156,27 @@ class User(UserMixin, db.Model):
         elif access == 'backup':
             return self.has_backup_access()
 
-def init_db(app):
+class BackgroundTasks(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    kwargs = db.Column(db.String)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now)
+
+class Leases(db.Model):
+    name = db.Column(db.String, primary_key=True)
+    holder = db.Column(db.String, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class JobRuns(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String, nullable=False, index=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    duration = db.Column(db.Float)
+    outcome = db.Column(db.String, nullable=False)
+    items_processed = db.Column(db.Integer)
+    error = db.Column(db.String)
+
+def init_db_engine(app):
     with app.app_context():
         # Ensure foreign keys are enforced when the SQLite connection is opened
         @event.listens_for(db.engine, "connect")
@@ -149,6 +185,9 @@ def init_db(app):
             cursor.execute("PRAGMA foreign_keys=ON;")
             cursor.close()
 
+def init_db(app):
+    init_db_engine(app)
+    with app.app_context():
         # create or migrate database
         if "db" not in sys.argv:
             if not os.path.exists(DB_FILE):
@@ -162,32 +201,127 @@ def init_db(app):
                     upgrade()
                     logger.info("Database migration applied successfully.")
 
+def update_file_paths(moves):
+    """
+    Update the paths of files moved by the organizer in a single batched UPDATE,
+    `moves` is a list of (library, old_path, new_path, organizer_hash)
+    """
+    if not moves:
+        return
+    files_table = Files.__table__
+    stmt = (
+        update(files_table)
+        .where(files_table.c.filepath == bindparam('b_old_path'))
+        .values(filepath=bindparam('b_new_path'), filename=bindparam('b_filename'), folder=bindparam('b_folder'),
+            organizer_hash=bindparam('b_organizer_hash'))
+    )
+    try:
+        db.session.execute(stmt, [{
+            'b_old_path': old_path,
+            'b_new_path': new_path,
+            'b_filename': os.path.basename(new_path),
+            'b_folder': _get_file_folder(library, new_path),
+            'b_organizer_hash': organizer_hash,
+        } for library, old_path, new_path, organizer_hash in moves])
+        db.session.commit()
+        logger.debug(f"File paths updated for {len(moves)} files.")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"An error occurred while updating the file paths: {str(e)}")
+    # Loaded instances may still hold the old paths
+    db.session.expire_all()
+
+def set_files_organizer_hash(organizer_hashes):
+    """Record the organizer inputs of files already organized, `organizer_hashes` is a dict of file_id: hash"""
+    if not organizer_hashes:
+        return
+    files_table = Files.__table__
+    stmt = (
+        update(files_table)
+        .where(files_table.c.id == bindparam('b_id'))
+        .values(organizer_hash=bindparam('b_organizer_hash'))
+    )
+    db.session.execute(stmt, [{'b_id': file_id, 'b_organizer_hash': organizer_hash} for file_id, organizer_hash in organizer_hashes.items()])
+    db.session.commit()
+
+def get_next_file_to_compress(excluded_ids=()):
+    """First identified NSP or XCI file not compressed yet, None if there is none"""
+    query = Files.query.filter(
+        Files.identified == True,
+        Files.compressed == False,
+        func.lower(Files.extension).in_(['nsp', 'xci'])
+    )
+    if excluded_ids:
+        query = query.filter(Files.id.notin_(list(excluded_ids)))
+    return query.order_by(Files.id).first()
+
+def set_file_compressed(file_id, filepath, size, decompressed_size=None):
+    """Point a file entry to its compressed version, keeping its identification and apps"""
+    file_entry = get_file_from_db(file_id)
+    if file_entry is None:
+        return
+    file_entry.filepath = filepath
+    file_entry.filename = os.path.basename(filepath)
+    file_entry.extension = os.path.splitext(filepath)[1].lstrip('.').lower()
+    file_entry.size = size
+    file_entry.decompressed_size = decompressed_size
+    file_entry.compressed = True
+    # The organized path depends on the extension
+    file_entry.organizer_hash = None
+    db.session.commit()
+
+def get_files_without_decompressed_size():
+    """NSZ files whose decompressed size is unknown, i.e. identified before it was stored"""
+    return Files.query.filter(func.lower(Files.extension) == 'nsz', Files.decompressed_size.is_(None)).all()
+
+def get_files_verification_keys():
+    return db.session.query(Files.id, Files.filepath, Files.verification_key).order_by(Files.id).all()
+
+def set_file_verification(file_id, verification_key, verified, error=None):
+    db.session.execute(
+        update(Files)
+        .where(Files.id == file_id)
+        .values(verified=verified, verification_error=error, verification_key=verification_key)
+    )
+    db.session.commit()
+
+def get_verification_failures():
+    """Files whose last verification failed"""
+    return [{
+        'id': f.id,
+        'filepath': f.filepath,
+        'error': f.verification_error,
+    } for f in Files.query.filter(Files.verified == False).order_by(Files.filepath)]
+
+def get_total_download_count():
+    return db.session.query(func.coalesce(func.sum(Files.download_count), 0)).scalar()
+
 def file_exists_in_db(filepath):
     return Files.query.filter_by(filepath=filepath).first() is not None
 
 def get_file_from_db(file_id):
     return Files.query.filter_by(id=file_id).first()
 
+def _get_file_folder(library, filepath):
+    """Folder of a file relative to its library, '' at the root of the library"""
+    folder = os.path.dirname(filepath)
+    if os.path.normpath(library) == os.path.normpath(folder):
+        # file is at the root of the library
+        return ''
+    new_folder = folder.replace(library, '')
+    return '/' + new_folder if not new_folder.startswith('/') else new_folder
+
 def update_file_path(library, old_path, new_path):
     try:
         # Find the file entry in the database using the old_path
         file_entry = Files.query.filter_by(filepath=old_path).one()
 
-        # Extract the new folder and filename from the new_path
-        folder = os.path.dirname(new_path)
-        if os.path.normpath(library) == os.path.normpath(folder):
-            # file is at the root of the library
-            new_folder = ''
-        else:
-            new_folder = folder.replace(library, '')
-            new_folder = '/' + new_folder if not new_folder.startswith('/') else new_folder
-
-        filename = os.path.basename(new_path)
-
         # Update the file entry with the new path values
-        file_entry.filename = filename
+        file_entry.filename = os.path.basename(new_path)
         file_entry.filepath = new_path
-        file_entry.folder = new_folder
+        file_entry.folder = _get_file_folder(library, new_path)
+        # Moved outside of the organizer, to be evaluated again
+        file_entry.organizer_hash = None
         
         # Commit the changes to the database
         db.session.commit()
@@ -237,6 +371,77 @@ def get_all_non_identified_files_from_library(library_id):
 def get_files_with_identification_from_library(library_id, identification_type):
     return Files.query.filter_by(library_id=library_id, identification_type=identification_type).all()
 
+def _chunks(values, chunk_size=500):
+    values = list(values)
+    for i in range(0, len(values), chunk_size):
+        yield values[i:i + chunk_size]
+
+def _query_in(query, column, values, chunk_size=500):
+    """Results of `query` filtered on `column` in `values`, queried in chunks to stay below the SQLite variables limit"""
+    results = []
+    for chunk in _chunks(values, chunk_size):
+        results.extend(query.filter(column.in_(chunk)).all())
+    return results
+
+def get_files_by_filepaths(filepaths):
+    return _query_in(Files.query, Files.filepath, filepaths)
+
+def get_identified_files(filepaths=None):
+    """Identified files of the whole library or only `filepaths`, with their apps and titles loaded for the organizer"""
+    query = Files.query.options(joinedload(Files.apps).joinedload(Apps.title)).filter_by(identified=True)
+    if filepaths is None:
+        return query.all()
+    return _query_in(query, Files.filepath, filepaths)
+
+def get_file_sizes_in_directory(directory, recursive=False):
+    """Paths and sizes of the files directly in `directory`, or in its whole tree if `recursive`"""
+    prefix = os.path.join(directory, '')
+    # Range on the indexed file paths, U+10FFFF sorts after any character following the prefix
+    rows = (db.session.query(Files.filepath, Files.size)
+        .filter(Files.filepath >= prefix, Files.filepath < prefix + '\U0010ffff')
+        .all())
+    parent = os.path.dirname(prefix)
+    return {
+        filepath: size for filepath, size in rows
+        if recursive or os.path.dirname(filepath) == parent
+    }
+
+def get_outdated_update_files(title_ids=None):
+    """
+    Files of owned updates superseded by a newer owned update of the same title, among all titles or only
+    `title_ids`. Multi-content and non identified files are left out. Returns (file id, filepath, title_id, app_version) rows.
+    """
+    latest_updates = (db.session.query(Apps.title_id, func.max(cast(Apps.app_version, Integer)).label('max_version'))
+        .filter(Apps.app_type == APP_TYPE_UPD, Apps.owned == True)
+        .group_by(Apps.title_id)
+        .subquery())
+    query = (db.session.query(Files.id, Files.filepath, Titles.title_id, Apps.app_version)
+        .join(app_files, app_files.c.file_id == Files.id)
+        .join(Apps, Apps.id == app_files.c.app_id)
+        .join(Titles, Titles.id == Apps.title_id)
+        .join(latest_updates, latest_updates.c.title_id == Apps.title_id)
+        .filter(
+            Apps.app_type == APP_TYPE_UPD,
+            Apps.owned == True,
+            cast(Apps.app_version, Integer) < latest_updates.c.max_version,
+            Files.identified == True,
+            Files.multicontent == False
+        ))
+    if title_ids is None:
+        return query.all()
+    return _query_in(query, Titles.title_id, title_ids)
+
+def get_file_title_ids(filepath):
+    """Title IDs of the apps contained in a file"""
+    rows = (db.session.query(Titles.title_id)
+        .join(Apps, Apps.title_id == Titles.id)
+        .join(app_files, app_files.c.app_id == Apps.id)
+        .join(Files, Files.id == app_files.c.file_id)
+        .filter(Files.filepath == filepath)
+        .distinct()
+        .all())
+    return {row.title_id for row in rows}
+
 def get_filtered_files(content_filter=None) -> list:
     """Get files from database with optional content type filtering."""
 
@@ -255,6 +460,18 @@ def get_filtered_files(content_filter=None) -> list:
     # Execute query and return files
     return query.all()
 
+def get_shop_file_entries(files, decompressed_nsp=False):
+    """
+    Format files as shop entries, as listed by Tinfoil and CyberFoil.
+    With `decompressed_nsp`, NSZ files are also listed as the NSP they decompress to.
+    """
+    entries = [{'url': f'/api/get_game/{f.id}#{f.filename}', 'size': f.size} for f in files]
+    if decompressed_nsp:
+        for f in files:
+            if f.extension == 'nsz' and f.decompressed_size is not None:
+                entries.append({'url': f'/api/get_game/{f.id}/nsp#{get_decompressed_filename(f.filename)}', 'size': f.decompressed_size})
+    return entries
+
 def get_shop_files():
     results = Files.query.all()
     shop_files = [{
@@ -300,6 +517,9 @@ def get_library_id(library_path):
         library_id = library.id
     return library_id
 
+def has_library_files(library_id):
+    return db.session.query(Files.id).filter_by(library_id=library_id).first() is not None
+
 def get_library_file_paths(library_id):
     return [file.filepath for file in Files.query.filter_by(library_id=library_id).all()]
 
@@ -311,6 +531,9 @@ def set_library_scan_time(library_id, scan_time=None):
 def get_all_titles():
     return Titles.query.all()
 
+def get_titles_by_title_ids(title_ids):
+    return _query_in(Titles.query, Titles.title_id, title_ids)
+
 def get_title(title_id):
     return Titles.query.filter_by(title_id=title_id).first()
 
@@ -389,10 +612,10 @@ def has_owned_apps(title_id):
     owned_apps = Apps.query.filter_by(title_id=title.id, owned=True).first()
     return owned_apps is not None
 
-def remove_titles_without_owned_apps():
-    """Remove titles that have no owned apps"""
+def remove_titles_without_owned_apps(title_ids=None):
+    """Remove titles that have no owned apps, among all titles or only `title_ids`"""
     titles_removed = 0
-    titles = get_all_titles()
+    titles = get_all_titles() if title_ids is None else get_titles_by_title_ids(title_ids)
     
     for title in titles:
         if not has_owned_apps(title.title_id):
@@ -402,33 +625,63 @@ def remove_titles_without_owned_apps():
     
     return titles_removed
 
+def delete_files_by_ids(file_ids):
+    """
+    Remove files with set-based statements: their app references, the owned status of these apps
+    and the files themselves, in a single transaction. Returns the title IDs of the affected apps.
+    """
+    file_ids = list(file_ids)
+    if not file_ids:
+        return set()
+    app_ids = set()
+    title_ids = set()
+    try:
+        for chunk in _chunks(file_ids):
+            rows = (db.session.query(app_files.c.app_id, Titles.title_id)
+                .join(Apps, Apps.id == app_files.c.app_id)
+                .join(Titles, Titles.id == Apps.title_id)
+                .filter(app_files.c.file_id.in_(chunk))
+                .all())
+            app_ids.update(row.app_id for row in rows)
+            title_ids.update(row.title_id for row in rows)
+            db.session.execute(app_files.delete().where(app_files.c.file_id.in_(chunk)))
+
+        still_owned = db.session.query(app_files.c.app_id).filter(app_files.c.app_id == Apps.id).exists()
+        for chunk in _chunks(app_ids):
+            db.session.execute(update(Apps).where(Apps.id.in_(chunk)).values(owned=still_owned)
+                .execution_options(synchronize_session=False))
+
+        for chunk in _chunks(file_ids):
+            db.session.execute(Files.__table__.delete().where(Files.id.in_(chunk)))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # Loaded instances may still reference the deleted rows
+    db.session.expire_all()
+
+    logger.info(f"{len(file_ids)} files removed from database.")
+    if app_ids:
+        logger.info(f"Updated {len(app_ids)} app entries to remove file references.")
+    return title_ids
+
+def delete_files_by_filepaths(filepaths):
+    """Remove files by path, see `delete_files_by_ids`"""
+    file_ids = []
+    for chunk in _chunks(filepaths):
+        file_ids.extend(row.id for row in db.session.query(Files.id).filter(Files.filepath.in_(chunk)))
+    return delete_files_by_ids(file_ids)
+
 def delete_files_by_library(library_path):
     success = True
     errors = []
     try:
-        # Find all files with the given library
-        files_to_delete = Files.query.filter_by(library=library_path).all()
-        
-        # Update Apps table before deleting files
-        total_apps_updated = 0
-        for file in files_to_delete:
-            apps_updated = remove_file_from_apps(file.id)
-            total_apps_updated += apps_updated
-        
-        # Delete each file
-        for file in files_to_delete:
-            db.session.delete(file)
-        
-        # Commit the changes
-        db.session.commit()
-        
+        library = Libraries.query.filter_by(path=library_path).first()
+        file_ids = [row.id for row in db.session.query(Files.id).filter_by(library_id=library.id)] if library else []
+        delete_files_by_ids(file_ids)
         logger.info(f"All entries with library '{library_path}' have been deleted.")
-        if total_apps_updated > 0:
-            logger.info(f"Updated {total_apps_updated} app entries to remove library file references.")
         return success, errors
     except Exception as e:
-        # If there's an error, rollback the session
-        db.session.rollback()
         logger.error(f"An error occurred: {e}")
         success = False
         errors.append({
@@ -439,58 +692,152 @@ def delete_files_by_library(library_path):
 
 def delete_file_by_filepath(filepath):
     try:
-        # Find file with the given filepath
-        file_to_delete = Files.query.filter_by(filepath=filepath).one()
-        file_id = file_to_delete.id
-        
-        # Update Apps table before deleting file
-        apps_updated = remove_file_from_apps(file_id)
-        
-        # Delete file
-        db.session.delete(file_to_delete)
-        
-        # Commit the changes
-        db.session.commit()
-        
-        logger.info(f"File '{filepath}' removed from database.")
-        if apps_updated > 0:
-            logger.info(f"Updated {apps_updated} app entries to remove file reference.")
-            
-    except NoResultFound:
-        logger.info(f"File '{filepath}' not present in database.")
+        if not file_exists_in_db(filepath):
+            logger.info(f"File '{filepath}' not present in database.")
+            return set()
+        return delete_files_by_filepaths([filepath])
     except Exception as e:
-        # If there's an error, rollback the session
-        db.session.rollback()
         logger.error(f"An error occurred while removing the file path: {str(e)}")
+        return set()
 
-def remove_missing_files_from_db():
+def remove_missing_files_from_db(library_ids=None):
+    """
+    Remove the files no longer on disk, among all libraries or only `library_ids`,
+    returns the title IDs of their apps
+    """
+    title_ids = set()
     try:
-        # Query all entries in the Files table
-        files = Files.query.all()
-        
-        for file_entry in files:
+        query = db.session.query(Files.id, Files.filepath)
+        if library_ids is not None:
+            query = query.filter(Files.library_id.in_(list(library_ids)))
+        missing_file_ids = []
+        for file_id, filepath in query:
             # Check if the file exists on disk
-            if not os.path.exists(file_entry.filepath):
-                logger.debug(f"File not found, marking file for deletion: {file_entry.filepath}")
-                delete_file_by_filepath(file_entry.filepath)
-    
+            if not os.path.exists(filepath):
+                logger.debug(f"File not found, marking file for deletion: {filepath}")
+                missing_file_ids.append(file_id)
+        title_ids = delete_files_by_ids(missing_file_ids)
+
     except Exception as e:
         logger.error(f"An error occurred while removing missing files: {str(e)}")
+    return title_ids
 
 def increment_download_count(filepath):
-    """Increment the download count for a file by filepath"""
+    """Record a download for a file by filepath, written to the database by flush_download_counts"""
+    with _pending_download_counts_lock:
+        _pending_download_counts[filepath] += 1
+
+def flush_download_counts():
+    """Write all pending download counts to the database in a single batched UPDATE"""
+    global _pending_download_counts
+    with _pending_download_counts_lock:
+        if not _pending_download_counts:
+            return 0
+        pending = _pending_download_counts
+        _pending_download_counts = Counter()
+
+    files_table = Files.__table__
+    stmt = (
+        update(files_table)
+        .where(files_table.c.filepath == bindparam('b_filepath'))
+        .values(download_count=func.coalesce(files_table.c.download_count, 0) + bindparam('b_count'))
+    )
     try:
-        file_entry = Files.query.filter_by(filepath=filepath).first()
-        if file_entry:
-            previous = file_entry.download_count
-            file_entry.download_count += 1
-            db.session.commit()
-            logger.debug(f"Download count incremented for '{filepath}': {file_entry.download_count}")
-            return True
+        db.session.execute(stmt, [{'b_filepath': filepath, 'b_count': count} for filepath, count in pending.items()])
+        db.session.commit()
+        logger.debug(f"Download counts flushed for {len(pending)} files.")
     except Exception as e:
         db.session.rollback()
-        logger.error(f"An error occurred while incrementing download count for '{filepath}': {str(e)}")
-        return False
+        logger.error(f"An error occurred while flushing download counts: {str(e)}")
+        # Keep the counts for the next flush
+        with _pending_download_counts_lock:
+            _pending_download_counts.update(pending)
+        return 0
+    return len(pending)
+
+def add_background_task(name, kwargs):
+    db.session.add(BackgroundTasks(name=name, kwargs=json.dumps(kwargs)))
+    db.session.commit()
+
+def pop_background_tasks():
+    """Fetch and remove all queued background tasks, in submission order"""
+    tasks = BackgroundTasks.query.order_by(BackgroundTasks.id).all()
+    if not tasks:
+        return []
+    BackgroundTasks.query.filter(BackgroundTasks.id <= tasks[-1].id).delete()
+    db.session.commit()
+    return [(task.name, json.loads(task.kwargs or '{}')) for task in tasks]
+
+def acquire_lease(name, holder, duration):
+    """Acquire or renew a lease for `duration` seconds, returns True if `holder` now holds the lease"""
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    expires_at = now + datetime.timedelta(seconds=duration)
+    leases_table = Leases.__table__
+    db.session.execute(
+        insert(leases_table)
+        .values(name=name, holder=holder, expires_at=expires_at)
+        .on_conflict_do_nothing()
+    )
+    # Renew our own lease, or take over an expired one
+    result = db.session.execute(
+        update(leases_table)
+        .where(leases_table.c.name == name)
+        .where(or_(leases_table.c.holder == holder, leases_table.c.expires_at < now))
+        .values(holder=holder, expires_at=expires_at)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+def get_lease_holder(name):
+    lease = db.session.get(Leases, name)
+    return lease.holder if lease else None
+
+def release_lease(name, holder):
+    Leases.query.filter_by(name=name, holder=holder).delete()
+    db.session.commit()
+
+def add_job_run(job_id, started_at):
+    """Record the start of a scheduled job run, returns the run id"""
+    run = JobRuns(job_id=job_id, started_at=started_at, outcome='running')
+    db.session.add(run)
+    db.session.commit()
+    return run.id
+
+def finish_job_run(run_id, outcome, duration, items_processed=None, error=None):
+    run = db.session.get(JobRuns, run_id)
+    if run is None:
+        return
+    run.outcome = outcome
+    run.duration = duration
+    run.items_processed = items_processed
+    run.error = error
+    job_id = run.job_id
+    db.session.commit()
+
+    # Only keep the latest runs of each job
+    oldest_kept = (JobRuns.query.filter_by(job_id=job_id)
+        .order_by(JobRuns.id.desc())
+        .offset(JOB_RUNS_HISTORY_SIZE - 1)
+        .first())
+    if oldest_kept:
+        JobRuns.query.filter(JobRuns.job_id == job_id, JobRuns.id < oldest_kept.id).delete()
+        db.session.commit()
+
+def get_job_runs(job_id=None, limit=JOB_RUNS_HISTORY_SIZE):
+    """Latest scheduled job runs, most recent first"""
+    query = JobRuns.query
+    if job_id:
+        query = query.filter_by(job_id=job_id)
+    runs = query.order_by(JobRuns.id.desc()).limit(limit).all()
+    return [{
+        'id': run.id,
+        'job_id': run.job_id,
+        'started_at': run.started_at.isoformat(),
+        'duration': run.duration,
+        'outcome': run.outcome,
+        'items_processed': run.items_processed,
+        'error': run.error
+    } for run in runs]
 
 @throttle(60, key_func=lambda filepath, host: (filepath, host))
 def increment_download_count_throttled(filepath, host):
@@ -499,6 +846,7 @@ def increment_download_count_throttled(filepath, host):
     Ensures the download count is incremented at most once per (filepath, host) pair
     within a 60-second window. This prevents clients that use HTTP range requests from
     inflating the count with the many sub-requests that make up a single download.
+    The count is only recorded in memory, so serving a download never waits on a database write.
 
     Args:
         filepath: Absolute path of the file being served.
@@ -0,0 +1,240 @@
+from constants import *
+from functools import lru_cache
+from itertools import accumulate
+from types import SimpleNamespace
+from zstandard import ZstdDecompressor
+import hashlib
+import struct
+import json
+import os
+import logging
+try:
+    from Crypto.Cipher import AES
+    from Crypto.Util import Counter
+except ModuleNotFoundError:
+    # Installed as "Cryptodome" by some system package managers
+    from Cryptodome.Cipher import AES
+    from Cryptodome.Util import Counter
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+# Magic, number of files, string table size, reserved
+PFS0_HEADER = struct.Struct('<4sIII')
+# Data offset, size, name offset, reserved
+PFS0_ENTRY = struct.Struct('<QQII')
+# Offset, size, crypto type, padding, key, counter
+NCZ_SECTION = struct.Struct('<QQQQ16s16s')
+# Version, type, unused, block size exponent, number of blocks, decompressed size
+NCZ_BLOCK_HEADER = struct.Struct('<BBBBIQ')
+# NCA header, kept uncompressed at the start of NCZ files
+NCA_HEADER_SIZE = 0x4000
+# AES-CTR encrypted NCA sections
+NCA_CTR_CRYPTO_TYPES = (3, 4)
+# Increased when the index format changes, invalidating the cached indexes
+INDEX_FORMAT_VERSION = 1
+
+def get_decompressed_filename(filename):
+    return os.path.splitext(filename)[0] + '.nsp'
+
+def read_ncz_header(f, ncz_offset):
+    """Read the sections and block table of a NCZ file starting at `ncz_offset`"""
+    f.seek(ncz_offset + NCA_HEADER_SIZE)
+    magic, section_count = struct.unpack('<8sQ', f.read(16))
+    if magic != b'NCZSECTN':
+        raise ValueError(f'no NCZ section header at offset {ncz_offset}')
+    sections = []
+    for _ in range(section_count):
+        offset, size, crypto_type, _, key, counter = NCZ_SECTION.unpack(f.read(NCZ_SECTION.size))
+        sections.append([offset, size, crypto_type, key.hex(), counter.hex()])
+
+    ncz = {'sections': sections, 'stream_offset': f.tell(), 'block': None}
+    nca_size = max((offset + size for offset, size, *_ in sections), default=NCA_HEADER_SIZE)
+    if f.read(8) == b'NCZBLOCK':
+        _, _, _, block_size_exponent, block_count, decompressed_size = NCZ_BLOCK_HEADER.unpack(f.read(NCZ_BLOCK_HEADER.size))
+        if not 14 <= block_size_exponent <= 32:
+            raise ValueError(f'invalid NCZ block size exponent {block_size_exponent}')
+        ncz['block'] = {
+            'size_exponent': block_size_exponent,
+            'decompressed_size': decompressed_size,
+            'compressed_sizes': list(struct.unpack(f'<{block_count}I', f.read(4 * block_count))),
+        }
+        ncz['stream_offset'] = f.tell()
+        nca_size = NCA_HEADER_SIZE + decompressed_size
+    return ncz, nca_size
+
+def build_decompression_index(filepath):
+    """
+    Index the layout of the NSP a NSZ file decompresses to: its PFS0 header, then for each file
+    its offset in the NSP and where its data is in the NSZ, with the sections and block table of NCZ files.
+    Only the headers are read.
+    """
+    with open(filepath, 'rb') as f:
+        magic, file_count, string_table_size, _ = PFS0_HEADER.unpack(f.read(PFS0_HEADER.size))
+        if magic != b'PFS0':
+            raise ValueError(f'{filepath} is not a PFS0 container')
+        entries = [PFS0_ENTRY.unpack(f.read(PFS0_ENTRY.size)) for _ in range(file_count)]
+        string_table = bytearray(f.read(string_table_size))
+        header_size = PFS0_HEADER.size + file_count * PFS0_ENTRY.size + string_table_size
+
+        files = []
+        offset = header_size
+        for data_offset, size, name_offset, _ in entries:
+            name_end = string_table.index(b'\0', name_offset)
+            file = {'offset': offset, 'src_offset': header_size + data_offset, 'ncz': None}
+            if string_table[name_offset:name_end].endswith(b'.ncz'):
+                # Same name length, the string table is kept as is
+                string_table[name_end - 4:name_end] = b'.nca'
+                file['ncz'], size = read_ncz_header(f, file['src_offset'])
+            file['size'] = size
+            files.append(file)
+            offset += size
+
+    # Files are laid out contiguously after the header, in the order of the NSZ
+    header = PFS0_HEADER.pack(b'PFS0', file_count, string_table_size, 0)
+    for file, (_, _, name_offset, _) in zip(files, entries):
+        header += PFS0_ENTRY.pack(file['offset'] - header_size, file['size'], name_offset, 0)
+    header += string_table
+    return {'size': offset, 'header': header.hex(), 'files': files}
+
+def _get_index_path(filepath):
+    return os.path.join(DECOMPRESSION_INDEX_DIR, hashlib.sha1(filepath.encode('utf-8')).hexdigest() + '.json')
+
+@lru_cache(maxsize=DECOMPRESSION_INDEX_CACHE_SIZE)
+def _load_decompression_index(filepath, size, mtime_ns):
+    signature = [size, mtime_ns]
+    index_path = _get_index_path(filepath)
+    index = None
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_FORMAT_VERSION or index.get('signature') != signature:
+            index = None
+    except (OSError, ValueError):
+        pass
+
+    if index is None:
+        index = build_decompression_index(filepath)
+        index.update(version=INDEX_FORMAT_VERSION, signature=signature)
+        try:
+            os.makedirs(DECOMPRESSION_INDEX_DIR, exist_ok=True)
+            tmp_path = f'{index_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            logger.warning(f'Error saving decompression index of {filepath}: {e}')
+
+    files = [
+        SimpleNamespace(offset=file['offset'], size=file['size'], src_offset=file['src_offset'],
+                        ncz=parse_ncz(file['ncz']) if file['ncz'] is not None else None)
+        for file in index['files']
+    ]
+    return SimpleNamespace(size=index['size'], header=bytes.fromhex(index['header']), files=files)
+
+def parse_ncz(ncz):
+    """Prepare NCZ sections and block table, as read by `read_ncz_header`, for `read_nca`"""
+    block = ncz['block']
+    if block is not None:
+        # Offsets of the compressed blocks in the file
+        block = SimpleNamespace(
+            size=1 << block['size_exponent'],
+            decompressed_size=block['decompressed_size'],
+            compressed_sizes=block['compressed_sizes'],
+            offsets=list(accumulate(block['compressed_sizes'][:-1], initial=ncz['stream_offset'])),
+        )
+    return SimpleNamespace(
+        sections=[(offset, size, crypto_type, bytes.fromhex(key), bytes.fromhex(counter))
+                  for offset, size, crypto_type, key, counter in ncz['sections']],
+        stream_offset=ncz['stream_offset'],
+        block=block,
+    )
+
+def get_decompression_index(filepath):
+    """Decompression index of a NSZ file, cached in memory and in DECOMPRESSION_INDEX_DIR until the file changes"""
+    stat = os.stat(filepath)
+    return _load_decompression_index(filepath, stat.st_size, stat.st_mtime_ns)
+
+def get_decompressed_size(filepath):
+    """Size of the NSP a NSZ file decompresses to, None if it cannot be indexed"""
+    try:
+        return get_decompression_index(filepath).size
+    except Exception as e:
+        logger.warning(f'Error indexing {filepath} for decompression: {e}')
+        return None
+
+def _encrypt(sections, offset, data):
+    """Encrypt decompressed NCA data starting at `offset` with the AES-CTR key of the sections it belongs to"""
+    end = offset + len(data)
+    output = None
+    for section_offset, section_size, crypto_type, key, counter in sections:
+        start, stop = max(offset, section_offset), min(end, section_offset + section_size)
+        if start >= stop or crypto_type not in NCA_CTR_CRYPTO_TYPES:
+            continue
+        if output is None:
+            output = bytearray(data)
+        # The counter is the offset in 16 bytes blocks, pad the data to start on a block boundary
+        padding = start % 16
+        cipher = AES.new(key, AES.MODE_CTR, counter=Counter.new(64, prefix=counter[:8], initial_value=start >> 4))
+        output[start - offset:stop - offset] = cipher.encrypt(bytes(padding) + output[start - offset:stop - offset])[padding:]
+    return data if output is None else bytes(output)
+
+def _read_raw(f, offset, length):
+    f.seek(offset)
+    while length > 0:
+        data = f.read(min(DECOMPRESSED_CHUNK_SIZE, length))
+        if not data:
+            raise EOFError('unexpected end of file')
+        length -= len(data)
+        yield data
+
+def read_nca(f, ncz, src_offset, start, stop):
+    """Yield the bytes [start, stop) of the NCA a NCZ decompresses to"""
+    if start < NCA_HEADER_SIZE:
+        yield from _read_raw(f, src_offset + start, min(stop, NCA_HEADER_SIZE) - start)
+        start = NCA_HEADER_SIZE
+    if start >= stop:
+        return
+
+    decompressor = ZstdDecompressor()
+    block = ncz.block
+    if block is not None:
+        # Only decompress the blocks the range overlaps
+        while start < stop:
+            block_id = (start - NCA_HEADER_SIZE) // block.size
+            block_start = NCA_HEADER_SIZE + block_id * block.size
+            block_decompressed_size = min(block.size, block.decompressed_size - block_id * block.size)
+            f.seek(block.offsets[block_id])
+            data = f.read(block.compressed_sizes[block_id])
+            if block.compressed_sizes[block_id] < block_decompressed_size:
+                data = decompressor.decompress(data)
+            data = data[start - block_start:stop - block_start]
+            if not data:
+                raise EOFError('unexpected end of compressed block')
+            yield _encrypt(ncz.sections, start, data)
+            start += len(data)
+    else:
+        # Solid compression is a single zstd stream, decompressed from its start
+        f.seek(ncz.stream_offset)
+        reader = decompressor.stream_reader(f)
+        reader.seek(start - NCA_HEADER_SIZE)
+        while start < stop:
+            data = reader.read(min(DECOMPRESSED_CHUNK_SIZE, stop - start))
+            if not data:
+                raise EOFError('unexpected end of compressed stream')
+            yield _encrypt(ncz.sections, start, data)
+            start += len(data)
+
+def read_decompressed(filepath, index, start, stop):
+    """Yield the bytes [start, stop) of the NSP a NSZ file decompresses to, as described by its `index`"""
+    with open(filepath, 'rb') as f:
+        if start < len(index.header):
+            yield index.header[start:stop]
+        for file in index.files:
+            file_start, file_stop = max(start, file.offset), min(stop, file.offset + file.size)
+            if file_start >= file_stop:
+                continue
+            if file.ncz is None:
+                yield from _read_raw(f, file.src_offset + file_start - file.offset, file_stop - file_start)
+            else:
+                yield from read_nca(f, file.ncz, file.src_offset, file_start - file.offset, file_stop - file.offset)
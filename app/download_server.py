@@ -0,0 +1,294 @@
+from werkzeug.datastructures import Authorization
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from types import SimpleNamespace
+from urllib.parse import unquote, urlsplit, parse_qs
+from constants import *
+from settings import load_settings
+from auth import basic_auth
+from db import Files, increment_download_count_throttled
+from downloads import verify_download_token, download_activity
+import asyncio
+import secrets
+import os
+import re
+import logging
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+GAME_PATH_REGEX = re.compile(r'^/api/get_game/(\d+)$')
+MAX_HEADER_SIZE = 64 * 1024
+MAX_RANGES = 32
+REQUEST_TIMEOUT = 60  # seconds to receive a request on an open connection
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+def parse_byte_ranges(range_header, size):
+    """
+    Parse a `Range` header against a file size.
+    Returns None if the header must be ignored (full content is served),
+    or a list of (start, stop) tuples with exclusive stop, empty if not satisfiable.
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in range_header[len('bytes='):].split(','):
+        start_str, sep, stop_str = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not start_str:
+                # Suffix range: last N bytes
+                length = int(stop_str)
+                if length <= 0:
+                    continue
+                start, stop = max(size - length, 0), size
+            else:
+                start = int(start_str)
+                stop = int(stop_str) + 1 if stop_str else None
+        except ValueError:
+            return None
+        if start < 0 or (stop is not None and stop <= start):
+            return None
+        if stop is None:
+            stop = size
+        if start >= size:
+            continue
+        ranges.append((start, min(stop, size)))
+
+    if len(ranges) > MAX_RANGES:
+        # Too many ranges, serve the full content instead
+        return None
+    return ranges
+
+
+class DownloadServer:
+    """
+    Asyncio HTTP server dedicated to file downloads.
+    Files are sent with the zero-copy `loop.sendfile` (os.sendfile), so a single
+    thread can serve a large number of slow concurrent downloads.
+    Only file resolution and authentication, which need the database, run in a small thread pool.
+    """
+    def __init__(self, app, host, port, max_workers=4):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download-server')
+        self._loop = None
+        self._stopped = None
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        self.executor.shutdown(wait=False)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port, limit=MAX_HEADER_SIZE)
+        logger.info(f'Download server listening on {self.host}:{self.port}')
+        async with server:
+            await self._stopped.wait()
+        logger.debug('Download server stopped.')
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        remote_addr = peer[0] if peer else ''
+        try:
+            keep_alive = True
+            while keep_alive:
+                request = await self._read_request(reader, remote_addr)
+                if request is None:
+                    break
+                keep_alive = request.keep_alive
+                try:
+                    await self._handle_request(request, writer)
+                except HttpError as e:
+                    await self._send_error(writer, request, e)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutdown with the connection still open
+            pass
+        except Exception as e:
+            logger.error(f'Download server error with client {remote_addr}: {e}')
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, remote_addr):
+        try:
+            raw = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                # Connection closed between two requests
+                return None
+            raise
+
+        lines = raw.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            return None
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        # Discard any request body
+        content_length = int(headers.get('content-length') or 0)
+        if content_length:
+            await reader.readexactly(content_length)
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        url = urlsplit(target)
+        return SimpleNamespace(
+            method=method.upper(),
+            path=unquote(url.path),
+            query=parse_qs(url.query),
+            version=version,
+            headers=headers,
+            keep_alive=keep_alive,
+            remote_addr=remote_addr,
+        )
+
+    async def _handle_request(self, request, writer):
+        if request.method not in ('GET', 'HEAD'):
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, 'Method not allowed.', {'Allow': 'GET, HEAD'})
+
+        filepath = await self._loop.run_in_executor(self.executor, self._resolve_file, request)
+        logger.debug(f'Download server: {request.remote_addr} {request.method} {request.path} {request.headers.get("range", "")}')
+
+        try:
+            f = open(filepath, 'rb')
+        except OSError:
+            raise HttpError(HTTPStatus.NOT_FOUND, 'File not found.')
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            ranges = parse_byte_ranges(request.headers.get('range'), size)
+            headers = {
+                'Accept-Ranges': 'bytes',
+                'Last-Modified': formatdate(os.fstat(f.fileno()).st_mtime, usegmt=True),
+            }
+
+            if ranges is None:
+                headers['Content-Type'] = 'application/octet-stream'
+                headers['Content-Length'] = str(size)
+                await self._send_head(writer, request, HTTPStatus.OK, headers)
+                parts = [(b'', 0, size)]
+
+            elif not ranges:
+                raise HttpError(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, 'Range not satisfiable.', {'Content-Range': f'bytes */{size}'})
+
+            elif len(ranges) == 1:
+                start, stop = ranges[0]
+                headers['Content-Type'] = 'application/octet-stream'
+                headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+                headers['Content-Length'] = str(stop - start)
+                await self._send_head(writer, request, HTTPStatus.PARTIAL_CONTENT, headers)
+                parts = [(b'', start, stop)]
+
+            else:
+                boundary = secrets.token_hex(16)
+                parts = [
+                    (
+                        (f'\r\n--{boundary}\r\n'
+                         f'Content-Type: application/octet-stream\r\n'
+                         f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode('latin-1'),
+                        start,
+                        stop
+                    )
+                    for start, stop in ranges
+                ]
+                closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+                headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+                headers['Content-Length'] = str(sum(len(p[0]) + p[2] - p[1] for p in parts) + len(closing))
+                await self._send_head(writer, request, HTTPStatus.PARTIAL_CONTENT, headers)
+                parts.append((closing, 0, 0))
+
+            if request.method == 'HEAD':
+                return
+
+            download_activity.begin()
+            try:
+                for part_header, start, stop in parts:
+                    if part_header:
+                        writer.write(part_header)
+                    if stop > start:
+                        await self._loop.sendfile(writer.transport, f, start, stop - start)
+                await writer.drain()
+            finally:
+                download_activity.end()
+
+    def _resolve_file(self, request):
+        """Authenticate the request and resolve the requested file path, consistently with `file_access`."""
+        with self.app.app_context():
+            game_match = GAME_PATH_REGEX.match(request.path)
+            if game_match:
+                file = Files.query.filter_by(id=int(game_match.group(1))).first()
+            elif any(request.path.endswith('.' + ext) for ext in ALLOWED_EXTENSIONS):
+                # Sphaira file paths, looked up by filename
+                file = Files.query.filter_by(filename=request.path.split('/')[-1]).first()
+            else:
+                raise HttpError(HTTPStatus.NOT_FOUND, 'Not found.')
+
+            if file is None:
+                raise HttpError(HTTPStatus.NOT_FOUND, 'File not found.')
+
+            # Requests redirected by the shop were already authenticated and counted
+            token = request.query.get('token', [None])[0]
+            if token and verify_download_token(self.app.config['SECRET_KEY'], token, file.id):
+                return file.filepath
+
+            app_settings = load_settings()
+            if not app_settings['shop']['public']:
+                authorization_header = request.headers.get('authorization', '')
+                auth_request = SimpleNamespace(
+                    authorization=Authorization.from_header(authorization_header),
+                    headers={'Authorization': authorization_header}
+                )
+                auth_success, auth_error, user = basic_auth(auth_request)
+                if not auth_success:
+                    raise HttpError(HTTPStatus.UNAUTHORIZED, auth_error, {'WWW-Authenticate': 'Basic realm="Ownfoil"'})
+                elif not user.has_shop_access():
+                    raise HttpError(HTTPStatus.FORBIDDEN, f'User "{user.user}" does not have access to the shop.')
+
+            increment_download_count_throttled(file.filepath, request.remote_addr)
+            return file.filepath
+
+    async def _send_head(self, writer, request, status, headers):
+        lines = [f'HTTP/1.1 {status.value} {status.phrase}']
+        headers['Date'] = formatdate(usegmt=True)
+        headers['Server'] = 'Ownfoil'
+        headers['Connection'] = 'keep-alive' if request.keep_alive else 'close'
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+    async def _send_error(self, writer, request, error):
+        body = (error.message + '\n').encode('utf-8')
+        headers = dict(error.headers)
+        headers['Content-Type'] = 'text/plain; charset=utf-8'
+        headers['Content-Length'] = str(len(body))
+        await self._send_head(writer, request, error.status, headers)
+        if request.method != 'HEAD':
+            writer.write(body)
+            await writer.drain()
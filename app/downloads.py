@@ -0,0 +1,196 @@
+from flask import Response, current_app, redirect, request, send_from_directory
+from itsdangerous import URLSafeTimedSerializer, BadData
+from urllib.parse import quote
+from constants import *
+from decompression import get_decompression_index, get_decompressed_filename, read_decompressed
+import threading
+import socket
+import time
+import os
+import logging
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+class DownloadActivity:
+    """
+    Downloads being transferred by Ownfoil, shared by all processes: each process serving downloads
+    keeps a file in DOWNLOAD_ACTIVITY_DIR, touched every DOWNLOAD_ACTIVITY_HEARTBEAT_INTERVAL
+    seconds by `heartbeat` and removed once its downloads are complete.
+    Downloads offloaded to a reverse proxy are not tracked.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _get_path(self):
+        # Resolved on each call, worker processes are forked after import
+        return os.path.join(self.directory, f'{socket.gethostname()}-{os.getpid()}')
+
+    def _touch(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._get_path(), 'a'):
+                pass
+            os.utime(self._get_path())
+        except OSError as e:
+            logger.warning(f'Error recording download activity: {e}')
+
+    def begin(self):
+        with self._lock:
+            self.count += 1
+            self._touch()
+
+    def end(self):
+        with self._lock:
+            self.count -= 1
+            if self.count == 0:
+                try:
+                    os.remove(self._get_path())
+                except OSError:
+                    pass
+
+    def heartbeat(self):
+        with self._lock:
+            if self.count:
+                self._touch()
+
+    def is_active(self):
+        """Whether any process is transferring a download"""
+        expired = time.time() - DOWNLOAD_ACTIVITY_TIMEOUT
+        try:
+            with os.scandir(self.directory) as entries:
+                return any(entry.stat().st_mtime > expired for entry in entries)
+        except OSError:
+            return False
+
+download_activity = DownloadActivity(DOWNLOAD_ACTIVITY_DIR)
+
+def track_download(response):
+    """Record the transfer of `response` in `download_activity`, until the server closes it"""
+    download_activity.begin()
+    if response.direct_passthrough:
+        # The body (i.e. a file wrapper sent with sendfile) is passed as is to the server, which closes it once sent
+        close = response.response.close
+
+        def close_and_end():
+            try:
+                close()
+            finally:
+                download_activity.end()
+        response.response.close = close_and_end
+    else:
+        response.call_on_close(download_activity.end)
+    return response
+
+def _get_token_serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt='download')
+
+def generate_download_token(secret_key, file_id):
+    """Generate a signed token allowing to download a file from the download server."""
+    return _get_token_serializer(secret_key).dumps(file_id)
+
+def verify_download_token(secret_key, token, file_id):
+    try:
+        return _get_token_serializer(secret_key).loads(token, max_age=DOWNLOAD_TOKEN_MAX_AGE) == file_id
+    except BadData:
+        return False
+
+def get_download_server_url(server_settings):
+    """Get the base URL of the download server, as reachable by the client of the current request."""
+    if server_settings.get('url'):
+        return server_settings['url'].rstrip('/')
+    host = request.host
+    if host.startswith('['):
+        # IPv6 address
+        hostname = host[:host.index(']') + 1]
+    else:
+        hostname = host.split(':')[0]
+    return f"http://{hostname}:{server_settings['port']}"
+
+def get_offload_path(filepath, mode, mappings):
+    """
+    Translate a library file path to the path expected by the reverse proxy.
+    The longest matching library path in `mappings` wins, so nested libraries can be mapped independently.
+    Returns None if the file cannot be offloaded.
+    """
+    for library_path, internal_path in sorted(mappings.items(), key=lambda m: len(m[0]), reverse=True):
+        library_path = library_path.rstrip('/')
+        if filepath.startswith(library_path + '/'):
+            relative_path = filepath[len(library_path):].lstrip('/')
+            return internal_path.rstrip('/') + '/' + relative_path
+
+    if mode == 'x-sendfile':
+        # X-Sendfile takes a filesystem path, usable as-is when proxy and Ownfoil share the same paths
+        return filepath
+    return None
+
+def is_header_safe(value):
+    """Whether `value` can be sent as is in a header value by the WSGI server"""
+    try:
+        value.encode('latin-1')
+    except UnicodeEncodeError:
+        return False
+    return not any(c in value for c in '\r\n\0')
+
+def send_library_file(file_id, filepath, app_settings):
+    """
+    Serve a library file, either by streaming it from Python, by delegating
+    the transfer to the reverse proxy with X-Accel-Redirect / X-Sendfile headers,
+    or by redirecting the client to the built-in download server.
+    Authentication and download counting must be done by the caller.
+    """
+    downloads_settings = app_settings.get('downloads', {})
+    offload_settings = downloads_settings.get('offload', {})
+    mode = (offload_settings.get('mode') or '').lower()
+
+    if mode in DOWNLOAD_OFFLOAD_HEADERS:
+        offload_path = get_offload_path(filepath, mode, offload_settings.get('mappings') or {})
+        if offload_path is None:
+            logger.warning(f'No offload mapping configured for {filepath}, serving file directly.')
+        elif mode == 'x-sendfile' and not is_header_safe(offload_path):
+            # X-Sendfile takes the raw path, unusable if it cannot be encoded in a header (latin-1) or has line breaks
+            logger.warning(f'{filepath} cannot be passed in a X-Sendfile header, serving file directly.')
+        else:
+            if mode == 'x-accel-redirect':
+                # nginx expects an URI for the internal location
+                offload_path = quote(offload_path)
+            response = Response(mimetype='application/octet-stream')
+            response.headers[DOWNLOAD_OFFLOAD_HEADERS[mode]] = offload_path
+            return response
+
+    server_settings = downloads_settings.get('server', {})
+    if server_settings.get('enabled'):
+        token = generate_download_token(current_app.config['SECRET_KEY'], file_id)
+        return redirect(f'{get_download_server_url(server_settings)}/api/get_game/{file_id}?token={token}', code=307)
+
+    filedir, filename = os.path.split(filepath)
+    return track_download(send_from_directory(filedir, filename))
+
+def send_decompressed_file(filepath):
+    """
+    Stream the NSP a NSZ file decompresses to, on the fly. Range requests only decompress
+    the zstd blocks they overlap, using the decompression index of the file.
+    Authentication and download counting must be done by the caller.
+    """
+    index = get_decompression_index(filepath)
+    size = index.size
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(get_decompressed_filename(os.path.basename(filepath)))}",
+    }
+
+    start, stop, status = 0, size, 200
+    # Multiple ranges are not supported, the full content is served instead
+    if request.range is not None and len(request.range.ranges) == 1:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        (start, stop), status = byte_range, 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    headers['Content-Length'] = str(stop - start)
+
+    return track_download(Response(read_decompressed(filepath, index, start, stop), status=status, headers=headers,
+                                   mimetype='application/octet-stream'))
@@ -1,32 +1,307 @@
 from constants import *
 from utils import *
+import threading
 import time, os
-from watchdog.observers.polling import PollingObserver
-from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.api import BaseObserver, EventEmitter
+from watchdog.observers.polling import PollingObserverVFS
+from watchdog.events import FileSystemEventHandler, FileCreatedEvent, FileDeletedEvent, FileMovedEvent, DirDeletedEvent
 from types import SimpleNamespace
+from functools import partial
 import logging
 
 # Retrieve main logger
 logger = logging.getLogger('main')
 
+def get_filesystem_type(path):
+    """Type of the filesystem containing `path` from /proc/mounts, None if unknown (i.e. not on Linux)"""
+    try:
+        with open('/proc/mounts', 'r') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return None
+
+    path = os.path.realpath(path)
+    fs_type = None
+    longest_mount_point = -1
+    for mount_point, mount_fs_type in mounts:
+        # Mount points with spaces are octal-escaped in /proc/mounts
+        mount_point = mount_point.encode().decode('unicode_escape')
+        if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > longest_mount_point:
+            fs_type = mount_fs_type
+            longest_mount_point = len(mount_point)
+    return fs_type
+
+def detect_watcher_mode(path):
+    """Native events for local filesystems, polling for filesystems not reporting changes made by other machines"""
+    fs_type = get_filesystem_type(path)
+    if fs_type in WATCHER_POLLING_FILESYSTEMS or (fs_type or '').split('.')[-1] in WATCHER_POLLING_FILESYSTEMS:
+        return 'polling', fs_type
+    return 'native', fs_type
+
+class StatCounter:
+    """stat and directory listing functions of a polling observer, counting their calls"""
+    def __init__(self):
+        self.stat_calls = 0
+        self.listdir_calls = 0
+
+    def stat(self, path):
+        self.stat_calls += 1
+        return os.stat(path)
+
+    def listdir(self, path):
+        self.listdir_calls += 1
+        return os.scandir(path)
+
+def is_library_file(path):
+    return any(path.endswith(ext) for ext in ALLOWED_EXTENSIONS)
+
+class CompactPollingEmitter(EventEmitter):
+    """
+    Polling emitter keeping only the mtime of each directory, instead of a snapshot
+    of every file. Each poll stats the directories and only lists those whose mtime changed, their
+    files being compared with the files known in the library (`known_files`). Poll cost and memory
+    thus scale with the number of directories and the changes, not with the number of files.
+    Files modified in place are not reported, as they do not change their directory mtime.
+    """
+    def __init__(self, event_queue, watch, timeout=1, event_filter=None, known_files=None, counter=None):
+        super().__init__(event_queue, watch, timeout=timeout, event_filter=event_filter)
+        self._known_files = known_files  # known_files(directory, recursive) -> {path: size}
+        self._stat = counter.stat if counter else os.stat
+        self._listdir = counter.listdir if counter else os.scandir
+        self._directories = {}  # directory -> mtime_ns
+        self._subdirectories = {}  # directory -> set of subdirectories
+        self._racy_directories = set()  # listed within the mtime granularity of their last change
+        # Changes reported but not yet recorded in the library, applied over `known_files`
+        self._reported_created = {}  # path -> size
+        self._reported_deleted = set()
+        self._lock = threading.Lock()
+
+    def on_thread_start(self):
+        # Files present at startup are handled by the library scan
+        self._add_tree(self.watch.path, None)
+
+    def queue_events(self, timeout):
+        # timeout behaves like an interval for polling emitters
+        if self.stopped_event.wait(timeout):
+            return
+
+        with self._lock:
+            if not self.should_keep_running():
+                return
+            try:
+                self._stat(self.watch.path)
+            except OSError:
+                self.queue_event(DirDeletedEvent(self.watch.path))
+                self.stop()
+                return
+
+            created = {}
+            deleted = {}
+            for directory, mtime_ns in list(self._directories.items()):
+                if directory not in self._directories:
+                    # Removed along with its parent
+                    continue
+                try:
+                    stat = self._stat(directory)
+                except OSError:
+                    # Handled when listing its parent
+                    continue
+                if stat.st_mtime_ns != mtime_ns or directory in self._racy_directories:
+                    self._list_directory(directory, stat, created, deleted)
+
+            self._queue_file_events(created, deleted)
+
+    @property
+    def directory_count(self):
+        return len(self._directories)
+
+    def _record_directory(self, directory, stat):
+        self._directories[directory] = stat.st_mtime_ns
+        # A change within the same mtime tick as the listing would go unnoticed, list it again next poll
+        if time.time_ns() - stat.st_mtime_ns < WATCHER_MTIME_GRANULARITY * 1e9:
+            self._racy_directories.add(directory)
+        else:
+            self._racy_directories.discard(directory)
+
+    def _scan(self, directory):
+        """List a directory, returns its subdirectories and library files"""
+        subdirectories = set()
+        files = set()
+        with self._listdir(directory) as entries:
+            for entry in entries:
+                if entry.name == TEMPORARY_DIRECTORY_NAME:
+                    continue
+                if entry.is_dir():
+                    subdirectories.add(entry.path)
+                elif is_library_file(entry.name):
+                    files.add(entry.path)
+        return subdirectories, files
+
+    def _add_tree(self, directory, created):
+        """Start tracking a directory and its subdirectories, their files are reported as created if `created` is not None"""
+        try:
+            stat = self._stat(directory)
+            subdirectories, files = self._scan(directory)
+        except OSError:
+            return
+        self._record_directory(directory, stat)
+        self._subdirectories[directory] = subdirectories
+        if created is not None:
+            created.update(dict.fromkeys(files))
+        for subdirectory in subdirectories:
+            self._add_tree(subdirectory, created)
+
+    def _remove_tree(self, directory, deleted):
+        """Stop tracking a removed directory, its known files are reported as deleted"""
+        for subdirectory in self._subdirectories.pop(directory, ()):
+            self._remove_tree(subdirectory, None)
+        self._directories.pop(directory, None)
+        self._racy_directories.discard(directory)
+        if deleted is not None:
+            deleted.update(self._get_known_files(directory, True))
+
+    def _list_directory(self, directory, stat, created, deleted):
+        try:
+            subdirectories, files = self._scan(directory)
+        except OSError:
+            return
+        self._record_directory(directory, stat)
+
+        known_subdirectories = self._subdirectories.get(directory, set())
+        for subdirectory in known_subdirectories - subdirectories:
+            self._remove_tree(subdirectory, deleted)
+        for subdirectory in subdirectories - known_subdirectories:
+            self._add_tree(subdirectory, created)
+        self._subdirectories[directory] = subdirectories
+
+        known_files = self._get_known_files(directory, False)
+        created.update(dict.fromkeys(files - known_files.keys()))
+        deleted.update({path: size for path, size in known_files.items() if path not in files})
+
+    def _get_known_files(self, directory, recursive):
+        known_files = self._known_files(directory, recursive)
+        prefix = os.path.join(directory, '')
+
+        def in_scope(path):
+            return path.startswith(prefix) and (recursive or os.path.dirname(path) == directory)
+
+        for path in [p for p in self._reported_created if in_scope(p)]:
+            if path in known_files:
+                del self._reported_created[path]
+            else:
+                known_files[path] = self._reported_created[path]
+        for path in [p for p in self._reported_deleted if in_scope(p)]:
+            if path in known_files:
+                del known_files[path]
+            else:
+                self._reported_deleted.discard(path)
+        return known_files
+
+    def _queue_file_events(self, created, deleted):
+        # Files deleted and created with the same name and size in the same poll were moved
+        deleted_by_name = {}
+        for path, size in deleted.items():
+            deleted_by_name.setdefault((os.path.basename(path), size), []).append(path)
+        events = []
+        for path in created:
+            try:
+                size = self._stat(path).st_size
+            except OSError:
+                continue
+            self._reported_created[path] = size
+            self._reported_deleted.discard(path)
+            candidates = deleted_by_name.get((os.path.basename(path), size))
+            if candidates:
+                src_path = candidates.pop()
+                del deleted[src_path]
+                self._reported_created.pop(src_path, None)
+                self._reported_deleted.add(src_path)
+                events.append(FileMovedEvent(src_path, path))
+            else:
+                events.append(FileCreatedEvent(path))
+
+        # Deletions first: renames are reported as the deletion of their source then the creation of their destination
+        for path in deleted:
+            self._reported_created.pop(path, None)
+            self._reported_deleted.add(path)
+            self.queue_event(FileDeletedEvent(path))
+        for event in events:
+            self.queue_event(event)
+
+class CompactPollingObserver(BaseObserver):
+    def __init__(self, known_files, counter=None, polling_interval=1):
+        emitter_cls = partial(CompactPollingEmitter, known_files=known_files, counter=counter)
+        super().__init__(emitter_cls, timeout=polling_interval)
 
 class Watcher:
-    def __init__(self, callback):
+    """
+    Watch the library directories, with one observer per library: native filesystem events
+    (i.e. inotify) or periodic polling, see the `library/watcher` settings.
+    """
+    def __init__(self, callback, settings=None, known_files=None):
         self.directories = set()  # Use a set to store directories
         self.callback = callback
-        self.event_handler = Handler(self.callback)
-        self.observer = PollingObserver()
-        self.scheduler_map = {}
+        # known_files(directory, recursive) -> {path: size} of the library files, enables compact polling
+        self.known_files = known_files
+        self.settings = settings or DEFAULT_SETTINGS['library']['watcher']
+        self.event_handler = Handler(self.callback, is_compared_with_library=self._is_compared_with_library)
+        self.observers = {}  # directory -> observer info
+        self.running = False
+        self._lock = threading.Lock()
 
     def run(self):
-        self.observer.start()
-        logger.debug('Successfully started observer.')
+        with self._lock:
+            self.running = True
+            for directory in self.observers:
+                self._start_observer(directory)
+        logger.debug('Successfully started observers.')
 
     def stop(self):
-        logger.debug('Stopping observer...')
-        self.observer.stop()
-        self.observer.join()
-        logger.debug('Successfully stopped observer.')
+        logger.debug('Stopping observers...')
+        with self._lock:
+            self.running = False
+            for observer_info in self.observers.values():
+                self._stop_observer(observer_info)
+        logger.debug('Successfully stopped observers.')
+
+    def _get_mode(self, directory):
+        mode = self.settings.get('modes', {}).get(directory) or self.settings['mode']
+        if mode == 'auto':
+            mode, fs_type = detect_watcher_mode(directory)
+            logger.info(f'Using {mode} watcher for {directory} (filesystem: {fs_type or "unknown"}).')
+        return mode
+
+    def _create_observer(self, directory, mode):
+        counter = None
+        if mode == 'polling':
+            counter = StatCounter()
+            if self.known_files:
+                observer = CompactPollingObserver(self.known_files, counter, polling_interval=self.settings['polling_interval'])
+            else:
+                observer = PollingObserverVFS(counter.stat, counter.listdir, polling_interval=self.settings['polling_interval'])
+        else:
+            observer = Observer()
+        observer.schedule(self.event_handler, directory, recursive=True)
+        return SimpleNamespace(mode=mode, observer=observer, counter=counter)
+
+    def _start_observer(self, directory):
+        observer_info = self.observers[directory]
+        try:
+            observer_info.observer.start()
+        except OSError as e:
+            if observer_info.mode == 'polling':
+                raise
+            # i.e. inotify watches or instances limit reached
+            logger.warning(f'Native watcher unavailable for {directory} ({e}), falling back to polling.')
+            observer_info = self._create_observer(directory, 'polling')
+            self.observers[directory] = observer_info
+            observer_info.observer.start()
+
+    def _stop_observer(self, observer_info):
+        if observer_info.observer.is_alive():
+            observer_info.observer.stop()
+            observer_info.observer.join()
 
     def add_directory(self, directory):
         if directory not in self.directories:
@@ -34,8 +309,10 @@ class Watcher:
                 logger.warning(f'Directory {directory} does not exist, not added to watchdog.')
                 return False
             logger.info(f'Adding directory {directory} to watchdog.')
-            task = self.observer.schedule(self.event_handler, directory, recursive=True)
-            self.scheduler_map[directory] = task
+            with self._lock:
+                self.observers[directory] = self._create_observer(directory, self._get_mode(directory))
+                if self.running:
+                    self._start_observer(directory)
             self.directories.add(directory)
             self.event_handler.add_directory(directory)
             return True
@@ -44,9 +321,9 @@ class Watcher:
     def remove_directory(self, directory):
         logger.debug(f'Removing {directory} from watchdog monitoring...')
         if directory in self.directories:
-            if directory in self.scheduler_map:
-                self.observer.unschedule(self.scheduler_map[directory])
-                del self.scheduler_map[directory]
+            with self._lock:
+                if directory in self.observers:
+                    self._stop_observer(self.observers.pop(directory))
             self.directories.remove(directory)
             logger.info(f'Removed {directory} from watchdog monitoring.')
             return True
@@ -54,68 +331,262 @@ class Watcher:
             logger.info(f'{directory} not in watchdog, nothing to do.')
         return False
 
-import threading # Keep threading for the lock
+    def _is_compared_with_library(self, path):
+        """
+        Whether changes under `path` are detected by comparing the disk with the library (compact polling).
+        The operations made by Ownfoil are recorded in the library, so they are not reported and not to be ignored.
+        """
+        directories = [directory for directory in list(self.observers) if path.startswith(os.path.join(directory, ''))]
+        if not directories:
+            return False
+        observer_info = self.observers.get(max(directories, key=len))
+        return observer_info is not None and isinstance(observer_info.observer, CompactPollingObserver)
+
+    def ignore_move(self, src_path, dest_path):
+        """Ignore the events of a file move made by Ownfoil, call before moving the file."""
+        self.event_handler.ignore_event(src_path, dest_path)
+
+    def ignore_moves(self, moves):
+        """Ignore the events of several (src_path, dest_path) file moves made by Ownfoil, call before moving the files."""
+        self.event_handler.ignore_events(moves)
+
+    def unignore_moves(self, moves):
+        self.event_handler.unignore_events(moves)
+
+    def ignore_deletes(self, paths):
+        """Ignore the events of several file deletions made by Ownfoil, call before deleting the files."""
+        self.event_handler.ignore_events([(path, '') for path in paths])
+
+    def unignore_deletes(self, paths):
+        self.event_handler.unignore_events([(path, '') for path in paths])
+
+    def ignore_delete(self, path):
+        """Ignore the event of a file deletion made by Ownfoil, call before deleting the file."""
+        self.event_handler.ignore_event(path)
+
+    def unignore_move(self, src_path, dest_path):
+        self.event_handler.unignore_event(src_path, dest_path)
+
+    def unignore_delete(self, path):
+        self.event_handler.unignore_event(path)
+
+    def get_stats(self):
+        """Observer mode of each library, with the stat and directory listing calls made by polling observers"""
+        return {
+            directory: {
+                'mode': observer_info.mode,
+                'stat_calls': observer_info.counter.stat_calls if observer_info.counter else 0,
+                'listdir_calls': observer_info.counter.listdir_calls if observer_info.counter else 0,
+                'directories': sum(emitter.directory_count for emitter in observer_info.observer.emitters
+                    if isinstance(emitter, CompactPollingEmitter)),
+            }
+            for directory, observer_info in list(self.observers.items())
+        }
+
 class Handler(FileSystemEventHandler):
-    def __init__(self, callback, stability_duration=5):
+    """
+    Coalesce the file events of the libraries and pass them to `callback` in batches, one per library.
+    Deletions are batched for WATCHER_BATCH_WINDOW seconds, created, modified and moved files once
+    their size has been stable for `stability_duration` seconds (i.e. copies are complete), along with
+    the files becoming stable within the following batch window.
+    Successive events on the same path are merged into its last state.
+    """
+    def __init__(self, callback, stability_duration=5, is_compared_with_library=None):
         self._raw_callback = callback  # Callback to invoke for stable files
         self.directories = []
         self.stability_duration = stability_duration  # Stability duration in seconds
-        self.tracked_files = {}  # Tracks files being copied
-        self.debounced_check_final = self._debounce(self._check_file_stability, stability_duration)
-        self.ignored_events_tuples = set() # Set to store (src, dest) paths of file operations to ignore
-        self.ignored_events_lock = threading.Lock() # Lock for thread-safe access to ignored_events_tuples
+        self._lock = threading.Lock()
+        self._callback_lock = threading.Lock()  # Batches are passed to the callback one at a time
+        self.tracked_files = {}  # path -> created, modified or moved event waiting for the file to be stable
+        self.deleted_files = {}  # path -> deleted event waiting for the batch window
+        self._flush_timer = None
+        self._flush_due = None
+        # Operations made by Ownfoil whose events are ignored, as (src, dest) pairs indexed
+        # by source and destination path, dest is empty for deletions. Only the sides of the operations
+        # reported as events are recorded: paths for which `is_compared_with_library(path)` is true are
+        # polled against the library, which Ownfoil updates itself, and never report its operations.
+        self.is_compared_with_library = is_compared_with_library or (lambda path: False)
+        self.ignored_events_lock = threading.Lock()
+        self._ignored_by_src = {}
+        self._ignored_by_dest = {}
 
     def add_directory(self, directory):
         if directory not in self.directories:
             self.directories.append(directory)
 
-    def _debounce(self, func, wait):
-        """Debounce decorator for the stability check."""
-        @debounce(wait)
-        def debounced():
-            func()
-        return debounced
+    def ignore_event(self, src_path, dest_path=''):
+        """Ignore the events of a move from `src_path` to `dest_path`, or of the deletion of `src_path`."""
+        self.ignore_events([(src_path, dest_path)])
+
+    def ignore_events(self, operations):
+        """Ignore the events of several (src_path, dest_path) operations, see `ignore_event`."""
+        with self.ignored_events_lock:
+            for src_path, dest_path in operations:
+                if not self.is_compared_with_library(src_path):
+                    self._ignored_by_src.setdefault(src_path, set()).add(dest_path)
+                if dest_path and not self.is_compared_with_library(dest_path):
+                    self._ignored_by_dest.setdefault(dest_path, set()).add(src_path)
+
+    def unignore_events(self, operations):
+        with self.ignored_events_lock:
+            for src_path, dest_path in operations:
+                self._discard_ignored(src_path, dest_path)
+
+    def unignore_event(self, src_path, dest_path=''):
+        """Stop ignoring an operation, i.e. when it failed."""
+        with self.ignored_events_lock:
+            self._discard_ignored(src_path, dest_path)
+
+    def _discard_ignored(self, src_path, dest_path):
+        self._discard_ignored_src(src_path, dest_path)
+        if dest_path:
+            self._discard_ignored_dest(src_path, dest_path)
+
+    def _discard_ignored_src(self, src_path, dest_path):
+        dests = self._ignored_by_src.get(src_path)
+        if dests is not None:
+            dests.discard(dest_path)
+            if not dests:
+                del self._ignored_by_src[src_path]
+
+    def _discard_ignored_dest(self, src_path, dest_path):
+        srcs = self._ignored_by_dest.get(dest_path)
+        if srcs is not None:
+            srcs.discard(src_path)
+            if not srcs:
+                del self._ignored_by_dest[dest_path]
+
+    def _is_ignored(self, event):
+        """
+        Check if an event comes from an operation made by Ownfoil, forgetting the operation once fully seen.
+        Moves are reported as a single moved event by native observers, but as created and deleted events
+        in any order when polling: each side of the move is then forgotten once its own event is seen.
+        """
+        with self.ignored_events_lock:
+            if event.event_type == 'moved':
+                if event.dest_path in self._ignored_by_src.get(event.src_path, ()):
+                    self._discard_ignored(event.src_path, event.dest_path)
+                    return True
+            elif event.event_type == 'deleted':
+                dests = self._ignored_by_src.get(event.src_path)
+                if dests:
+                    if '' in dests:
+                        # Internal delete
+                        self._discard_ignored_src(event.src_path, '')
+                    else:
+                        # Source of an internal move, preferably one whose destination was already seen
+                        dest_path = min(dests, key=lambda dest: (event.src_path in self._ignored_by_dest.get(dest, ()), dest))
+                        self._discard_ignored_src(event.src_path, dest_path)
+                    return True
+            elif event.event_type == 'created':
+                srcs = self._ignored_by_dest.get(event.src_path)
+                if srcs:
+                    # Destination of an internal move, preferably one whose source was already seen
+                    # deleted, or else no longer exists (i.e. not a copy still in progress)
+                    src_path = min(srcs, key=lambda src: (
+                        event.src_path in self._ignored_by_src.get(src, ()),
+                        os.path.lexists(src),
+                        src
+                    ))
+                    self._discard_ignored_dest(src_path, event.src_path)
+                    return True
+        return False
+
+    def _schedule_flush(self, delay):
+        """Arm the flush timer to fire in `delay` seconds at the latest, must be called with the lock held."""
+        due = time.monotonic() + delay
+        if self._flush_timer is not None:
+            if self._flush_due <= due:
+                return
+            self._flush_timer.cancel()
+        self._flush_due = due
+        self._flush_timer = timer_service.schedule(delay, self._flush)
 
     def _track_file(self, event):
-        """Start or update tracking for a file."""
+        """Start or update tracking of a created, modified or moved file, merged with its previous events."""
+        file_path = event.dest_path if event.type == 'moved' else event.src_path
+        now = time.monotonic()
         if event.type == 'moved':
-            file_path = event.dest_path
-        else:
-            file_path = event.src_path
-        current_size = os.path.getsize(file_path)
-        if file_path not in self.tracked_files:
-            event.size = current_size
-            event.timestamp = time.time()
-            self.tracked_files[file_path] = event
-        else:
-            self.tracked_files[file_path].size = current_size
-            self.tracked_files[file_path].timestamp = time.time()
-
-    def _check_file_stability(self):
-        """Check for stable files and invoke the callback."""
-        now = time.time()
-        stable_files = []
-
-        # Check all tracked files
-        for file_path, file_data in list(self.tracked_files.items()):
-            if not os.path.exists(file_path):
-                # If the file no longer exists, stop tracking it
-                del self.tracked_files[file_path]
-                continue
-            current_size = os.path.getsize(file_path)
-            if current_size == file_data.size and (now - file_data.timestamp) >= self.stability_duration:
-                stable_files.append(file_data)
+            previous = self.tracked_files.pop(event.src_path, None)
+            if previous is not None:
+                # Moved again before being reported: keep the original event at its new path
+                if previous.type == 'moved':
+                    previous.dest_path = file_path
+                else:
+                    previous.src_path = previous.dest_path = file_path
+                event = previous
+        elif file_path in self.tracked_files:
+            event = self.tracked_files[file_path]
+
+        try:
+            event.size = os.path.getsize(file_path)
+        except OSError:
+            # Already gone, its deletion will be reported
+            return
+        event.timestamp = now
+        self.tracked_files[file_path] = event
+        # Files changed within the batch window are then flushed together
+        self._schedule_flush(self.stability_duration + WATCHER_BATCH_WINDOW)
+
+    def _delete_file(self, event):
+        """Record a deletion, replacing the pending events of the path."""
+        previous = self.tracked_files.pop(event.src_path, None)
+        if previous is not None and previous.type == 'moved':
+            # Deleted after a move not reported yet, the library only knows the source path
+            event.src_path = previous.src_path
+        self.deleted_files[event.src_path] = event
+        self._schedule_flush(WATCHER_BATCH_WINDOW)
+
+    def _flush(self):
+        """Pass the pending deletions and the files now stable to the callback, in one batch per library."""
+        batches = {}
+        with self._lock:
+            self._flush_timer = None
+            now = time.monotonic()
+            for event in self.deleted_files.values():
+                batches.setdefault(event.directory, []).append(event)
+            self.deleted_files.clear()
+
+            next_check = None
+            for file_path, event in list(self.tracked_files.items()):
+                remaining = event.timestamp + self.stability_duration - now
+                if remaining > 0:
+                    next_check = remaining if next_check is None else min(next_check, remaining)
+                    continue
+                try:
+                    current_size = os.path.getsize(file_path)
+                except OSError:
+                    # If the file no longer exists, stop tracking it
+                    del self.tracked_files[file_path]
+                    continue
+                if current_size != event.size:
+                    # Still being copied
+                    event.size = current_size
+                    event.timestamp = now
+                    next_check = self.stability_duration if next_check is None else min(next_check, self.stability_duration)
+                    continue
+                batches.setdefault(event.directory, []).append(event)
                 del self.tracked_files[file_path]  # Stop tracking stable file
 
-        # Trigger the callback for all stable files
-        if stable_files:
-            self._raw_callback(stable_files)
+            if next_check is not None:
+                self._schedule_flush(next_check + WATCHER_BATCH_WINDOW)
+
+        with self._callback_lock:
+            for directory, events in batches.items():
+                try:
+                    self._raw_callback(events)
+                except Exception as e:
+                    logger.exception(f'Error processing file events of {directory}: {e}')
 
     def collect_event(self, source_event, directory):
-        """Track file events and trigger the stability check."""
+        """Queue a library file event, merged with the pending events of the same path."""
         if source_event.is_directory:
             return
 
+        # Files being written by Ownfoil, only their rename to a library file is reported
+        if is_temporary_path(source_event.src_path) and not (source_event.dest_path and not is_temporary_path(source_event.dest_path)):
+            return
+
         if not any(source_event.src_path.endswith(ext) or source_event.dest_path.endswith(ext) for ext in ALLOWED_EXTENSIONS):
             return
 
@@ -129,40 +600,15 @@ class Handler(FileSystemEventHandler):
         if library_event.type == 'moved' and not any(library_event.dest_path.endswith(ext) for ext in ALLOWED_EXTENSIONS):
             library_event.type = 'deleted'
 
-        if library_event.type == 'deleted':
-            self._raw_callback([library_event])
-
-        else:
-            # Track file on create or modify
-            self._track_file(library_event)
-            self.debounced_check_final()
-
-        self._check_file_stability()
+        with self._lock:
+            if library_event.type == 'deleted':
+                self._delete_file(library_event)
+            elif library_event.type in ('created', 'modified', 'moved'):
+                self._track_file(library_event)
 
     def on_any_event(self, event):
-        with self.ignored_events_lock:
-            if event.event_type == 'moved':
-                move_tuple = (event.src_path, event.dest_path)
-                if move_tuple in self.ignored_events_tuples:
-                    self.ignored_events_tuples.remove(move_tuple)
-                    # logger.debug(f"Ignoring internally generated 'moved' event: {event.src_path} -> {event.dest_path}")
-                    return
-            elif event.event_type == 'deleted':
-                # Check if this deleted event is part of an internally generated move
-                for src, dest in list(self.ignored_events_tuples): # Iterate over a copy to allow modification
-                    if event.src_path == src:
-                        if not dest:
-                            # This is an internal delete event
-                            self.ignored_events_tuples.remove((src, dest))
-                        # logger.debug(f"Ignoring internally generated 'deleted' event (part of move): {event.src_path}")
-                        return
-            elif event.event_type == 'created':
-                # Check if this created event is part of an internally generated move
-                for src, dest in list(self.ignored_events_tuples): # Iterate over a copy to allow modification
-                    if event.src_path == dest:
-                        self.ignored_events_tuples.remove((src, dest))
-                        # logger.debug(f"Ignoring internally generated 'created' event (part of move): {event.src_path}")
-                        return
+        if self._is_ignored(event):
+            return
 
         for directory in self.directories:
             if event.src_path.startswith(directory):
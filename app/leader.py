@@ -0,0 +1,84 @@
+from constants import *
+from db import acquire_lease, release_lease, get_lease_holder
+import threading
+import secrets
+import socket
+import time
+import os
+import logging
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+class LeaderElector:
+    """
+    Lease-based leader election between the Ownfoil processes sharing the same database.
+    The leader renews its lease every LEADER_LEASE_RENEW_INTERVAL seconds, the other
+    processes take it over once it has not been renewed for LEADER_LEASE_DURATION seconds.
+    `on_elected` and `on_demoted` start and stop the services only the leader runs.
+    """
+    def __init__(self, app, on_elected, on_demoted, lease_name=LEADER_LEASE_NAME):
+        self.app = app
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.lease_name = lease_name
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}'
+        self.is_leader = False
+        self._lease_expires = 0
+        self._stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # First election is done synchronously, so the leader starts its services right away
+        self._elect()
+        if not self.is_leader:
+            with self.app.app_context():
+                logger.info(f'Background services are run by another Ownfoil process ({get_lease_holder(self.lease_name)}), waiting for its lease to expire.')
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self.thread:
+            self.thread.join()
+        if self.is_leader:
+            self._demote()
+            try:
+                with self.app.app_context():
+                    release_lease(self.lease_name, self.holder)
+            except Exception as e:
+                logger.error(f'Error releasing leader lease: {e}')
+
+    def _run(self):
+        while not self._stopped.wait(LEADER_LEASE_RENEW_INTERVAL):
+            self._elect()
+
+    def _elect(self):
+        attempt_time = time.monotonic()
+        try:
+            with self.app.app_context():
+                acquired = acquire_lease(self.lease_name, self.holder, LEADER_LEASE_DURATION)
+            if acquired:
+                self._lease_expires = attempt_time + LEADER_LEASE_DURATION
+        except Exception as e:
+            # Database busy or unavailable: the lease we hold is still valid until it expires
+            logger.error(f'Error renewing leader lease: {e}')
+            acquired = self.is_leader and time.monotonic() < self._lease_expires
+
+        if acquired and not self.is_leader:
+            logger.info(f'Elected to run background services ({self.holder}).')
+            self.is_leader = True
+            try:
+                self.on_elected()
+            except Exception as e:
+                logger.error(f'Error starting background services: {e}')
+        elif not acquired and self.is_leader:
+            logger.warning('Leader lease lost, stopping background services.')
+            self._demote()
+
+    def _demote(self):
+        self.is_leader = False
+        try:
+            self.on_demoted()
+        except Exception as e:
+            logger.error(f'Error stopping background services: {e}')
@@ -1,16 +1,123 @@
 import hashlib
 import os
+import errno
+import json
 import shutil
 from constants import *
 from db import *
 import titles as titles_lib
 import datetime
+import threading
 import sys
 from pathlib import Path
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from utils import *
 from settings import load_settings
+from mover import file_mover, get_temporary_path
+from tasks import submit_task
+from decompression import get_decompressed_size
 from db import update_file_path 
 
+class LibraryChanges:
+    """
+    Files and titles changed since the last run of the library pipeline, each stage of the
+    next run only processes them. A full run processes the whole library, it is done at startup
+    and requested when the settings, keys or TitleDB change.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._full = True
+        self._check_existence = False
+        self._filepaths = set()
+        self._title_ids = set()
+
+    def add_files(self, filepaths):
+        with self._lock:
+            self._filepaths.update(filepaths)
+
+    def add_titles(self, title_ids):
+        with self._lock:
+            self._title_ids.update(title_ids)
+
+    def request_full_run(self):
+        with self._lock:
+            self._full = True
+
+    def request_existence_check(self):
+        """Check that all files still exist, i.e. after a scan since events may have been missed"""
+        with self._lock:
+            self._check_existence = True
+
+    def pop(self):
+        """Get and reset the changes, to be processed by a pipeline run"""
+        with self._lock:
+            changes = SimpleNamespace(
+                full=self._full,
+                check_existence=self._check_existence,
+                filepaths=self._filepaths,
+                title_ids=self._title_ids
+            )
+            self._full = False
+            self._check_existence = False
+            self._filepaths = set()
+            self._title_ids = set()
+        return changes
+
+    def restore(self, changes):
+        """Put back the changes of a failed pipeline run"""
+        with self._lock:
+            self._full = self._full or changes.full
+            self._check_existence = self._check_existence or changes.check_existence
+            self._filepaths.update(changes.filepaths)
+            self._title_ids.update(changes.title_ids)
+
+library_changes = LibraryChanges()
+
+# Paths of the libraries whose root vanished (i.e. unmounted share), their files are kept until they are available again
+suspended_libraries = set()
+_suspended_libraries_lock = threading.Lock()
+
+def is_library_root_available(library_path):
+    """A library root is unavailable when missing, or empty while files are known in it (i.e. unmounted mount point)"""
+    try:
+        with os.scandir(library_path) as entries:
+            if next(entries, None) is not None:
+                return True
+    except OSError:
+        return False
+    library_id = get_library_id(library_path)
+    return library_id is None or not has_library_files(library_id)
+
+def check_library_available(library_path):
+    """Suspend a library whose root vanished instead of removing all its files, returns whether it is available"""
+    available = is_library_root_available(library_path)
+    with _suspended_libraries_lock:
+        if not available and library_path not in suspended_libraries:
+            suspended_libraries.add(library_path)
+            logger.warning(f'Library {library_path} is unavailable or empty, suspended until it is available again. Remove it from the settings to delete its files from the library.')
+    return available and library_path not in suspended_libraries
+
+def get_available_library_ids():
+    return [library.id for library in get_libraries() if check_library_available(library.path)]
+
+def resume_libraries(app, watcher):
+    """Resume the suspended libraries available again, returns their paths"""
+    resumed = []
+    with app.app_context():
+        for library_path in list(suspended_libraries):
+            if not is_library_root_available(library_path):
+                continue
+            with _suspended_libraries_lock:
+                suspended_libraries.discard(library_path)
+            # The observer stops when its directory vanishes
+            watcher.remove_directory(library_path)
+            watcher.add_directory(library_path)
+            logger.info(f'Library {library_path} is available again, resumed.')
+            resumed.append(library_path)
+    return resumed
+
 def sanitize_filename(name, windows_compatible=False):
     if sys.platform == 'win32' or windows_compatible:
         forbidden_chars = FORBIDDEN_CHARS_WINDOWS
@@ -30,98 +137,234 @@ def sanitize_filename(name, windows_compatible=False):
 
     return sanitized
 
-def organize_file(file_obj, library_path, organizer_settings, watcher):
-    try:
-        templates = organizer_settings['templates']
-        
-        current_filepath = file_obj.filepath
-        
-        # Get the associated app for the file
-        app = file_obj.apps[0] if file_obj.apps else None
-        if not app:
-            logger.warning(f"No app associated with file {file_obj.filename}. Skipping organization.")
-            return
+def get_organizer_inputs(file_obj, library_path, organizer_settings):
+    """Template and values the organized path of a file is formatted from, None if it cannot be organized"""
+    templates = organizer_settings['templates']
 
-        template = _get_template_for_file(file_obj, app, templates)
+    # Get the associated app for the file
+    app = file_obj.apps[0] if file_obj.apps else None
+    if not app:
+        logger.warning(f"No app associated with file {file_obj.filename}. Skipping organization.")
+        return None
 
-        # Retrieve data for template formatting
-        format_data = {}
-        # Get title name from the associated title_id
-        title_info = titles_lib.get_game_info(app.title.title_id)
-        if title_info['name'] == 'Unrecognized':
-            logger.warning(f"No title info associated with file {file_obj.filename}. Skipping organization.")
-            return
-        format_data["extension"] = file_obj.extension
-        format_data["titleId"] = app.title.title_id
-        format_data["titleName"] = title_info['name']
-        if not file_obj.multicontent:
-            format_data["appId"] = app.app_id
-            format_data["appVersion"] = app.app_version
-            format_data["patchLevel"] = titles_lib.get_update_number(app.app_version)
-
-            game_info = titles_lib.get_game_info(app.app_id)
-            if app.app_type == APP_TYPE_DLC:
-                format_data["appName"] = game_info['name']
-            else:
-                format_data["appName"] = title_info['name']
-        
-        # Format the new relative path and remove leading slash if present
-        raw_path = template.format(**format_data).lstrip('/')
-        windows_compatible = organizer_settings.get('windows_compatible', False)
-        safe_parts = [sanitize_filename(part, windows_compatible) for part in Path(raw_path).parts]
-        new_relative_path = os.path.join(*safe_parts)
-        
-        # Construct the full new path
-        new_full_path = os.path.join(library_path, new_relative_path)
+    template = _get_template_for_file(file_obj, app, templates)
 
-        if current_filepath == new_full_path:
-            return
-        
-        # Ensure the directory exists
-        new_dir = os.path.dirname(new_full_path)
+    # Retrieve data for template formatting
+    format_data = {}
+    # Get title name from the associated title_id
+    title_info = titles_lib.get_game_info(app.title.title_id)
+    if title_info['name'] == 'Unrecognized':
+        logger.warning(f"No title info associated with file {file_obj.filename}. Skipping organization.")
+        return None
+    format_data["extension"] = file_obj.extension
+    format_data["titleId"] = app.title.title_id
+    format_data["titleName"] = title_info['name']
+    if not file_obj.multicontent:
+        format_data["appId"] = app.app_id
+        format_data["appVersion"] = app.app_version
+        format_data["patchLevel"] = titles_lib.get_update_number(app.app_version)
+
+        game_info = titles_lib.get_game_info(app.app_id)
+        if app.app_type == APP_TYPE_DLC:
+            format_data["appName"] = game_info['name']
+        else:
+            format_data["appName"] = title_info['name']
+
+    return SimpleNamespace(
+        library_path=library_path,
+        template=template,
+        format_data=format_data,
+        windows_compatible=organizer_settings.get('windows_compatible', False)
+    )
+
+def get_organizer_hash(inputs):
+    """Hash of the organizer inputs of a file, its organized path only changes along with it"""
+    data = json.dumps([inputs.library_path, inputs.template, inputs.windows_compatible, inputs.format_data], sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def get_organized_filepath(inputs):
+    """Path of a file according to the organizer templates"""
+    # Format the new relative path and remove leading slash if present
+    raw_path = inputs.template.format(**inputs.format_data).lstrip('/')
+    safe_parts = [sanitize_filename(part, inputs.windows_compatible) for part in Path(raw_path).parts]
+    new_relative_path = os.path.join(*safe_parts)
+
+    # Construct the full new path
+    return os.path.join(inputs.library_path, new_relative_path)
+
+def plan_library_organization(files, library_paths, organizer_settings, all_files=False):
+    """
+    Compute the moves organizing `files` in memory, each target directory is only listed once
+    to avoid overwriting existing files. Files whose organizer inputs did not change since they were
+    last organized are skipped, unless `all_files`. Returns a list of moves, as dicts of file_id,
+    library_path, src, dest and organizer_hash.
+    """
+    listings = {}  # directory -> names taken
+
+    def get_taken_names(directory):
+        names = listings.get(directory)
+        if names is None:
+            try:
+                names = set(os.listdir(directory))
+            except OSError:
+                names = set()
+            listings[directory] = names
+        return names
+
+    plan = []
+    organized_hashes = {}  # file_id -> organizer hash of the files already in place
+    for file_obj in files:
+        library_path = library_paths[file_obj.library_id]
         try:
-            os.makedirs(new_dir, exist_ok=True)
-        except OSError as e:
-            logger.error(f"Error creating directory {new_dir} for file {file_obj.filename}: {e}")
-            return
-        
-        # Move the file, handling duplicates
+            inputs = get_organizer_inputs(file_obj, library_path, organizer_settings)
+            if inputs is None:
+                continue
+            organizer_hash = get_organizer_hash(inputs)
+            if organizer_hash == file_obj.organizer_hash and not all_files:
+                continue
+            new_full_path = get_organized_filepath(inputs)
+        except Exception as e:
+            logger.error(f"An unexpected error occurred while organizing file {file_obj.filename}: {e}")
+            continue
+        if new_full_path == file_obj.filepath:
+            organized_hashes[file_obj.id] = organizer_hash
+            continue
+
+        # Handle duplicates
+        new_dir = os.path.dirname(new_full_path)
+        taken_names = get_taken_names(new_dir)
         base_name = os.path.splitext(os.path.basename(new_full_path))[0]
-        
         counter = 1
         final_new_full_path = new_full_path
-        while os.path.exists(final_new_full_path):
-            if final_new_full_path == current_filepath:
-                return
+        while os.path.basename(final_new_full_path) in taken_names:
+            if final_new_full_path == file_obj.filepath:
+                final_new_full_path = None
+                break
             counter += 1
             new_filename = f"{base_name}({counter}).{file_obj.extension}"
             final_new_full_path = os.path.join(new_dir, new_filename)
-        
-        logger.info(f'Organizing file: {file_obj.filename}')
+        if final_new_full_path is None:
+            organized_hashes[file_obj.id] = organizer_hash
+            continue
+
+        taken_names.add(os.path.basename(final_new_full_path))
+        plan.append({
+            'file_id': file_obj.id,
+            'library_path': library_path,
+            'src': file_obj.filepath,
+            'dest': final_new_full_path,
+            'organizer_hash': organizer_hash,
+        })
+    return plan, organized_hashes
+
+def _move_planned_file(move):
+    """Rename a file of an organization plan, returns 'done', 'cross-device' or an error message"""
+    src, dest = move['src'], move['dest']
+    try:
+        # The target directory may have changed since the plan was computed
+        if os.path.lexists(dest):
+            return f'{dest} already exists'
+        os.rename(src, dest)
+        return 'done'
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            return 'cross-device'
+        return str(e)
+
+def apply_organization_plan(app, plan, watcher, organizer_settings):
+    """
+    Move the files of an organization plan: same device renames are done in parallel and their new paths
+    written to the database in a single transaction. Moves to other filesystems are handed to `file_mover`,
+    each one updating the database and notifying the library pipeline once done.
+    The directories vacated by the moves are removed if empty, see `remove_empty_folders`.
+    Returns the plan with the outcome of each move.
+    """
+    if not plan:
+        return plan
+    logger.info(f'Organizing {len(plan)} files...')
+
+    failed_directories = {}
+    for directory in {os.path.dirname(move['dest']) for move in plan}:
         try:
-            # Add the move event to the ignored list before performing the move
-            with watcher.event_handler.ignored_events_lock:
-                watcher.event_handler.ignored_events_tuples.add((current_filepath, final_new_full_path))
-            
-            shutil.move(current_filepath, final_new_full_path)
-            logger.info(f"Moved '{current_filepath}' to '{final_new_full_path}'")
-            
-            # Update the file path in the database
-            # Get the library path from the library ID
-            library_path_str = get_library_path(file_obj.library_id)
-            update_file_path(library_path_str, current_filepath, final_new_full_path)
-            # logger.info(f"Updated database for file '{current_filepath}' to '{final_new_full_path}'")
-
-        except (shutil.Error, OSError) as e:
-            logger.error(f"Error moving file from '{current_filepath}' to '{final_new_full_path}': {e}")
-            # If an error occurs, ensure the event is removed from the ignored list
-            with watcher.event_handler.ignored_events_lock:
-                if (current_filepath, final_new_full_path) in watcher.event_handler.ignored_events_tuples:
-                    watcher.event_handler.ignored_events_tuples.remove((current_filepath, final_new_full_path))
-        # No finally block needed for removing from ignored_move_events, as it's removed by the watchdog handler
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Error creating directory {directory}: {e}")
+            failed_directories[directory] = str(e)
+
+    moves = [move for move in plan if os.path.dirname(move['dest']) not in failed_directories]
+    for move in plan:
+        if os.path.dirname(move['dest']) in failed_directories:
+            move['outcome'] = failed_directories[os.path.dirname(move['dest'])]
+
+    # Add the move events to the ignored list before performing the moves
+    watcher.ignore_moves([(move['src'], move['dest']) for move in moves])
+    with ThreadPoolExecutor(max_workers=ORGANIZER_WORKERS, thread_name_prefix='organizer') as executor:
+        for move, outcome in zip(moves, executor.map(_move_planned_file, moves)):
+            move['outcome'] = outcome
+
+    cross_device_moves = [move for move in moves if move['outcome'] == 'cross-device']
+    # The copy is written to a temporary file renamed to the target once complete, then the source is deleted
+    watcher.unignore_moves([(move['src'], move['dest']) for move in cross_device_moves])
+    watcher.ignore_moves([(get_temporary_path(move['dest']), move['dest']) for move in cross_device_moves])
+    watcher.ignore_deletes([move['src'] for move in cross_device_moves])
+    for move in cross_device_moves:
+        move['outcome'] = 'moving'
+        file_mover.submit(move['src'], move['dest'], organizer_settings.get('verify_moves', False),
+            partial(_on_cross_device_move_done, app, watcher, organizer_settings, move))
+    if cross_device_moves:
+        logger.info(f'{len(cross_device_moves)} files are moved to another filesystem in the background.')
+
+    failed = [move for move in moves if move['outcome'] not in ('done', 'moving')]
+    for move in failed:
+        logger.error(f"Error moving file from '{move['src']}' to '{move['dest']}': {move['outcome']}")
+    # If an error occurs, ensure the events are removed from the ignored list
+    watcher.unignore_moves([(move['src'], move['dest']) for move in failed])
+
+    done = [move for move in moves if move['outcome'] == 'done']
+    update_file_paths([(move['library_path'], move['src'], move['dest'], move['organizer_hash']) for move in done])
+    logger.info(f'Organized {len(done)} files, {len(failed)} errors.')
+    remove_vacated_folders(done, organizer_settings)
+    return plan
+
+def remove_vacated_folders(moves, organizer_settings):
+    """Remove the source directories of `moves` and their parents if they are now empty, if enabled"""
+    if not organizer_settings['remove_empty_folders']:
+        return
+    vacated_directories = {}  # library path -> source directories
+    for move in moves:
+        vacated_directories.setdefault(move['library_path'], set()).add(os.path.dirname(move['src']))
+    for library_path, directories in vacated_directories.items():
+        prune_empty_folders(directories, library_path)
+
+def _on_cross_device_move_done(app, watcher, organizer_settings, move, error):
+    if error:
+        move['outcome'] = str(error) or type(error).__name__
+        watcher.unignore_moves([(get_temporary_path(move['dest']), move['dest'])])
+        watcher.unignore_deletes([move['src']])
+        return
+    move['outcome'] = 'done'
+    with app.app_context():
+        update_file_paths([(move['library_path'], move['src'], move['dest'], move['organizer_hash'])])
+        submit_task('library_files_moved', filepaths=[move['dest']])
+    remove_vacated_folders([move], organizer_settings)
 
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while organizing file {file_obj.filename}: {e}")
+def save_organization_plan(plan):
+    """Keep the last applied organization plan, returned by the organizer API"""
+    try:
+        os.makedirs(os.path.dirname(ORGANIZER_LAST_PLAN_FILE), exist_ok=True)
+        tmp_path = f'{ORGANIZER_LAST_PLAN_FILE}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'applied_at': datetime.datetime.now().isoformat(), 'moves': plan}, f)
+        os.replace(tmp_path, ORGANIZER_LAST_PLAN_FILE)
+    except OSError as e:
+        logger.error(f'Error saving organization plan: {e}')
+
+def load_organization_plan():
+    try:
+        with open(ORGANIZER_LAST_PLAN_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
 def _get_template_for_file(file_obj, app, templates):
     """Helper function to determine the correct template for file organization."""
@@ -138,25 +381,6 @@ def _get_template_for_file(file_obj, app, templates):
     return templates.get(template_key) + '.{extension}'
 
 
-def add_library_complete(app, watcher, path):
-    """Add a library to settings, database, and watchdog"""
-    from settings import add_library_path_to_settings
-    
-    with app.app_context():
-        # Add to settings
-        success, errors = add_library_path_to_settings(path)
-        if not success:
-            return success, errors
-        
-        # Add to database
-        add_library(path)
-        
-        # Add to watchdog
-        watcher.add_directory(path)
-        
-        logger.info(f"Successfully added library: {path}")
-        return True, []
-
 def remove_library_complete(app, watcher, path):
     """Remove a library from settings, database, and watchdog with proper cleanup"""
     from settings import delete_library_path_from_settings
@@ -164,29 +388,21 @@ def remove_library_complete(app, watcher, path):
     with app.app_context():
         # Remove from watchdog first
         watcher.remove_directory(path)
+        with _suspended_libraries_lock:
+            suspended_libraries.discard(path)
         
         # Get library object before deletion
         library = Libraries.query.filter_by(path=path).first()
         if library:
-            # Get all file IDs from this library before deletion
-            file_ids = [f.id for f in library.files]
-            
-            # Update Apps table to remove file references and update ownership
-            total_apps_updated = 0
-            for file_id in file_ids:
-                apps_updated = remove_file_from_apps(file_id)
-                total_apps_updated += apps_updated
+            # Remove the files and their app references, then the titles that no longer have any owned apps
+            file_ids = [row.id for row in db.session.query(Files.id).filter_by(library_id=library.id)]
+            title_ids = delete_files_by_ids(file_ids)
+            titles_removed = remove_titles_without_owned_apps(title_ids)
             
-            # Remove titles that no longer have any owned apps
-            titles_removed = remove_titles_without_owned_apps()
-            
-            # Delete library (cascade will delete files automatically)
             db.session.delete(library)
             db.session.commit()
             
             logger.info(f"Removed library: {path}")
-            if total_apps_updated > 0:
-                logger.info(f"Updated {total_apps_updated} app entries to remove library file references.")
             if titles_removed > 0:
                 logger.info(f"Removed {titles_removed} titles with no owned apps.")
         
@@ -196,13 +412,14 @@ def remove_library_complete(app, watcher, path):
 
 def init_libraries(app, watcher, paths):
     with app.app_context():
-        # delete non existing libraries
+        # delete no longer configured libraries, suspend non existing ones
         for library in get_libraries():
             path = library.path
-            if not os.path.exists(path):
-                logger.warning(f"Library {path} no longer exists, deleting from database.")
-                # Use the complete removal function for consistency
+            if path not in paths:
+                logger.info(f"Library {path} no longer configured, deleting from database.")
                 remove_library_complete(app, watcher, path)
+            else:
+                check_library_available(path)
 
         # add libraries and start watchdog
         for path in paths:
@@ -212,7 +429,7 @@ def init_libraries(app, watcher, paths):
                 # add library paths to watchdog if necessary
                 watcher.add_directory(path)
                 add_library(path)
-            else:
+            elif path not in suspended_libraries:
                 # Ensure watchdog is monitoring existing library
                 watcher.add_directory(path)
 
@@ -235,6 +452,7 @@ def add_files_to_library(library, files):
     if not new_files_to_add:
         return
 
+    added_files = []
     nb_to_identify = len(new_files_to_add)
     for n, filepath in enumerate(new_files_to_add):
         file = filepath.replace(library_path, "")
@@ -256,6 +474,7 @@ def add_files_to_library(library, files):
             size = file_info["size"],
         )
         db.session.add(new_file)
+        added_files.append(filepath)
 
         # Commit every 100 files to avoid excessive memory use
         if (n + 1) % 100 == 0:
@@ -263,19 +482,22 @@ def add_files_to_library(library, files):
 
     # Final commit
     db.session.commit()
+    library_changes.add_files(added_files)
 
 def scan_library_path(library_path):
+    """Add the new files of a library path, returns their number"""
     library_id = get_library_id(library_path)
     logger.info(f'Scanning library path {library_path} ...')
     if not os.path.isdir(library_path):
         logger.warning(f'Library path {library_path} does not exists.')
-        return
+        return 0
     _, files = titles_lib.getDirsAndFiles(library_path)
 
     filepaths_in_library = get_library_file_paths(library_id)
     new_files = [f for f in files if f not in filepaths_in_library]
     add_files_to_library(library_id, new_files)
     set_library_scan_time(library_id)
+    return len(new_files)
 
 def get_files_to_identify(library_id):
     non_identified_files = get_all_non_identified_files_from_library(library_id)
@@ -284,6 +506,12 @@ def get_files_to_identify(library_id):
         non_identified_files = list(set(non_identified_files).union(files_to_identify_with_cnmt))
     return non_identified_files
 
+def get_files_to_identify_by_filepaths(filepaths):
+    return [
+        f for f in get_files_by_filepaths(filepaths)
+        if not f.identified or (titles_lib.Keys.keys_loaded and f.identification_type == 'filename')
+    ]
+
 def identify_library_files(library):
     if isinstance(library, int) or library.isdigit():
         library_id = library
@@ -291,7 +519,11 @@ def identify_library_files(library):
     else:
         library_path = library
         library_id = get_library_id(library_path)
-    files_to_identify = get_files_to_identify(library_id)
+    return identify_files(get_files_to_identify(library_id))
+
+def identify_files(files_to_identify):
+    """Identify the contents of files, returns the title IDs found"""
+    identified_title_ids = set()
     nb_to_identify = len(files_to_identify)
     for n, file in enumerate(files_to_identify):
         try:
@@ -312,6 +544,7 @@ def identify_library_files(library):
 
                 for title_id in title_ids:
                     add_title_id_in_db(title_id)
+                identified_title_ids.update(title_ids)
 
                 nb_content = 0
                 for file_content in file_contents:
@@ -350,6 +583,9 @@ def identify_library_files(library):
                 if nb_content > 1:
                     file.multicontent = True
                 file.nb_content = nb_content
+                if file.extension == 'nsz':
+                    # Listed as the NSP it decompresses to when `decompressed_nsp` is enabled
+                    file.decompressed_size = get_decompressed_size(filepath)
                 file.identified = True
             else:
                 logger.warning(f"Error identifying file {filename}: {error}")
@@ -373,10 +609,20 @@ def identify_library_files(library):
 
     # Final commit
     db.session.commit()
-
-def add_missing_apps_to_db():
+    return identified_title_ids
+
+def update_decompressed_sizes():
+    """Store the decompressed size of the NSZ files identified before it was stored"""
+    files = get_files_without_decompressed_size()
+    for file in files:
+        file.decompressed_size = get_decompressed_size(file.filepath)
+    if files:
+        db.session.commit()
+
+def add_missing_apps_to_db(title_ids=None):
+    """Add the apps known from TitleDB but not owned, for all titles or only `title_ids`"""
     logger.info('Adding missing apps to database...')
-    titles = get_all_titles()
+    titles = get_all_titles() if title_ids is None else get_titles_by_title_ids(title_ids)
     apps_added = 0
     
     for n, title in enumerate(titles):
@@ -450,116 +696,104 @@ def add_missing_apps_to_db():
     db.session.commit()
     logger.info(f'Finished adding missing apps to database. Total apps added: {apps_added}')
 
-def process_library_identification(app):
-    logger.info(f"Starting library identification process for all libraries...")
+def process_library_identification(app, filepaths=None):
+    """Identify the files of all libraries or only `filepaths`, returns the title IDs found"""
+    identified_title_ids = set()
+    scope = 'all libraries' if filepaths is None else f'{len(filepaths)} changed files'
+    logger.info(f"Starting library identification process for {scope}...")
     try:
         with app.app_context():
-            libraries = get_libraries()
-            for library in libraries:
-                identify_library_files(library.path)
+            if filepaths is None:
+                libraries = get_libraries()
+                for library in libraries:
+                    identified_title_ids.update(identify_library_files(library.path))
+            elif filepaths:
+                identified_title_ids.update(identify_files(get_files_to_identify_by_filepaths(filepaths)))
 
     except Exception as e:
         logger.error(f"Error during library identification process: {e}")
-    logger.info(f"Library identification process for all libraries completed.")
+    logger.info(f"Library identification process for {scope} completed.")
+    return identified_title_ids
 
-def process_library_organization(app, watcher):
-    logger.info(f"Starting library organization process for all libraries...")
+def get_library_organization_plan(app, all_files=False):
+    """Dry run of the organizer over the whole library, see `plan_library_organization`"""
+    app_settings = load_settings()
+    organizer_settings = app_settings['library']['management']['organizer']
+    titles_lib.load_titledb()
+    try:
+        with app.app_context():
+            library_paths = {library.id: library.path for library in get_libraries()}
+            identified_files = get_identified_files()
+            plan, _ = plan_library_organization(identified_files, library_paths, organizer_settings, all_files)
+            return plan
+    finally:
+        titles_lib.identification_in_progress_count -= 1
+        titles_lib.unload_titledb()
+
+def process_library_organization(app, watcher, filepaths=None, title_ids=None):
+    """Organize the files and remove the outdated updates of the whole library, or only of `filepaths` and `title_ids`"""
+    scope = 'all libraries' if filepaths is None else f'{len(filepaths)} changed files'
+    logger.info(f"Starting library organization process for {scope}...")
     try:
         app_settings = load_settings()
         organizer_settings = app_settings['library']['management']['organizer']
-        if organizer_settings['enabled']:
+        if organizer_settings['enabled'] and (filepaths is None or filepaths):
             with app.app_context():
-                libraries = get_libraries()
-                for library in libraries:
-                    library_path = library.path
-                    # Get all identified files for the current library
-                    identified_files = Files.query.filter_by(library_id=library.id, identified=True).all()
-                    for file_obj in identified_files:
-                        organize_file(file_obj, library_path, organizer_settings, watcher)
-                    
-                    # Remove empty directories if needed
-                    if organizer_settings['remove_empty_folders']:
-                        delete_empty_folders(library_path)
+                library_paths = {library.id: library.path for library in get_libraries()}
+                identified_files = get_identified_files(filepaths)
+                plan, organized_hashes = plan_library_organization(identified_files, library_paths, organizer_settings)
+                set_files_organizer_hash(organized_hashes)
+                logger.info(f'{len(plan)} files to organize, {len(identified_files) - len(plan)} unchanged or already organized.')
+                if plan:
+                    save_organization_plan(apply_organization_plan(app, plan, watcher, organizer_settings))
 
         # Remove outdated update files
-        if app_settings['library']['management']['delete_older_updates']:
-            remove_outdated_update_files(watcher)
+        if app_settings['library']['management']['delete_older_updates'] and (title_ids is None or title_ids):
+            remove_outdated_update_files(watcher, title_ids)
     except Exception as e:
         logger.error(f"Error during library organization process: {e}")
-    logger.info(f"Library organization process for all libraries completed.")
+    logger.info(f"Library organization process for {scope} completed.")
 
-def remove_outdated_update_files(watcher):
+def remove_outdated_update_files(watcher, title_ids=None):
+    """Delete the update files superseded by a newer owned update, for all titles or only `title_ids`"""
     logger.info("Starting removal of outdated update files...")
     try:
-        titles = get_all_titles()
-        
-        for title in titles:
-            title_apps = get_all_title_apps(title.title_id)
-            
-            # Filter for owned update apps
-            owned_update_apps = [app for app in title_apps if app.get('app_type') == APP_TYPE_UPD and app.get('owned')]
-            
-            # If there's only one or no owned update apps, there's no "greater version available" to compare against.
-            if len(owned_update_apps) <= 1:
+        outdated_files = get_outdated_update_files(title_ids)
+        if not outdated_files:
+            logger.info("No outdated update files to remove.")
+            return
+
+        removed_file_ids = []
+        for outdated_file in outdated_files:
+            logger.info(f"Removing outdated update file: {outdated_file.filepath} (Title ID: {outdated_file.title_id}, Version: {outdated_file.app_version}) - Greater owned version available.")
+            # Add the delete event to the ignored list before performing the removal, removed if it fails
+            watcher.ignore_deletes([outdated_file.filepath])
+            try:
+                os.remove(outdated_file.filepath)
+                logger.debug(f"Deleted physical file: {outdated_file.filepath}")
+            except FileNotFoundError:
+                logger.warning(f"Physical file not found for deletion: {outdated_file.filepath}")
+                watcher.unignore_deletes([outdated_file.filepath])
+            except OSError as e:
+                logger.error(f"Error deleting physical file {outdated_file.filepath}: {e}")
+                watcher.unignore_deletes([outdated_file.filepath])
                 continue
-            
-            # Group owned update apps by their version for easy lookup
-            owned_versions = {int(app['app_version']) for app in owned_update_apps}
-            
-            # Iterate through all update apps (owned or not) for this title
-            for app_data in title_apps:
-                if app_data.get('app_type') == APP_TYPE_UPD:
-                    current_app_version = int(app_data['app_version'])
-                    
-                    # Check if there's a greater owned version available for this title
-                    has_greater_owned_version = any(
-                        owned_v > current_app_version for owned_v in owned_versions
-                    )
-                    
-                    if has_greater_owned_version:
-                        # Get the actual App object from the database
-                        app_obj = get_app_by_id_and_version(app_data['app_id'], app_data['app_version'])
-                        
-                        if app_obj:
-                            # Get files associated with this specific app version
-                            # Create a list to iterate over as the original collection might change during deletion
-                            files_to_process = list(app_obj.files) 
-                            for file_obj in files_to_process:
-                                # Check if file meets criteria: identified, not multicontent
-                                if file_obj.identified and not file_obj.multicontent:
-                                    logger.info(f"Removing outdated update file: {file_obj.filepath} (App ID: {app_obj.app_id}, Version: {app_obj.app_version}) - Greater owned version available.")
-                                    
-                                    # Remove from disk
-                                    if os.path.exists(file_obj.filepath):
-                                        try:
-                                            # Add the delete event to the ignored list before performing the remove
-                                            with watcher.event_handler.ignored_events_lock:
-                                                watcher.event_handler.ignored_events_tuples.add((file_obj.filepath, ""))
-                                            os.remove(file_obj.filepath)
-                                            logger.debug(f"Deleted physical file: {file_obj.filepath}")
-                                            # Remove from database and update app owned status
-                                            # This function handles db.session.delete(file_obj) and app.owned status
-                                            remove_file_from_apps(file_obj.id)
-                                        except OSError as e:
-                                            logger.error(f"Error deleting physical file {file_obj.filepath}: {e}")
-                                            # If an error occurs, ensure the event is removed from the ignored list
-                                            with watcher.event_handler.ignored_events_lock:
-                                                if (file_obj.filepath, "") in watcher.event_handler.ignored_events_tuples:
-                                                    watcher.event_handler.ignored_events_tuples.remove((file_obj.filepath, ""))
-                                    else:
-                                        logger.warning(f"Physical file not found for deletion: {file_obj.filepath}")
-                                    
+            removed_file_ids.append(outdated_file.id)
+
+        # Remove from database and update app owned status, the title status is updated by the next pipeline run
+        library_changes.add_titles(delete_files_by_ids(removed_file_ids))
         logger.info(f"Finished removal of outdated update files.")
     except Exception as e:
         logger.error(f"Error during removal of outdated update files: {e}")
 
-def update_titles():
+def update_titles(title_ids=None):
+    """Update the base, update and DLC status of all titles or only `title_ids`"""
     # Remove titles that no longer have any owned apps
-    titles_removed = remove_titles_without_owned_apps()
+    titles_removed = remove_titles_without_owned_apps(title_ids)
     if titles_removed > 0:
             logger.info(f"Removed {titles_removed} titles with no owned apps.")
 
-    titles = get_all_titles()
+    titles = get_all_titles() if title_ids is None else get_titles_by_title_ids(title_ids)
     for n, title in enumerate(titles):
         have_base = False
         up_to_date = False
@@ -638,12 +872,13 @@ def get_library_status(title_id):
     }
     return library_status
 
-def compute_apps_hash():
+def compute_apps_hash(apps=None):
     """
     Computes a hash of all Apps table content to detect changes in library state.
     """
     hash_md5 = hashlib.md5()
-    apps = get_all_apps()
+    if apps is None:
+        apps = get_all_apps()
     
     # Sort apps with safe handling of None values
     for app in sorted(apps, key=lambda x: (x['app_id'] or '', x['app_version'] or '')):
@@ -696,6 +931,12 @@ def generate_library():
     logger.info(f'Generating library ...')
     titles_lib.load_titledb()
     titles = get_all_apps()
+    apps_hash = compute_apps_hash(titles)
+    # Status and apps of all titles, loaded at once rather than queried for each app
+    titles_status = {title.title_id: title for title in get_all_titles()}
+    apps_by_title = {}
+    for app in titles:
+        apps_by_title.setdefault(app['title_id'], []).append(dict(app))
     games_info = []
     processed_dlc_apps = set()  # Track processed DLC app_ids to avoid duplicates
 
@@ -716,7 +957,7 @@ def generate_library():
         
         if title['app_type'] == APP_TYPE_BASE:
             # Get title status from Titles table (already calculated by update_titles)
-            title_obj = get_title(title['title_id'])
+            title_obj = titles_status.get(title['title_id'])
             if title_obj:
                 title['has_base'] = title_obj.have_base
                 # Only mark as up to date if the base itself is owned and up_to_date
@@ -730,7 +971,7 @@ def generate_library():
                 title['has_all_dlcs'] = False
             
             # Get version info from Apps table and add release dates from versions_db
-            title_apps = get_all_title_apps(title['title_id'])
+            title_apps = apps_by_title.get(title['title_id'], [])
             update_apps = [app for app in title_apps if app.get('app_type') == APP_TYPE_UPD]
             
             # Get release date information from external source
@@ -756,7 +997,7 @@ def generate_library():
             processed_dlc_apps.add(title['app_id'])
             
             # Get all versions for this DLC app_id
-            title_apps = get_all_title_apps(title['title_id'])
+            title_apps = apps_by_title.get(title['title_id'], [])
             dlc_apps = [app for app in title_apps if app.get('app_type') == APP_TYPE_DLC and app['app_id'] == title['app_id']]
             
             # Create version list for this DLC
@@ -790,7 +1031,7 @@ def generate_library():
         games_info.append(title)
     
     library_data = {
-        'hash': compute_apps_hash(),
+        'hash': apps_hash,
         'library': sorted(games_info, key=lambda x: (
             "title_id_name" not in x, 
             x.get("title_id_name", "Unrecognized") or "Unrecognized", 
@@ -0,0 +1,24 @@
+"""Add organizer hash to files
+
+Revision ID: 4b7e2d9a0f13
+Revises: c3f18d5a6e20
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d9a0f13'
+down_revision = 'c3f18d5a6e20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('organizer_hash', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_column('organizer_hash')
@@ -0,0 +1,28 @@
+"""Add background tasks table
+
+Revision ID: 5d2b8e41c7a9
+Revises: 78c33e9bffce
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5d2b8e41c7a9'
+down_revision = '78c33e9bffce'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('background_tasks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('kwargs', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('background_tasks')
@@ -0,0 +1,28 @@
+"""Add integrity verification to files
+
+Revision ID: 7d3c1e8b5a24
+Revises: 4b7e2d9a0f13
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7d3c1e8b5a24'
+down_revision = '4b7e2d9a0f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('verified', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('verification_error', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('verification_key', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_column('verification_key')
+        batch_op.drop_column('verification_error')
+        batch_op.drop_column('verified')
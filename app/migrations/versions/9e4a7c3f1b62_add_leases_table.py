@@ -0,0 +1,27 @@
+"""Add leases table
+
+Revision ID: 9e4a7c3f1b62
+Revises: 5d2b8e41c7a9
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9e4a7c3f1b62'
+down_revision = '5d2b8e41c7a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('leases',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('holder', sa.String(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('leases')
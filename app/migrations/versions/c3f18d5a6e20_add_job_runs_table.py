@@ -0,0 +1,36 @@
+"""Add job runs table
+
+Revision ID: c3f18d5a6e20
+Revises: 9e4a7c3f1b62
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c3f18d5a6e20'
+down_revision = '9e4a7c3f1b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.String(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('outcome', sa.String(), nullable=False),
+        sa.Column('items_processed', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('job_runs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_job_runs_job_id'), ['job_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('job_runs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_job_runs_job_id'))
+
+    op.drop_table('job_runs')
@@ -0,0 +1,24 @@
+"""Add decompressed size to files
+
+Revision ID: e5a3b7c91d08
+Revises: 7d3c1e8b5a24
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e5a3b7c91d08'
+down_revision = '7d3c1e8b5a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('decompressed_size', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_column('decompressed_size')
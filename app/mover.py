@@ -0,0 +1,180 @@
+from constants import *
+from concurrent.futures import ThreadPoolExecutor, CancelledError, wait as wait_futures
+from types import SimpleNamespace
+import itertools
+import threading
+import hashlib
+import shutil
+import errno
+import time
+import os
+import logging
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+# Errors of copy_file_range meaning it cannot copy between these files, i.e. across filesystem types
+COPY_FILE_RANGE_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+
+def get_temporary_path(path):
+    """Path a file is written to before being renamed to `path`, ignored by the watcher"""
+    return path + TEMPORARY_FILE_SUFFIX
+
+def copy_file_data(src_fd, dest_fd, size, progress=None):
+    """
+    Copy `size` bytes between two file descriptors in MOVE_CHUNK_SIZE chunks, in the kernel when possible:
+    copy_file_range (which may also clone or copy server-side), then sendfile, then read and write.
+    `progress` is called with the number of bytes copied after each chunk.
+    """
+    copied = 0
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    use_sendfile = hasattr(os, 'sendfile')
+    while copied < size:
+        count = min(MOVE_CHUNK_SIZE, size - copied)
+        n = None
+        if use_copy_file_range:
+            try:
+                n = os.copy_file_range(src_fd, dest_fd, count, copied, copied)
+            except OSError as e:
+                if e.errno not in COPY_FILE_RANGE_UNSUPPORTED_ERRORS:
+                    raise
+                use_copy_file_range = False
+        if n is None and use_sendfile:
+            try:
+                os.lseek(dest_fd, copied, os.SEEK_SET)
+                n = os.sendfile(dest_fd, src_fd, copied, count)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+                use_sendfile = False
+        if n is None:
+            data = os.pread(src_fd, count, copied)
+            os.lseek(dest_fd, copied, os.SEEK_SET)
+            n = os.write(dest_fd, data)
+        if n == 0:
+            raise OSError(errno.EIO, f'unexpected end of file after {copied} of {size} bytes')
+        copied += n
+        if progress:
+            progress(copied)
+    return copied
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(MOVE_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def copy_and_remove(src, dest, verify=False, progress=None):
+    """
+    Move a file to another filesystem: copy it to a temporary file next to `dest`, optionally compare
+    the hashes of both files, rename the copy to `dest` and only then remove `src`.
+    """
+    if os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, f'{dest} already exists')
+    size = os.stat(src).st_size
+    tmp_path = get_temporary_path(dest)
+    try:
+        with open(src, 'rb') as src_file, open(tmp_path, 'wb') as dest_file:
+            copy_file_data(src_file.fileno(), dest_file.fileno(), size, progress)
+            os.fsync(dest_file.fileno())
+        shutil.copystat(src, tmp_path)
+
+        copied_size = os.stat(tmp_path).st_size
+        if copied_size != size:
+            raise OSError(errno.EIO, f'size mismatch after copy ({copied_size} instead of {size} bytes)')
+        if verify and hash_file(src) != hash_file(tmp_path):
+            raise OSError(errno.EIO, 'hash mismatch after copy')
+        # The target may have been created during the copy
+        if os.path.lexists(dest):
+            raise FileExistsError(errno.EEXIST, f'{dest} already exists')
+        os.rename(tmp_path, dest)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(src)
+
+class FileMover:
+    """
+    Moves files to other filesystems on a limited number of worker threads, so that long copies
+    neither block the caller nor delay the moves within the same filesystem.
+    The progress of the moves in progress is returned by `get_progress`.
+    """
+    def __init__(self, max_workers=CROSS_DEVICE_MOVE_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='file-mover')
+        self._moves = {}  # id -> move in progress
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, src, dest, verify=False, on_done=None):
+        """
+        Queue a move, `on_done(error)` is called from the worker thread once done, with None on success.
+        Returns a future.
+        """
+        move_id = next(self._ids)
+        move = SimpleNamespace(src=src, dest=dest, size=None, copied=0, started_at=None, on_done=on_done)
+        with self._lock:
+            self._moves[move_id] = move
+            move.future = self.executor.submit(self._run, move_id, move, verify, on_done)
+        return move.future
+
+    def _run(self, move_id, move, verify, on_done):
+        error = None
+        try:
+            move.size = os.stat(move.src).st_size
+            move.started_at = time.time()
+            copy_and_remove(move.src, move.dest, verify, lambda copied: setattr(move, 'copied', copied))
+            duration = time.time() - move.started_at
+            logger.info(f"Moved '{move.src}' to '{move.dest}' across filesystems ({move.size / max(duration, 0.001) / 2**20:.1f} MiB/s).")
+        except Exception as e:
+            error = e
+            logger.error(f"Error moving file from '{move.src}' to '{move.dest}': {e}")
+        finally:
+            with self._lock:
+                del self._moves[move_id]
+
+        if on_done:
+            try:
+                on_done(error)
+            except Exception as e:
+                logger.error(f"Error handling the move of '{move.src}': {e}")
+        return error
+
+    def get_progress(self):
+        """Moves queued or in progress, with the bytes copied so far"""
+        with self._lock:
+            moves = list(self._moves.values())
+        return [{
+            'src': move.src,
+            'dest': move.dest,
+            'size': move.size,
+            'copied': move.copied,
+            'started_at': move.started_at,
+        } for move in moves]
+
+    def drain(self):
+        """
+        Cancel the queued moves and wait for the ones in progress, i.e. when this process stops managing
+        the libraries. The files of the cancelled moves are left in place, `on_done` is called with CancelledError.
+        """
+        with self._lock:
+            moves = list(self._moves.items())
+        for move_id, move in moves:
+            if not move.future.cancel():
+                continue
+            with self._lock:
+                del self._moves[move_id]
+            if move.on_done:
+                try:
+                    move.on_done(CancelledError())
+                except Exception as e:
+                    logger.error(f"Error handling the cancelled move of '{move.src}': {e}")
+        wait_futures([move.future for _, move in moves])
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+file_mover = FileMover()
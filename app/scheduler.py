@@ -1,15 +1,20 @@
 import threading
-import time
 import logging
+import time
 import re
 from datetime import datetime, timedelta
 from typing import Callable, Dict, Any, Optional, List, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import Flask
 from croniter import croniter, CroniterBadCronError
+from utils import timer_service
+from db import add_job_run, finish_job_run
 
 logger = logging.getLogger('main')
 
+# Policies when a job is due while its previous run is still in progress
+OVERLAP_POLICIES = ('skip', 'queue', 'coalesce')
+
 # Generic interval parsing utilities
 def parse_interval_string(interval_str: str) -> Tuple[int, str]:
     """ Parse interval string like '2h', '30m', '1d', '45s' or '0' into (value, unit)"""
@@ -55,53 +60,127 @@ class JobScheduler:
         self.app = app
         self._lock = threading.RLock()
         self.scheduled_jobs: Dict[str, Dict[str, Any]] = {}
+        # Runs in progress by job id, kept across replacements of a job with the same id
+        self.active_runs: Dict[str, Dict[str, Any]] = {}
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
         self._running = True
-        self._sleep_time = 1  # seconds
-        self.thread = threading.Thread(target=self._run_loop, daemon=True)
-        self.thread.start()
         logger.info("Job scheduler initialized.")
 
-    def _run_loop(self):
-        with self.app.app_context():
-            logger.debug("Scheduler loop started.")
-            try:
-                self._check_jobs()
-            except Exception as e:
-                logger.error(f"Initial scheduler check failed: {e}")
-            while self._running:
-                try:
-                    self._check_jobs()
-                except Exception as e:
-                    logger.error(f"Scheduler loop error: {str(e)}")
-                time.sleep(self._sleep_time)
-            logger.info("Scheduler loop exited.")
+    def _schedule_timer(self, job: Dict[str, Any]):
+        """Arm the timer of a job for its next run."""
+        delay = (job['next_run'] - datetime.now()).total_seconds()
+        job['timer'] = timer_service.schedule(delay, self._on_timer, job)
+
+    def _on_timer(self, job: Dict[str, Any]):
+        with self._lock:
+            # Ignore timers of removed or replaced jobs
+            if not self._running or self.scheduled_jobs.get(job['id']) is not job:
+                return
+            if job['id'] in self.active_runs:
+                if self._handle_overlap(job):
+                    # Coalesced jobs are rescheduled once the running execution completes
+                    return
+            else:
+                self._execute_job(job)
+            self._reschedule(job)
+            if self.scheduled_jobs.get(job['id']) is job:
+                self._schedule_timer(job)
+
+    def _handle_overlap(self, job: Dict[str, Any]) -> bool:
+        """Apply the overlap policy of a job due while still running, returns True if the job is coalesced."""
+        job['overlaps'] += 1
+        if job['overlap'] == 'queue':
+            job['queued'] = True
+            logger.info(f"Job {job['id']} is still running, next run queued.")
+        elif job['overlap'] == 'coalesce':
+            job['coalesced'] = True
+            logger.info(f"Job {job['id']} is still running, next run rescheduled after completion.")
+            return True
+        else:
+            logger.info(f"Job {job['id']} is still running, skipping this run.")
+        return False
 
-    def _check_jobs(self):
-        now = datetime.now().replace(microsecond=0)
+    def _on_run_completed(self, job_id: str):
         with self._lock:
-            for job_id, job in list(self.scheduled_jobs.items()):
-                if job['next_run'] <= now:
-                    self._execute_job(job)
+            run = self.active_runs.pop(job_id, None)
+            if run and run['timeout_timer']:
+                run['timeout_timer'].cancel()
+            job = self.scheduled_jobs.get(job_id)
+            if not self._running or job is None:
+                return
+            if job['queued']:
+                job['queued'] = False
+                self._execute_job(job)
+            elif job['coalesced']:
+                job['coalesced'] = False
+                job['timer'].cancel()
+                if job['run_once']:
+                    job['next_run'] = datetime.now().replace(microsecond=0)
+                else:
                     self._reschedule(job)
+                self._schedule_timer(job)
+
+    def _on_timeout(self, job_id: str, run: Dict[str, Any], timeout: timedelta):
+        with self._lock:
+            if self.active_runs.get(job_id) is not run:
+                return
+            run['timed_out'] = True
+        logger.warning(f"Job {job_id} is running for more than {timeout}, it will be reported as timed out.")
 
     def _execute_job(self, job: Dict[str, Any]):
+        """Start a run of a job, must be called with the lock held."""
+        run = {
+            'started_at': datetime.now().replace(microsecond=0),
+            'timed_out': False,
+            'timeout_timer': None
+        }
+        if job['timeout']:
+            run['timeout_timer'] = timer_service.schedule(job['timeout'].total_seconds(), self._on_timeout, job['id'], run, job['timeout'])
+        self.active_runs[job['id']] = run
+
         def job_wrapper():
+            # Quiet jobs are frequent housekeeping jobs, only their failures are logged and their runs are not recorded
+            quiet = job.get('quiet')
+            log_job = (lambda message: None) if quiet else logger.info
+            start_time = time.monotonic()
             with self.app.app_context():
+                run_id = None
+                if not quiet:
+                    try:
+                        run_id = add_job_run(job['id'], run['started_at'])
+                    except Exception as e:
+                        logger.error(f"Error recording run of job {job['id']}: {e}")
+
+                items_processed = None
+                error = None
                 try:
-                    logger.info(f"Starting job {job['id']}")
-                    job['func'](*job.get('args', []), **job.get('kwargs', {}))
+                    log_job(f"Starting job {job['id']}")
+                    result = job['func'](*job.get('args', []), **job.get('kwargs', {}))
+                    # Jobs may return the number of items they processed
+                    if isinstance(result, int) and not isinstance(result, bool):
+                        items_processed = result
                     with self._lock:
                         job['last_run'] = datetime.now().replace(microsecond=0)
                         job['last_error'] = None
                     schedule_info = f" Next run at {job['next_run']}" if not job.get('run_once') else ""
-                    logger.info(f"Completed job {job['id']}.{schedule_info}")
+                    log_job(f"Completed job {job['id']}.{schedule_info}")
                 except Exception as e:
+                    error = str(e)
                     with self._lock:
-                        job['last_error'] = str(e)
+                        job['last_error'] = error
                     schedule_info = f" Next run at {job['next_run']}" if not job.get('run_once') else ""
                     logger.error(f"Job {job['id']} failed: {e}.{schedule_info}")
 
+                if run_id is not None:
+                    duration = time.monotonic() - start_time
+                    timed_out = run['timed_out'] or (job['timeout'] and duration > job['timeout'].total_seconds())
+                    outcome = 'error' if error else 'timeout' if timed_out else 'success'
+                    try:
+                        finish_job_run(run_id, outcome, duration, items_processed, error)
+                    except Exception as e:
+                        logger.error(f"Error recording run of job {job['id']}: {e}")
+            self._on_run_completed(job['id'])
+
         self.executor.submit(job_wrapper)
 
     def _reschedule(self, job: Dict[str, Any]):
@@ -133,12 +212,18 @@ class JobScheduler:
         kwargs: Optional[Dict[str, Any]] = None,
         run_once: bool = False,
         run_first: bool = False,
-        start_date: Optional[datetime] = None # for delayed one-off jobs
+        start_date: Optional[datetime] = None, # for delayed one-off jobs
+        quiet: bool = False,
+        overlap: str = 'skip', # when due while still running, see OVERLAP_POLICIES
+        timeout: Optional[timedelta] = None # soft timeout, runs are reported but not interrupted
     ):
         with self._lock:
             if job_id in self.scheduled_jobs:
                 raise ValueError(f"Job {job_id} already exists.")
 
+            if overlap not in OVERLAP_POLICIES:
+                raise ValueError(f"Invalid overlap policy: {overlap}, must be one of {', '.join(OVERLAP_POLICIES)}.")
+
             if not (cron or interval or run_once):
                 raise ValueError("Must provide either cron, interval, or run_once=True.")
             
@@ -167,9 +252,17 @@ class JobScheduler:
                 'kwargs': kwargs or {},
                 'next_run': next_run,
                 'run_once': run_once,
+                'quiet': quiet,
+                'overlap': overlap,
+                'timeout': timeout,
+                'queued': False,
+                'coalesced': False,
+                'overlaps': 0,
                 'last_run': None,
-                'last_error': None
+                'last_error': None,
+                'timer': None
             }
+            self._schedule_timer(self.scheduled_jobs[job_id])
 
             schedule_info = f"cron: {cron}" if cron else f"interval: {interval}" if interval else "one-off"
             logger.info(f"Added job {job_id} with schedule: {schedule_info}, first run at {next_run}")
@@ -177,10 +270,10 @@ class JobScheduler:
     def remove_job(self, job_id: str):
         with self._lock:
             if job_id in self.scheduled_jobs:
-                del self.scheduled_jobs[job_id]
+                self.scheduled_jobs.pop(job_id)['timer'].cancel()
                 logger.info(f"Removed job {job_id}.")
 
-    def update_job_interval(self, job_id: str, interval_str: str, func: Callable, run_first: bool = False, run_once: bool = False):
+    def update_job_interval(self, job_id: str, interval_str: str, func: Callable, run_first: bool = False, run_once: bool = False, **job_options):
         """
         Update or add a job with an interval string (e.g., '2h', '30m', '0').
         If interval is '0', the job is removed. Otherwise, it's rescheduled.
@@ -206,7 +299,8 @@ class JobScheduler:
                     job_id=job_id,
                     func=func,
                     interval=interval_delta,
-                    run_once=run_once
+                    run_once=run_once,
+                    **job_options
                 )
                 return True
         
@@ -215,13 +309,43 @@ class JobScheduler:
             job_id=job_id,
             func=func,
             interval=interval_delta,
-            run_first=run_first
+            run_first=run_first,
+            **job_options
         )
         logger.debug(f"Job {job_id} scheduled with interval: {interval_str}")
         return True
 
+    def get_jobs(self) -> List[Dict[str, Any]]:
+        """State of the scheduled and running jobs."""
+        with self._lock:
+            job_ids = sorted(set(self.scheduled_jobs) | set(self.active_runs))
+            jobs = []
+            for job_id in job_ids:
+                job = self.scheduled_jobs.get(job_id)
+                run = self.active_runs.get(job_id)
+                jobs.append({
+                    'id': job_id,
+                    'scheduled': job is not None,
+                    'next_run': job['next_run'].isoformat() if job and not job['coalesced'] else None,
+                    'overlap': job['overlap'] if job else None,
+                    'timeout': job['timeout'].total_seconds() if job and job['timeout'] else None,
+                    'last_run': job['last_run'].isoformat() if job and job['last_run'] else None,
+                    'last_error': job['last_error'] if job else None,
+                    'overlaps': job['overlaps'] if job else 0,
+                    'running': run is not None,
+                    'running_since': run['started_at'].isoformat() if run else None,
+                    'timed_out': run['timed_out'] if run else False
+                })
+            return jobs
+
     def shutdown(self):
-        self._running = False
+        with self._lock:
+            self._running = False
+            for job in self.scheduled_jobs.values():
+                job['timer'].cancel()
+            for run in self.active_runs.values():
+                if run['timeout_timer']:
+                    run['timeout_timer'].cancel()
         self.executor.shutdown(wait=False)
         logger.debug("Job scheduler shutdown.")
 
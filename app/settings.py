@@ -4,6 +4,7 @@ import yaml
 import os, sys
 import threading
 import hashlib
+import copy
 
 from nsz.nut import Keys
 
@@ -12,6 +13,12 @@ import logging
 settings_lock = threading.Lock()
 keys_lock = threading.Lock()
 
+# In-memory snapshot of the settings, with the signature of the files it was read from
+_settings_cache = {
+    'signature': None,
+    'settings': None,
+}
+
 # Retrieve main logger
 logger = logging.getLogger('main')
 
@@ -51,9 +58,9 @@ def remove_obsolete_keys(target, defaults, path=''):
 
     for key, value in target.items():
         if isinstance(value, dict) and key in defaults and isinstance(defaults[key], dict):
-            # Skip removing keys from hauth dict as it contains dynamic per-host entries
+            # Skip removing keys from hauth, mappings and modes dicts as they contain dynamic per-host/per-library entries
             current_path = f"{path}/{key}" if path else key
-            if current_path.endswith('/hauth'):
+            if current_path.endswith(('/hauth', '/mappings', '/modes')):
                 continue
             if remove_obsolete_keys(value, defaults[key], current_path):
                 removed = True
@@ -109,40 +116,71 @@ def migrate_shop_settings(settings):
             migrated = True
     return migrated
 
-def load_settings():
-    settings_updated = False
-    with settings_lock:
-        if os.path.exists(CONFIG_FILE):
-            logger.debug('Reading configuration file.')
-            with open(CONFIG_FILE, 'r') as yaml_file:
-                settings = yaml.safe_load(yaml_file)
+def _get_settings_files_signature():
+    """Stat settings.yaml and keys.txt, to detect changes without reading them."""
+    signature = []
+    for path in (CONFIG_FILE, KEYS_FILE):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
 
-            # Migrate old shop settings format
-            if migrate_shop_settings(settings):
-                settings_updated = True
+def _read_settings():
+    settings_updated = False
+    if os.path.exists(CONFIG_FILE):
+        logger.debug('Reading configuration file.')
+        with open(CONFIG_FILE, 'r') as yaml_file:
+            settings = yaml.safe_load(yaml_file)
 
-            # Remove obsolete keys from loaded settings
-            if remove_obsolete_keys(settings, DEFAULT_SETTINGS):
-                settings_updated = True
+        # Migrate old shop settings format
+        if migrate_shop_settings(settings):
+            settings_updated = True
 
-            # Merge default settings into loaded settings
-            if merge_dicts_recursive(DEFAULT_SETTINGS, settings):
-                settings_updated = True
+        # Remove obsolete keys from loaded settings
+        if remove_obsolete_keys(settings, DEFAULT_SETTINGS):
+            settings_updated = True
 
-        else:
-            settings = DEFAULT_SETTINGS
+        # Merge default settings into loaded settings
+        if merge_dicts_recursive(DEFAULT_SETTINGS, settings):
             settings_updated = True
 
-        if settings_updated:
-            with open(CONFIG_FILE, 'w') as yaml_file:
-                yaml.dump(settings, yaml_file)
-        
-        # Get Keys informations
-        valid_keys, missing_keys, corrupt_keys = load_keys()
-        settings['titles']['valid_keys'] = valid_keys
-        settings['titles']['missing_keys'] = missing_keys
-        settings['titles']['corrupt_keys'] = corrupt_keys
-        return settings
+    else:
+        settings = copy.deepcopy(DEFAULT_SETTINGS)
+        settings_updated = True
+
+    if settings_updated:
+        with open(CONFIG_FILE, 'w') as yaml_file:
+            yaml.dump(settings, yaml_file)
+    
+    # Get Keys informations
+    valid_keys, missing_keys, corrupt_keys = load_keys()
+    settings['titles']['valid_keys'] = valid_keys
+    settings['titles']['missing_keys'] = missing_keys
+    settings['titles']['corrupt_keys'] = corrupt_keys
+    return settings
+
+def load_settings():
+    """
+    Get the current settings. They are only read from settings.yaml when the file
+    or the keys file changed since the last call, otherwise a copy of the in-memory
+    snapshot is returned.
+    """
+    with settings_lock:
+        signature = _get_settings_files_signature()
+        if _settings_cache['settings'] is None or signature != _settings_cache['signature']:
+            _settings_cache['settings'] = _read_settings()
+            # Signature taken after reading, as settings.yaml may have been updated
+            _settings_cache['signature'] = _get_settings_files_signature()
+        return copy.deepcopy(_settings_cache['settings'])
+
+def save_settings(settings):
+    with settings_lock:
+        with open(CONFIG_FILE, 'w') as yaml_file:
+            yaml.dump(settings, yaml_file)
+        # Force a reload on next access, even if the file signature did not change
+        _settings_cache['settings'] = None
 
 def verify_settings(section, data):
     success = True
@@ -184,17 +222,13 @@ def add_library_path_to_settings(path):
     else:
         library_paths = [path]
     settings['library']['paths'] = library_paths
-    with settings_lock:
-        with open(CONFIG_FILE, 'w') as yaml_file:
-            yaml.dump(settings, yaml_file)
+    save_settings(settings)
     return success, errors
 
 def set_library_management_settings(data):
     settings = load_settings()
     settings['library']['management'].update(data)
-    with settings_lock:
-        with open(CONFIG_FILE, 'w') as yaml_file:
-            yaml.dump(settings, yaml_file)
+    save_settings(settings)
 
 def delete_library_path_from_settings(path):
     success = True
@@ -205,9 +239,7 @@ def delete_library_path_from_settings(path):
         if path in library_paths:
             library_paths.remove(path)
             settings['library']['paths'] = library_paths
-            with settings_lock:
-                with open(CONFIG_FILE, 'w') as yaml_file:
-                    yaml.dump(settings, yaml_file)
+            save_settings(settings)
         else:
             success = False
             errors.append({
@@ -220,9 +252,7 @@ def set_titles_settings(region, language):
     settings = load_settings()
     settings['titles']['region'] = region
     settings['titles']['language'] = language
-    with settings_lock:
-        with open(CONFIG_FILE, 'w') as yaml_file:
-            yaml.dump(settings, yaml_file)
+    save_settings(settings)
 
 def set_shop_settings(data):
     settings = load_settings()
@@ -238,13 +268,9 @@ def set_shop_settings(data):
         for client_name, client_data in data['clients'].items():
             settings['shop']['clients'][client_name].update(client_data)
 
-    with settings_lock:
-        with open(CONFIG_FILE, 'w') as yaml_file:
-            yaml.dump(settings, yaml_file)
+    save_settings(settings)
 
 def set_scheduler_settings(data):
     settings = load_settings()
     settings['scheduler'].update(data)
-    with settings_lock:
-        with open(CONFIG_FILE, 'w') as yaml_file:
-            yaml.dump(settings, yaml_file)
+    save_settings(settings)
@@ -0,0 +1,159 @@
+from constants import *
+from db import get_filtered_files, get_shop_file_entries, get_libraries
+from settings import load_settings
+from types import SimpleNamespace
+import threading
+import struct
+import mmap
+import json
+import os
+import logging
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+# Magic, format version, generation, index length
+HEADER = struct.Struct('<4sIQQ')
+MAGIC = b'OFSC'
+FORMAT_VERSION = 1
+
+class SharedCache:
+    """
+    Generation-stamped cache file shared by all Ownfoil processes.
+    The file holds a JSON index followed by binary sections, it is written by the leader
+    and atomically replaced, while readers map it read-only and remap it when replaced.
+    Every process thus shares the same copy through the page cache.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._current = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _get_current(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._current = None
+            return None
+
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        current = self._current
+        if current is not None and current.signature == signature:
+            return current
+
+        with self._lock:
+            if self._current is not None and self._current.signature == signature:
+                return self._current
+            try:
+                self._current = self._map(signature)
+            except Exception as e:
+                logger.error(f'Error loading shared cache {self.path}: {e}')
+                self._current = None
+            return self._current
+
+    def _map(self, signature):
+        with open(self.path, 'rb') as f:
+            if os.name == 'nt':
+                # A mapped file cannot be replaced on Windows
+                data = f.read()
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, generation, index_length = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('unsupported cache file format')
+        index = json.loads(bytes(data[HEADER.size:HEADER.size + index_length]))
+        logger.debug(f'Loaded shared cache generation {generation} with {len(index)} sections.')
+        return SimpleNamespace(
+            signature=signature,
+            data=data,
+            index=index,
+            generation=generation,
+            payload_offset=HEADER.size + index_length
+        )
+
+    @property
+    def generation(self):
+        """Generation of the current cache file, None if there is no usable cache."""
+        current = self._get_current()
+        return current.generation if current else None
+
+    def get(self, key):
+        """Get the bytes of a section, None if missing."""
+        current = self._get_current()
+        if current is None or key not in current.index:
+            return None
+        offset, length = current.index[key]
+        start = current.payload_offset + offset
+        return current.data[start:start + length]
+
+    def write(self, sections):
+        """Atomically replace the cache file with `sections`, a dict of key: bytes."""
+        with self._write_lock:
+            generation = (self.generation or 0) + 1
+            index = {}
+            offset = 0
+            for key, value in sections.items():
+                index[key] = (offset, len(value))
+                offset += len(value)
+            index_data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, generation, len(index_data)))
+                f.write(index_data)
+                for value in sections.values():
+                    f.write(value)
+            os.replace(tmp_path, self.path)
+            logger.debug(f'Shared cache generation {generation} written with {len(sections)} sections.')
+            return generation
+
+def encode_json(data):
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+# Library and shop indexes, see `update_shop_cache`
+shop_cache = SharedCache(SHOP_CACHE_FILE)
+
+def get_shop_files_key(content_filter=None):
+    return f'shop_files/{content_filter or ""}'
+
+def get_directory_listing_key(content_filter, path):
+    return f'directory/{content_filter or ""}/{path}'
+
+def build_directory_listings(files, library_paths):
+    """
+    Build the virtual directory listings of files relative to their library,
+    directories first then files at each level.
+    """
+    listings = {'': set()}
+    for file in files:
+        library_path = library_paths[file.library_id].rstrip('/')
+        parts = file.filepath[len(library_path):].lstrip('/').split('/')
+        for i, part in enumerate(parts):
+            directory = '/'.join(parts[:i])
+            is_directory = i < len(parts) - 1
+            listings.setdefault(directory, set()).add(part + '/' if is_directory else part)
+
+    return {
+        directory: sorted(items, key=lambda x: (not x.endswith('/'), x.lower()))
+        for directory, items in listings.items()
+    }
+
+def update_shop_cache(library):
+    """Write the generated library, shop files lists and directory listings of all content filters to the shared cache."""
+    sections = {
+        'library': encode_json({'total': len(library), 'games': library}),
+    }
+    library_paths = {l.id: l.path for l in get_libraries()}
+    decompressed_nsp = load_settings()['downloads']['decompressed_nsp']
+    for content_filter in [None] + list(APP_TYPE_FILTERS.keys()):
+        files = get_filtered_files(content_filter)
+        sections[get_shop_files_key(content_filter)] = encode_json(get_shop_file_entries(files, decompressed_nsp))
+        for directory, items in build_directory_listings(files, library_paths).items():
+            sections[get_directory_listing_key(content_filter, directory)] = encode_json(items)
+
+    try:
+        shop_cache.write(sections)
+    except Exception as e:
+        logger.error(f'Error writing shop cache: {e}')
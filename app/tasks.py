@@ -0,0 +1,49 @@
+from db import add_background_task, pop_background_tasks
+import logging
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+_task_handlers = {}
+# Whether this process runs the background services (watcher, scheduler and library pipeline)
+_local_tasks_enabled = False
+
+def register_task_handler(name, handler):
+    _task_handlers[name] = handler
+
+def set_local_tasks(enabled):
+    """Run submitted tasks directly, enabled while this process runs the background services."""
+    global _local_tasks_enabled
+    _local_tasks_enabled = enabled
+
+def submit_task(name, **kwargs):
+    """
+    Run a background task in the process running the background services.
+    From that process the task runs directly and its result is returned,
+    otherwise it is queued in the database and None is returned.
+    """
+    if _local_tasks_enabled:
+        return _run_task(name, kwargs)
+    add_background_task(name, kwargs)
+    logger.debug(f'Background task {name} queued.')
+
+def process_pending_tasks():
+    """Run the tasks queued by other processes, identical tasks are only run once."""
+    processed = []
+    for name, kwargs in pop_background_tasks():
+        if (name, kwargs) in processed:
+            continue
+        processed.append((name, kwargs))
+        _run_task(name, kwargs)
+    return len(processed)
+
+def _run_task(name, kwargs):
+    handler = _task_handlers.get(name)
+    if handler is None:
+        logger.error(f'Unknown background task {name}, skipping.')
+        return None
+    try:
+        return handler(**kwargs)
+    except Exception as e:
+        logger.error(f'Error running background task {name}: {e}')
+        return None
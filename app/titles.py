@@ -27,6 +27,7 @@ identification_in_progress_count = 0
 _titles_db_loaded = False
 _cnmts_db = None
 _titles_db = None
+_titles_db_by_id = None
 _versions_db = None
 _versions_txt_db = None
 
@@ -37,6 +38,9 @@ def getDirsAndFiles(path):
 
     for entry in entries:
         fullPath = os.path.join(path, entry)
+        if entry == TEMPORARY_DIRECTORY_NAME:
+            # Files being written by Ownfoil
+            continue
         if os.path.isdir(fullPath):
             allDirs.append(fullPath)
             dirs, files = getDirsAndFiles(fullPath)
@@ -138,6 +142,7 @@ def identify_appId(app_id):
 def load_titledb():
     global _cnmts_db
     global _titles_db
+    global _titles_db_by_id
     global _versions_db
     global _versions_txt_db
     global identification_in_progress_count
@@ -152,6 +157,10 @@ def load_titledb():
 
         with open(os.path.join(TITLEDB_DIR, titledb.get_region_titles_file(app_settings)), "r", encoding="utf-8") as f:
             _titles_db = json.load(f)
+        # Titles by ID, the first entry of each ID is used
+        _titles_db_by_id = {}
+        for title_info in _titles_db.values():
+            _titles_db_by_id.setdefault(title_info['id'], title_info)
 
         with open(os.path.join(TITLEDB_DIR, 'versions.json'), "r", encoding="utf-8") as f:
             _versions_db = json.load(f)
@@ -171,6 +180,7 @@ def load_titledb():
 def unload_titledb():
     global _cnmts_db
     global _titles_db
+    global _titles_db_by_id
     global _versions_db
     global _versions_txt_db
     global identification_in_progress_count
@@ -183,6 +193,7 @@ def unload_titledb():
     logger.info("Unloading TitleDBs from memory...")
     _cnmts_db = None
     _titles_db = None
+    _titles_db_by_id = None
     _versions_db = None
     _versions_txt_db = None
     _titles_db_loaded = False
@@ -307,7 +318,7 @@ def get_game_info(title_id):
         return None
 
     try:
-        title_info = [_titles_db[t] for t in list(_titles_db.keys()) if _titles_db[t]['id'] == title_id][0]
+        title_info = _titles_db_by_id[title_id]
         return {
             'name': title_info['name'],
             'bannerUrl': title_info['bannerUrl'],
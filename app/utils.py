@@ -1,11 +1,20 @@
 import logging
 import re
+import heapq
+import itertools
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 import json
 import os
 import tempfile
+from pathlib import Path
+from constants import TEMPORARY_DIRECTORY_NAME, TEMPORARY_FILE_SUFFIX
+
+# Retrieve main logger
+logger = logging.getLogger('main')
 
 # Global lock for all JSON writes in this process
 _json_write_lock = threading.Lock()
@@ -40,20 +49,96 @@ class FilterRemoveDateFromWerkzeugLogs(logging.Filter):
         return True
 
 
+class TimerHandle:
+    """Handle of a callback scheduled with `TimerService.schedule`."""
+    __slots__ = ('deadline', 'fn', 'args', 'kwargs', 'cancelled')
+
+    def __init__(self, deadline, fn, args, kwargs):
+        self.deadline = deadline
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class TimerService:
+    """Run callbacks at given deadlines from a single timer thread.
+    Pending timers are kept in a heap, the thread sleeps on a condition variable until the
+    earliest deadline or until an earlier timer is scheduled, and hands due callbacks
+    over to a bounded thread pool.
+    """
+    def __init__(self, max_workers=8, name='timer'):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._thread = None
+
+    def schedule(self, delay, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` in `delay` seconds. Returns a handle to cancel it."""
+        handle = TimerHandle(time.monotonic() + max(delay, 0), fn, args, kwargs)
+        with self._condition:
+            heapq.heappush(self._heap, (handle.deadline, next(self._counter), handle))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            elif self._heap[0][2] is handle:
+                # New earliest deadline, wake up the timer thread
+                self._condition.notify()
+        return handle
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    deadline, _, handle = self._heap[0]
+                    if handle.cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        heapq.heappop(self._heap)
+                        break
+                    self._condition.wait(timeout)
+            self._executor.submit(self._call, handle)
+
+    def _call(self, handle):
+        if handle.cancelled:
+            return
+        try:
+            handle.fn(*handle.args, **handle.kwargs)
+        except Exception as e:
+            logger.error(f'Error in timer callback {getattr(handle.fn, "__qualname__", handle.fn)}: {e}')
+
+# Timers shared by debounced functions and the job scheduler
+timer_service = TimerService()
+
 # Global registry for debounced function states
 # This ensures all decorator instances share the same state even across different imports
 _debounce_registry = {}
 _debounce_registry_lock = threading.Lock()
 
-def debounce(wait, key=None):
+def debounce(wait, key=None, merge=None):
     """Thread-safe decorator that postpones a function's execution until after `wait` seconds
-    have elapsed since the last time it was invoked. Only allows one execution at a time.
+    have elapsed since the last time it was invoked, with the arguments of the last call.
+    Only allows one execution at a time: if the delay elapses again during an execution,
+    a single execution is queued right after it.
     Uses a global registry to ensure state is shared across all imports and decorator instances.
+    A single timer per function is kept in the shared `timer_service`, further calls only push its deadline back.
+    The call waiting for its execution is dropped by `cancel()`, i.e. `fn.cancel()`.
     
     Args:
         wait: Number of seconds to wait before executing
         key: Optional string key to identify this function across different imports.
              If not provided, uses function qualname (may not work across module reloads).
+        merge: Optional function `merge(previous_call, call)` combining the `(args, kwargs)` of the calls
+               handled by a single execution. By default the arguments of the last call are used.
     """
     def decorator(fn):
         # Use provided key or fall back to qualname
@@ -64,37 +149,132 @@ def debounce(wait, key=None):
             if func_key not in _debounce_registry:
                 _debounce_registry[func_key] = {
                     'timer': None,
-                    'lock': threading.Lock(),
-                    'execution_lock': threading.Lock()
+                    'deadline': 0,
+                    'call': None,
+                    'running': False,
+                    'pending': False,
+                    'lock': threading.Lock()
                 }
-        
+        state = _debounce_registry[func_key]
+
+        def fire():
+            with state['lock']:
+                remaining = state['deadline'] - time.monotonic()
+                if remaining > 0:
+                    # Called again since the timer was scheduled
+                    state['timer'] = timer_service.schedule(remaining, fire)
+                    return
+                state['timer'] = None
+                if state['call'] is None:
+                    # Cancelled
+                    return
+                if state['running']:
+                    state['pending'] = True
+                    return
+                state['running'] = True
+                args, kwargs = state['call']
+                state['call'] = None
+
+            while True:
+                try:
+                    fn(*args, **kwargs)
+                except Exception as e:
+                    logger.exception(f'Error in debounced function {func_key}: {e}')
+                with state['lock']:
+                    if not state['pending']:
+                        state['running'] = False
+                        return
+                    # Run the queued execution, with the arguments of the calls made since the last one
+                    state['pending'] = False
+                    args, kwargs = state['call']
+                    state['call'] = None
+
         @wraps(fn)
         def debounced(*args, **kwargs):
-            state = _debounce_registry[func_key]
-            
-            def call_it():
-                # Acquire execution lock to ensure only one instance runs at a time
-                with state['execution_lock']:
-                    fn(*args, **kwargs)
-            
-            # Acquire lock to safely cancel old timer and start new one
             with state['lock']:
-                # Cancel existing timer if any
-                if state['timer'] is not None:
-                    state['timer'].cancel()
-                
-                # Create and start new timer
-                state['timer'] = threading.Timer(wait, call_it)
-                state['timer'].start()
-        
+                call = (args, kwargs)
+                if merge is not None and state['call'] is not None:
+                    # Not handled by an execution yet
+                    call = merge(state['call'], call)
+                state['call'] = call
+                state['deadline'] = time.monotonic() + wait
+                if state['timer'] is None:
+                    state['timer'] = timer_service.schedule(wait, fire)
+
+        def cancel():
+            """Drop the call waiting for its execution, an execution in progress is not interrupted"""
+            with state['lock']:
+                state['call'] = None
+                state['pending'] = False
+
+        debounced.cancel = cancel
         return debounced
     return decorator
 
+class TTLCache:
+    """Thread-safe mapping whose entries expire `ttl` seconds after being set.
+    The number of entries is bounded by `maxsize`, the oldest entries being evicted first.
+    Expired entries are purged lazily on access, so the structure never grows unbounded.
+    """
+    def __init__(self, ttl, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict() # key -> (expiry, value), ordered by expiry
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        while self._entries:
+            expiry, _ = next(iter(self._entries.values()))
+            if expiry > now:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._purge(time.monotonic())
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else default
+
+    def set(self, key, value):
+        with self._lock:
+            now = time.monotonic()
+            self._purge(now)
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def add(self, key, value):
+        """Set the entry only if the key is absent or expired. Returns True if the entry was set."""
+        with self._lock:
+            now = time.monotonic()
+            self._purge(now)
+            if key in self._entries:
+                return False
+            self._entries[key] = (now + self.ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            self._purge(time.monotonic())
+            return len(self._entries)
+
 # Global registry for throttled function states
 _throttle_registry = {}
 _throttle_registry_lock = threading.Lock()
 
-def throttle(wait, key_func=None):
+def throttle(wait, key_func=None, maxsize=10000):
     """Thread-safe decorator that ensures a function executes at most once per `wait` seconds
     per computed key. The first call within a window executes immediately; subsequent calls
     within the same window are silently ignored.
@@ -102,11 +282,15 @@ def throttle(wait, key_func=None):
     Unlike debounce (which delays the last call), throttle fires on the FIRST call and then
     suppresses further calls until the window expires.
 
+    Throttle windows are kept in a TTLCache: they are forgotten once expired, and at most
+    `maxsize` windows are tracked per function (the oldest being dropped first).
+
     Args:
         wait: Number of seconds to suppress duplicate calls after the first execution.
         key_func: Optional callable that receives the same arguments as the decorated function
                   and returns a hashable key used to distinguish independent throttle windows.
                   If not provided, all calls share a single window (no per-argument distinction).
+        maxsize: Maximum number of throttle windows tracked at the same time.
 
     Example:
         @throttle(60, key_func=lambda filepath, host: (filepath, host))
@@ -116,27 +300,20 @@ def throttle(wait, key_func=None):
     def decorator(fn):
         func_id = fn.__qualname__
 
+        with _throttle_registry_lock:
+            if func_id not in _throttle_registry:
+                _throttle_registry[func_id] = TTLCache(wait, maxsize)
+        windows = _throttle_registry[func_id]
+
         @wraps(fn)
         def throttled(*args, **kwargs):
-            now = time.monotonic()
-
             # Compute the per-call key
             if key_func is not None:
                 call_key = key_func(*args, **kwargs)
             else:
                 call_key = None
 
-            registry_key = (func_id, call_key)
-
-            with _throttle_registry_lock:
-                last_called = _throttle_registry.get(registry_key)
-                if last_called is None or (now - last_called) >= wait:
-                    _throttle_registry[registry_key] = now
-                    should_execute = True
-                else:
-                    should_execute = False
-
-            if should_execute:
+            if windows.add(call_key, True):
                 return fn(*args, **kwargs)
 
         return throttled
@@ -178,37 +355,23 @@ def merge_dicts_recursive(source, destination):
         # For this task, we only add missing keys.
     return changed
 
-def delete_empty_folders(path):
+def is_temporary_path(path):
+    """Whether a path is a file being written by Ownfoil, see TEMPORARY_DIRECTORY_NAME"""
+    return TEMPORARY_DIRECTORY_NAME in Path(path).parts or path.endswith(TEMPORARY_FILE_SUFFIX)
+
+def prune_empty_folders(directories, root):
     """
-    Recursively deletes empty folders starting from the given path.
-    Considers folders containing only hidden files as empty.
+    Delete the given directories if they are empty, then their parents as they become empty, up to `root` excluded.
+    Only the ancestors of `directories` are tried, with a single rmdir each, instead of walking the whole tree.
     """
-    if not os.path.isdir(path):
-        return
-
-    # Loop until no more empty directories are found and deleted in a pass
-    while True:
-        deleted_any_in_pass = False
-        # Traverse from bottom up to ensure child empty folders are deleted first
-        for dirpath, dirnames, filenames in os.walk(path, topdown=False):
-            # Check if the directory is truly empty (no subdirectories and no files)
-            if not dirnames and not filenames:
-                try:
-                    os.rmdir(dirpath)
-                    logging.getLogger('main').debug(f"Deleted empty directory: {dirpath}")
-                    deleted_any_in_pass = True
-                except OSError as e:
-                    logging.getLogger('main').error(f"Error deleting directory {dirpath}: {e}")
-        
-        # After a full pass, check if the root path itself is now empty and can be deleted
-        # This handles cases where the initial 'path' becomes empty after its children are removed
-        if not os.listdir(path) and os.path.isdir(path):
+    root = os.path.normpath(root)
+    # Deepest first, so that a parent is tried once its vacated subdirectories are removed
+    for directory in sorted({os.path.normpath(d) for d in directories}, key=lambda d: d.count(os.sep), reverse=True):
+        while directory.startswith(root + os.sep):
             try:
-                os.rmdir(path)
-                logging.getLogger('main').debug(f"Deleted empty root directory: {path}")
-                deleted_any_in_pass = True
-            except OSError as e:
-                logging.getLogger('main').error(f"Error deleting root directory {path}: {e}")
-
-        if not deleted_any_in_pass:
-            break # No more empty directories found in this pass, so we are done
+                os.rmdir(directory)
+            except OSError:
+                # Not empty, or already removed along with another vacated directory
+                break
+            logging.getLogger('main').debug(f"Deleted empty directory: {directory}")
+            directory = os.path.dirname(directory)
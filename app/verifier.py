@@ -0,0 +1,291 @@
+from constants import *
+from db import get_files_verification_keys, set_file_verification
+from decompression import PFS0_HEADER, PFS0_ENTRY, read_ncz_header, parse_ncz, read_nca
+from settings import load_settings
+from zstandard import ZstdError
+import threading
+import hashlib
+import struct
+import time
+import re
+import os
+import logging
+
+# Retrieve main logger
+logger = logging.getLogger('main')
+
+# Magic, number of files, string table size, reserved
+HFS0_HEADER = struct.Struct('<4sIII')
+# Data offset, size, name offset, hashed size, reserved, sha256 of the hashed region
+HFS0_ENTRY = struct.Struct('<QQII8s32s')
+# Offset of the XCI header magic, then offset and size of the root HFS0 partition
+XCI_MAGIC_OFFSET = 0x100
+XCI_ROOT_PARTITION_OFFSET = 0x130
+XCI_ROOT_PARTITION = struct.Struct('<QQ')
+# NCA files are named after the first half of their sha256
+NCA_HASH_NAME_REGEX = re.compile(r'^[0-9a-f]{32}$')
+
+class VerificationError(Exception):
+    """The file is truncated or its content does not match its hashes"""
+
+class VerificationInterrupted(Exception):
+    pass
+
+# Errors caused by the content of a file, recorded as a failed verification. Other errors (i.e. I/O errors) are not
+# recorded, the file is verified again at the next run.
+CORRUPTION_ERRORS = (VerificationError, ValueError, EOFError, struct.error, ZstdError)
+
+def get_verification_key(stat):
+    """Files are only verified again when their size or modification time changed"""
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+class RateLimiter:
+    """Limit reads to `rate` bytes per second on average, unlimited if 0. Raises VerificationInterrupted once `stopped` is set."""
+    def __init__(self, rate, stopped):
+        self.rate = rate
+        self.stopped = stopped
+        self._start = time.monotonic()
+        self._count = 0
+
+    def consume(self, count):
+        if self.stopped.is_set():
+            raise VerificationInterrupted()
+        if not self.rate:
+            return
+        self._count += count
+        delay = self._start + self._count / self.rate - time.monotonic()
+        if delay > 0:
+            self.stopped.wait(delay)
+        elif delay < -1:
+            # No credit for the time spent idle
+            self._start, self._count = time.monotonic(), 0
+
+class VerifiedFile:
+    """
+    File read sequentially through a RateLimiter. The data read is dropped from the page cache,
+    so that verifying the whole library does not evict the files being served.
+    """
+    def __init__(self, filepath, limiter):
+        self.f = open(filepath, 'rb', buffering=0)
+        self.limiter = limiter
+        self.size = os.fstat(self.f.fileno()).st_size
+        self._fadvise(0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+    def _fadvise(self, offset, length, advice):
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(self.f.fileno(), offset, length, getattr(os, advice))
+
+    def read(self, size=-1):
+        offset = self.f.tell()
+        data = self.f.read(size)
+        self.limiter.consume(len(data))
+        self._fadvise(offset, len(data), 'POSIX_FADV_DONTNEED')
+        return data
+
+    def read_exactly(self, size):
+        data = self.read(size)
+        if len(data) < size:
+            raise VerificationError(f'unexpected end of file at offset {self.f.tell()}')
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _read_chunks(f, offset, size):
+    f.seek(offset)
+    while size > 0:
+        data = f.read_exactly(min(VERIFICATION_CHUNK_SIZE, size))
+        size -= len(data)
+        yield data
+
+def _read_string_table(f, size):
+    table = f.read_exactly(size)
+    return lambda name_offset: table[name_offset:table.index(b'\0', name_offset)].decode('utf-8', errors='replace')
+
+def read_pfs0_entries(f, offset):
+    """Files of the PFS0 partition at `offset`, as (name, absolute offset, size, hashed size, hash)"""
+    f.seek(offset)
+    magic, file_count, string_table_size, _ = PFS0_HEADER.unpack(f.read_exactly(PFS0_HEADER.size))
+    if magic != b'PFS0':
+        raise VerificationError(f'no PFS0 header at offset {offset}')
+    entries = [PFS0_ENTRY.unpack(f.read_exactly(PFS0_ENTRY.size)) for _ in range(file_count)]
+    get_name = _read_string_table(f, string_table_size)
+    data_offset = offset + PFS0_HEADER.size + file_count * PFS0_ENTRY.size + string_table_size
+    return [(get_name(name_offset), data_offset + file_offset, size, 0, None) for file_offset, size, name_offset, _ in entries]
+
+def read_hfs0_entries(f, offset):
+    """Files of the HFS0 partition at `offset`, as (name, absolute offset, size, hashed size, hash)"""
+    f.seek(offset)
+    magic, file_count, string_table_size, _ = HFS0_HEADER.unpack(f.read_exactly(HFS0_HEADER.size))
+    if magic != b'HFS0':
+        raise VerificationError(f'no HFS0 header at offset {offset}')
+    entries = [HFS0_ENTRY.unpack(f.read_exactly(HFS0_ENTRY.size)) for _ in range(file_count)]
+    get_name = _read_string_table(f, string_table_size)
+    data_offset = offset + HFS0_HEADER.size + file_count * HFS0_ENTRY.size + string_table_size
+    return [(get_name(name_offset), data_offset + file_offset, size, hashed_size, sha256)
+            for file_offset, size, name_offset, hashed_size, _, sha256 in entries]
+
+def _check_bounds(f, name, offset, size):
+    if offset + size > f.size:
+        raise VerificationError(f'{name} is truncated, {offset + size - f.size} bytes missing')
+
+def _verify_hashed_region(f, name, offset, hashed_size, expected_hash):
+    """HFS0 entries store the sha256 of their first `hashed_size` bytes"""
+    if hashed_size and hashlib.sha256(b''.join(_read_chunks(f, offset, hashed_size))).digest() != expected_hash:
+        raise VerificationError(f'{name} header hash mismatch')
+
+def _verify_nca(f, name, offset, size):
+    """NCA and NCZ files are named after the sha256 of the NCA, NCZ files are decompressed to compute it"""
+    stem, extension = os.path.splitext(name.lower())
+    stem = stem.removesuffix('.cnmt')
+    if extension not in ('.nca', '.ncz') or not NCA_HASH_NAME_REGEX.match(stem):
+        return
+
+    if extension == '.ncz':
+        ncz, nca_size = read_ncz_header(f, offset)
+        data = read_nca(f, parse_ncz(ncz), offset, 0, nca_size)
+    else:
+        data = _read_chunks(f, offset, size)
+    sha256 = hashlib.sha256()
+    for chunk in data:
+        sha256.update(chunk)
+    if not sha256.hexdigest().startswith(stem):
+        raise VerificationError(f'{name} hash mismatch')
+
+def verify_file(filepath, limiter):
+    """
+    Check the structure of a library file, that none of its content is truncated and that
+    its NCA match their hashes. Raises VerificationError if the file is corrupted.
+    """
+    with VerifiedFile(filepath, limiter) as f:
+        extension = os.path.splitext(filepath)[1].lower()
+        if extension in ('.nsp', '.nsz'):
+            entries = read_pfs0_entries(f, 0)
+        elif extension in ('.xci', '.xcz'):
+            f.seek(XCI_MAGIC_OFFSET)
+            if f.read_exactly(4) != b'HEAD':
+                raise VerificationError('invalid XCI header')
+            f.seek(XCI_ROOT_PARTITION_OFFSET)
+            root_offset, _ = XCI_ROOT_PARTITION.unpack(f.read_exactly(XCI_ROOT_PARTITION.size))
+            entries = []
+            # Partitions (update, normal, secure...) of the root partition, whose headers are hashed
+            for name, offset, size, hashed_size, expected_hash in read_hfs0_entries(f, root_offset):
+                _check_bounds(f, name, offset, size)
+                _verify_hashed_region(f, name, offset, hashed_size, expected_hash)
+                entries += read_hfs0_entries(f, offset)
+        else:
+            return
+
+        # Truncated files are detected before reading their content
+        for name, offset, size, _, _ in entries:
+            _check_bounds(f, name, offset, size)
+        for name, offset, size, hashed_size, expected_hash in entries:
+            _verify_hashed_region(f, name, offset, hashed_size, expected_hash)
+            _verify_nca(f, name, offset, size)
+
+class Verifier:
+    """
+    Background integrity verification of the library files, when `verification` is enabled.
+    Files are verified again only when their size or modification time changed, see `get_verification_key`.
+    Files of each device are verified by a dedicated thread, reading at most `rate_limit` MiB/s.
+    """
+    def __init__(self, app):
+        self.app = app
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._current = {}  # device -> file being verified
+        self.thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name='verifier')
+        self.thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self.thread:
+            self.thread.join()
+
+    def request_run(self):
+        """Look for files to verify, i.e. after a library change"""
+        self._wake.set()
+
+    def get_status(self):
+        return {'current': list(self._current.values())}
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                settings = load_settings()['library']['verification']
+                if settings['enabled']:
+                    self._verify_pending_files(settings['rate_limit'] * 2**20)
+            except Exception as e:
+                logger.error(f'Error during library verification: {e}')
+            self._wake.wait(VERIFICATION_CHECK_INTERVAL)
+
+    def _verify_pending_files(self, rate):
+        with self.app.app_context():
+            files = get_files_verification_keys()
+
+        files_by_device = {}
+        for file_id, filepath, verification_key in files:
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            if get_verification_key(stat) != verification_key:
+                files_by_device.setdefault(stat.st_dev, []).append((file_id, filepath))
+        if not files_by_device:
+            return
+
+        logger.info(f'Verifying {sum(len(files) for files in files_by_device.values())} library files...')
+        threads = [
+            threading.Thread(target=self._verify_files, args=(device, files, rate), daemon=True, name=f'verifier-{device}')
+            for device, files in files_by_device.items()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _verify_files(self, device, files, rate):
+        limiter = RateLimiter(rate, self._stopped)
+        for file_id, filepath in files:
+            self._current[device] = filepath
+            try:
+                verification_key = get_verification_key(os.stat(filepath))
+                try:
+                    verify_file(filepath, limiter)
+                    verified, error = True, None
+                except VerificationInterrupted:
+                    return
+                except CORRUPTION_ERRORS as e:
+                    verified, error = False, str(e) or type(e).__name__
+                    logger.warning(f'{filepath} failed verification: {error}')
+
+                # Changed during its verification, verified again at the next run
+                if get_verification_key(os.stat(filepath)) != verification_key:
+                    continue
+                with self.app.app_context():
+                    set_file_verification(file_id, verification_key, verified, error)
+            except FileNotFoundError:
+                # Moved or removed, handled by the watcher
+                continue
+            except Exception as e:
+                logger.error(f'Error verifying {filepath}: {e}')
+            finally:
+                self._current.pop(device, None)
@@ -0,0 +1,7 @@
+"""
+WSGI entry point for the gunicorn worker processes started by `OWNFOIL_SERVER=gunicorn python app.py`.
+Workers only serve requests: the watcher, scheduler and library pipeline run in the leader process.
+"""
+from app import app, init_worker
+
+init_worker()
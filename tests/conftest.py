@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The application modules are imported from the app directory, as when running Ownfoil
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
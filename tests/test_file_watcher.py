@@ -0,0 +1,133 @@
+import os
+import time
+
+import pytest
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+
+from constants import TEMPORARY_DIRECTORY_NAME
+from file_watcher import Handler, Watcher
+from mover import get_temporary_path
+
+POLLING_INTERVAL = 0.05
+
+def wait_for_polls(count=5):
+    time.sleep(POLLING_INTERVAL * count)
+
+def write_file(path, size=16):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+
+def assert_nothing_ignored(handler):
+    assert not handler._ignored_by_src and not handler._ignored_by_dest
+
+@pytest.fixture
+def polled_library(tmp_path):
+    """Compact polled library, whose files known to the library are kept in `library`"""
+    library_path = str(tmp_path)
+    library = {}
+
+    def known_files(directory, recursive=False):
+        prefix = os.path.join(directory, '')
+        return {path: size for path, size in library.items()
+                if path.startswith(prefix) and (recursive or os.path.dirname(path) == directory)}
+
+    watcher = Watcher(lambda events: None, {'mode': 'polling', 'polling_interval': POLLING_INTERVAL, 'modes': {}}, known_files)
+    watcher.add_directory(library_path)
+    watcher.run()
+    wait_for_polls()
+    yield watcher, library, library_path
+    watcher.stop()
+
+def test_handler_forgets_internal_move_once_seen():
+    handler = Handler(lambda events: None)
+    handler.ignore_event('/games/a.nsp', '/games/b/a.nsp')
+
+    assert handler._is_ignored(FileMovedEvent('/games/a.nsp', '/games/b/a.nsp'))
+    assert_nothing_ignored(handler)
+    assert not handler._is_ignored(FileCreatedEvent('/games/b/a.nsp'))
+
+def test_handler_forgets_cross_device_move_once_seen():
+    # Registered as by `apply_organization_plan` once the rename failed across filesystems
+    handler = Handler(lambda events: None)
+    src, dest = '/games/a.nsp', '/other/b/a.nsp'
+    tmp = get_temporary_path(dest)
+    handler.ignore_event(src, dest)
+    handler.unignore_events([(src, dest)])
+    handler.ignore_events([(tmp, dest), (src, '')])
+
+    assert handler._is_ignored(FileMovedEvent(tmp, dest))
+    assert handler._is_ignored(FileDeletedEvent(src))
+    assert_nothing_ignored(handler)
+    assert not handler._is_ignored(FileCreatedEvent(dest))
+
+def test_compact_polling_does_not_keep_internal_moves_ignored(polled_library):
+    watcher, library, library_path = polled_library
+    src, dest = os.path.join(library_path, 'a.nsp'), os.path.join(library_path, 'b', 'a.nsp')
+    write_file(src)
+    os.makedirs(os.path.dirname(dest))
+    library[src] = 16
+    wait_for_polls()
+
+    # Organized by Ownfoil: the library is updated right after the move, before the next poll
+    watcher.ignore_moves([(src, dest)])
+    os.rename(src, dest)
+    library[dest] = library.pop(src)
+    wait_for_polls()
+
+    handler = watcher.event_handler
+    assert_nothing_ignored(handler)
+    assert not handler.tracked_files and not handler.deleted_files
+
+    # Then deleted and copied back by the user, which is reported
+    assert not handler._is_ignored(FileDeletedEvent(dest))
+    assert not handler._is_ignored(FileCreatedEvent(dest))
+    os.remove(dest)
+    wait_for_polls()
+    assert dest in handler.deleted_files
+
+def test_compact_polling_does_not_keep_compression_swap_ignored(polled_library):
+    watcher, library, library_path = polled_library
+    src, dest = os.path.join(library_path, 'a.nsp'), os.path.join(library_path, 'a.nsz')
+    tmp = os.path.join(library_path, TEMPORARY_DIRECTORY_NAME, 'a.nsz')
+    write_file(src)
+    write_file(tmp, 8)
+    library[src] = 16
+    wait_for_polls()
+
+    # Swapped as by `Compressor._swap`, the compressed file is written to a directory skipped by the poller
+    watcher.ignore_moves([(tmp, dest)])
+    os.rename(tmp, dest)
+    library[dest] = 8
+    del library[src]
+    watcher.ignore_deletes([src])
+    os.remove(src)
+    wait_for_polls()
+
+    handler = watcher.event_handler
+    assert_nothing_ignored(handler)
+    assert not handler.tracked_files and not handler.deleted_files
+
+def test_compact_polling_reports_deletion_after_internal_deletion(polled_library):
+    watcher, library, library_path = polled_library
+    path = os.path.join(library_path, 'update.nsp')
+    write_file(path)
+    library[path] = 16
+    wait_for_polls()
+
+    # Removed as by `remove_outdated_update_files`, along with its database entry
+    watcher.ignore_deletes([path])
+    os.remove(path)
+    del library[path]
+    wait_for_polls()
+    handler = watcher.event_handler
+    assert_nothing_ignored(handler)
+    assert not handler.deleted_files
+
+    # Put back then deleted by the user
+    write_file(path)
+    library[path] = 16
+    wait_for_polls()
+    os.remove(path)
+    wait_for_polls()
+    assert path in handler.deleted_files